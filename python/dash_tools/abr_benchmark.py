@@ -0,0 +1,245 @@
+"""Benchmark the ABR clients in client.py over many network traces.
+
+Every algorithm is simulated with abr_simulator for every trace in a
+directory and every buffer size, with the runs spread over worker
+processes. The QoE components the clients print (bitrate reward,
+rebuffer penalty and smoothness penalty) are collected per run and
+averaged per algorithm and buffer size into a summary table. The scripts
+in plots/ take the summary file as argument.
+
+Both the runs and the summary are written as CSV, or as JSON if the file
+name ends with .json.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2017, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import csv
+import json
+import multiprocessing
+from argparse import ArgumentParser
+
+import client
+from abr_simulator import ALGORITHMS, NetworkTrace, load_mpd, simulate
+
+TRACE_EXTENSIONS = ('.json', '.txt', '.log')
+
+RUN_FIELDS = ['algorithm', 'trace', 'buffer_size', 'bitrate_reward',
+              'rebuffer_penalty', 'smooth_penalty', 'qoe', 'average_qoe',
+              'average_bitrate', 'rebuffer_time', 'rebuffer_count',
+              'play_time', 'session_time', 'nr_segments', 'nr_downloads']
+
+# Metrics averaged over the runs. The components are also given per segment.
+SUMMARY_METRICS = ['bitrate_reward', 'rebuffer_penalty', 'smooth_penalty',
+                   'qoe', 'average_qoe', 'average_bitrate', 'rebuffer_time',
+                   'rebuffer_count', 'session_time']
+
+SUMMARY_FIELDS = (['algorithm', 'buffer_size', 'nr_runs'] + SUMMARY_METRICS +
+                  ['average_bitrate_reward', 'average_rebuffer_penalty',
+                   'average_smooth_penalty'])
+
+
+def available_algorithms():
+    "All algorithms, but Pensieve only if numpy is available."
+    return [a for a in sorted(ALGORITHMS) if a != 'pensieve' or client.np is not None]
+
+
+def find_traces(trace_dir):
+    "Find the trace files in trace_dir."
+    traces = [os.path.join(trace_dir, name) for name in sorted(os.listdir(trace_dir))
+              if os.path.splitext(name)[1] in TRACE_EXTENSIONS]
+    if not traces:
+        raise ValueError("No traces in %s" % trace_dir)
+    return traces
+
+
+def make_runs(mpd_path, algorithms, trace_files, buffer_sizes, gp=5,
+              segment_sizes=None):
+    "Make one run per algorithm, trace and buffer size."
+    return [(mpd_path, algorithm, trace_file, buffer_size, gp, segment_sizes)
+            for trace_file in trace_files
+            for buffer_size in buffer_sizes
+            for algorithm in algorithms]
+
+
+def run_simulation(run):
+    "Simulate one run. Return a dict with RUN_FIELDS."
+    mpd_path, algorithm, trace_file, buffer_size, gp, segment_sizes = run
+    metrics = simulate(algorithm, load_mpd(mpd_path),
+                       NetworkTrace.from_file(trace_file), buffer_size, gp,
+                       segment_sizes)
+    metrics.update({'algorithm': algorithm,
+                    'trace': os.path.basename(trace_file),
+                    'buffer_size': buffer_size})
+    return metrics
+
+
+def run_simulations(runs, workers=1):
+    "Simulate all runs, in a process pool if more than one worker."
+    nr_workers = min(workers, len(runs))
+    if nr_workers <= 1:
+        return [run_simulation(run) for run in runs]
+    pool = multiprocessing.Pool(nr_workers)
+    try:
+        results = pool.map(run_simulation, runs)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def summarize(results):
+    "Average the metrics per algorithm and buffer size."
+    groups = {}
+    for result in results:
+        groups.setdefault((result['algorithm'], result['buffer_size']), []).append(result)
+    summary = []
+    for (algorithm, buffer_size), group in sorted(groups.items()):
+        row = {'algorithm': algorithm, 'buffer_size': buffer_size,
+               'nr_runs': len(group)}
+        for metric in SUMMARY_METRICS:
+            row[metric] = sum(r[metric] for r in group) / float(len(group))
+        for component in ('bitrate_reward', 'rebuffer_penalty', 'smooth_penalty'):
+            row['average_' + component] = sum(r[component] / r['nr_segments']
+                                              for r in group) / len(group)
+        summary.append(row)
+    return summary
+
+
+def write_table(rows, fields, path):
+    "Write rows as JSON if path ends with .json, and as CSV otherwise."
+    with open(path, 'wb') as ofh:
+        if path.endswith('.json'):
+            json.dump(rows, ofh, indent=1, sort_keys=True)
+            return
+        writer = csv.DictWriter(ofh, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_summary(path):
+    "Read a summary written by write_table. CSV values are converted to numbers."
+    with open(path, 'rb') as ifh:
+        if path.endswith('.json'):
+            return json.load(ifh)
+        rows = list(csv.DictReader(ifh))
+    for row in rows:
+        for field in SUMMARY_FIELDS[1:]:
+            row[field] = float(row[field])
+        row['buffer_size'] = int(row['buffer_size'])
+        row['nr_runs'] = int(row['nr_runs'])
+    return rows
+
+
+def print_summary(summary):
+    "Print the summary table."
+    print("%-10s %6s %5s %9s %9s %9s %9s %9s" %
+          ("algorithm", "buffer", "runs", "bitrate", "rebuffer", "smooth",
+           "qoe", "avg_qoe"))
+    for row in summary:
+        print("%-10s %6d %5d %9.1f %9.2f %9.1f %9.1f %9.3f" %
+              (row['algorithm'], row['buffer_size'], row['nr_runs'],
+               row['bitrate_reward'], row['rebuffer_penalty'],
+               row['smooth_penalty'], row['qoe'], row['average_qoe']))
+
+
+def main():
+    parser = ArgumentParser(usage="usage: %(prog)s [options] mpdfile tracedir")
+
+    parser.add_argument("mpd_file", help="Static MPD file")
+
+    parser.add_argument("trace_dir", help="Directory with network traces")
+
+    parser.add_argument("-a", "--algorithm",
+                        dest="algorithms",
+                        action="append",
+                        choices=sorted(ALGORITHMS.keys()),
+                        help="ABR algorithm. Can be repeated (default all "
+                             "available)")
+
+    parser.add_argument("-s", "--buffer-size",
+                        dest="buffer_sizes",
+                        type=int,
+                        action="append",
+                        help="Buffer size in seconds. Can be repeated "
+                             "(default 20)")
+
+    parser.add_argument("-g", "--gp",
+                        dest="gp",
+                        type=float,
+                        default=5,
+                        help="The (gamma p) product in seconds for BOLA "
+                             "(default 5)")
+
+    parser.add_argument("--sizes",
+                        dest="sizes_file",
+                        default=None,
+                        help="JSON file with list of segment sizes per "
+                             "representation id")
+
+    parser.add_argument("-j", "--workers",
+                        dest="workers",
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of worker processes (default number of "
+                             "CPUs)")
+
+    parser.add_argument("-r", "--runs",
+                        dest="runs_file",
+                        default=None,
+                        help="Write the metrics of every run to this file")
+
+    parser.add_argument("-o", "--output",
+                        dest="summary_file",
+                        default="abr_summary.csv",
+                        help="Summary file for the plots "
+                             "(default abr_summary.csv)")
+
+    args = parser.parse_args()
+    segment_sizes = None
+    if args.sizes_file:
+        with open(args.sizes_file) as ifh:
+            segment_sizes = json.load(ifh)
+    algorithms = args.algorithms or available_algorithms()
+    if 'pensieve' in algorithms and client.np is None:
+        parser.error("pensieve needs numpy")
+    runs = make_runs(args.mpd_file, algorithms, find_traces(args.trace_dir),
+                     args.buffer_sizes or [20], args.gp, segment_sizes)
+    print("Running %d simulations with %d workers" % (len(runs), args.workers))
+    results = run_simulations(runs, args.workers)
+    if args.runs_file:
+        write_table(results, RUN_FIELDS, args.runs_file)
+    summary = summarize(results)
+    write_table(summary, SUMMARY_FIELDS, args.summary_file)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Offline simulation of the ABR clients in client.py over network traces.
+
+Instead of downloading over HTTP from a server shaped by tc, the clients
+fetch segments from a simulated network. The network follows a trace with
+piecewise constant bandwidth and latency, and a virtual clock advances by
+the time each download takes. Segment sizes come from the size_video
+tables in client.py for the video1-video6 representations of
+server/static/manifest.mpd, from a JSON file, or else from the
+representation bandwidth. Buffer accounting is done by
+videoplayer.VideoPlayer, just as for real downloads, so a session of a few
+minutes is simulated in milliseconds.
+
+Traces are either JSON lists like server/3G_trace.json with duration_ms,
+bandwidth_kbps and latency_ms, or text files with one "time_s
+bandwidth_mbps" pair per line, as the traces used for Pensieve.
+A trace is repeated if the session is longer than the trace.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2017, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import json
+from bisect import bisect_right
+from optparse import Values
+from argparse import ArgumentParser
+
+import client
+import staticmpdparser
+from httpio import FetchTiming
+
+DEFAULT_LATENCY = 0.08  # s, for traces without latency
+INIT_SEGMENT_SIZE = 1000  # bytes
+
+
+class NetworkTrace(object):
+    """Piecewise constant bandwidth and latency, repeated when it ends.
+
+    entries is a list of (duration_s, bandwidth_bps, latency_s)."""
+
+    def __init__(self, entries):
+        self.durations = [float(e[0]) for e in entries]
+        self.bandwidths = [float(e[1]) for e in entries]
+        self.latencies = [float(e[2]) for e in entries]
+        if min(self.durations) <= 0:
+            raise ValueError("Trace entries must have positive durations")
+        if max(self.bandwidths) <= 0:
+            raise ValueError("Trace has no bandwidth")
+        self.starts = []
+        start = 0.0
+        for duration in self.durations:
+            self.starts.append(start)
+            start += duration
+        self.period = start
+
+    @classmethod
+    def from_file(cls, path):
+        "Read a JSON trace or a text trace with time_s and bandwidth_mbps."
+        with open(path) as ifh:
+            data = ifh.read()
+        if data.lstrip().startswith('['):
+            return cls([(e['duration_ms'] * 0.001, e['bandwidth_kbps'] * 1000,
+                         e.get('latency_ms', DEFAULT_LATENCY * 1000) * 0.001)
+                        for e in json.loads(data)])
+        points = [[float(x) for x in line.split()[:2]]
+                  for line in data.splitlines() if line.strip()]
+        return cls([(t1 - t0, bw * 1e6, DEFAULT_LATENCY)
+                    for (t0, bw), (t1, _) in zip(points[:-1], points[1:])])
+
+    def locate(self, time):
+        "Return the entry index at time and the time into that entry."
+        time %= self.period
+        index = bisect_right(self.starts, time) - 1
+        return index, time - self.starts[index]
+
+    def transfer_time(self, start, nr_bytes):
+        "Time to download nr_bytes when starting at time start, including latency."
+        index, _ = self.locate(start)
+        time = start + self.latencies[index]
+        bits = nr_bytes * 8.0
+        while True:
+            index, offset = self.locate(time)
+            left = max(self.durations[index] - offset, 1e-9)
+            bandwidth = self.bandwidths[index]
+            if bandwidth * left >= bits:
+                time += bits / bandwidth
+                return time - start
+            bits -= bandwidth * left
+            time += left
+
+
+class SimulatedFetcher(object):
+    "Fetcher like common.Fetcher, but downloading from a SimulatedNetwork."
+
+    def __init__(self, network):
+        self.network = network
+        self.last_timing = None
+
+    def fetch(self, rep, number):
+        "Download a media segment. Return duration in seconds and size."
+        size = self.network.segment_size(rep, number)
+        latency = self.network.latency()
+        duration = self.network.download(size)
+        self.last_timing = FetchTiming(0.0, latency, duration - latency, duration, True)
+        return duration, size
+
+
+class SimulatedNetwork(object):
+    """Network following a NetworkTrace with a virtual clock.
+
+    segment_sizes maps representation id to a list of segment sizes in
+    bytes, starting at the startNumber."""
+
+    def __init__(self, trace, segment_sizes=None, start_time=0.0):
+        self.trace = trace
+        self.segment_sizes = segment_sizes or {}
+        self.now = start_time
+        self.nr_downloads = 0
+
+    def download(self, size):
+        "Download size bytes now and advance the clock. Return the duration."
+        duration = self.trace.transfer_time(self.now, size)
+        self.now += duration
+        self.nr_downloads += 1
+        return duration
+
+    def latency(self):
+        "Latency of a download started now."
+        index, _ = self.trace.locate(self.now)
+        return self.trace.latencies[index]
+
+    def segment_size(self, rep, number):
+        "Get size of a segment, using the bandwidth if not known."
+        sizes = self.segment_sizes.get(rep['id'])
+        index = number - rep['startNr']
+        if sizes is not None and 0 <= index < len(sizes):
+            return sizes[index]
+        return int(rep['bandwidth'] * rep['dur_s'] / 8)
+
+    def fetch_file(self, url):
+        "Fetch a file like common.fetch_file. The data is empty."
+        #pylint: disable=unused-argument
+        return "", self.download(INIT_SEGMENT_SIZE), INIT_SEGMENT_SIZE
+
+    def make_fetcher(self, file_writer):
+        #pylint: disable=unused-argument
+        return SimulatedFetcher(self)
+
+
+def default_segment_sizes():
+    "Segment sizes of video1 (highest) to video6 in client.py."
+    return dict(('video%d' % i, getattr(client, 'size_video%d' % i))
+                for i in range(1, 7))
+
+
+# Client class and download method per algorithm
+ALGORITHMS = {'abr': ('AbrClient', 'download'),
+              'bola': ('BolaClient', 'download'),
+              'bba0': ('BBAClient', 'download_bba0'),
+              'bba2': ('BBAClient', 'download_bba2'),
+              'pensieve': ('PensieveClient', 'download_pensieve')}
+
+
+class NullWriter(object):
+    "Discard everything written."
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def load_mpd(mpd_path):
+    "Parse a static MPD file."
+    with open(mpd_path) as ifh:
+        return staticmpdparser.StaticManifestParser(ifh.read()).mpd
+
+
+def qoe_metrics(abr_client, total_segments):
+    "Calculate the QoE metrics as printed by the clients, but as a dict."
+    player = abr_client.player
+    bitrate_reward = player.played_bitrate / 1000.0
+    rebuffer_penalty = client.REBUF_PENALTY * player.rebuffer_time / 1000.0
+    smooth_penalty = client.SMOOTH_PENALTY * abr_client.quality_switch / 1000.0
+    qoe = bitrate_reward - rebuffer_penalty - smooth_penalty
+    return {'bitrate_reward': bitrate_reward,
+            'rebuffer_penalty': rebuffer_penalty,
+            'smooth_penalty': smooth_penalty,
+            'qoe': qoe,
+            'average_qoe': qoe / total_segments,
+            'average_bitrate': player.played_bitrate / total_segments,
+            'rebuffer_time': player.rebuffer_time / 1000.0,
+            'rebuffer_count': player.rebuffer_event_count,
+            'play_time': player.total_play_time / 1000.0,
+            'nr_segments': total_segments}
+
+
+def simulate(algorithm, mpd, trace, buffer_size=20, gp=5, segment_sizes=None,
+             verbose=False):
+    """Run a client over a simulated network and return its QoE metrics.
+
+    mpd is a parsed static MPD and trace a NetworkTrace. Unless verbose,
+    the output of the client is discarded."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown algorithm %s" % algorithm)
+    class_name, method_name = ALGORITHMS[algorithm]
+    if segment_sizes is None:
+        segment_sizes = default_segment_sizes()
+    options = Values({'buffer_size': buffer_size, 'gp': gp, 'verbose': verbose,
+                      'bandwidth_changerscript_path': None})
+    network = SimulatedNetwork(trace, segment_sizes)
+    stdout = sys.stdout
+    if not verbose:
+        sys.stdout = NullWriter()
+    try:
+        abr_client = getattr(client, class_name)(mpd, "", "", options)
+        abr_client.network = network
+        getattr(abr_client, method_name)()
+    finally:
+        sys.stdout = stdout
+    if algorithm == 'pensieve':
+        total_segments = client.TOTAL_VIDEO_CHUNKS
+    else:
+        rep = abr_client.config.reps[0]
+        total_segments = rep['periodDuration'] / rep['dur_s']
+    metrics = qoe_metrics(abr_client, total_segments)
+    metrics['session_time'] = network.now
+    metrics['nr_downloads'] = network.nr_downloads
+    return metrics
+
+
+def main():
+    parser = ArgumentParser(usage="usage: %(prog)s [options] mpdfile "
+                                  "tracefile [tracefile ...]")
+
+    parser.add_argument("mpd_file", help="Static MPD file")
+
+    parser.add_argument("trace_files", nargs="+", help="Network traces")
+
+    parser.add_argument("-a", "--algorithm",
+                        dest="algorithms",
+                        action="append",
+                        choices=sorted(ALGORITHMS.keys()),
+                        help="ABR algorithm. Can be repeated (default abr)")
+
+    parser.add_argument("-s", "--buffer-size",
+                        dest="buffer_size",
+                        type=int,
+                        default=20,
+                        help="Buffer size in seconds (default 20)")
+
+    parser.add_argument("-g", "--gp",
+                        dest="gp",
+                        type=float,
+                        default=5,
+                        help="The (gamma p) product in seconds for BOLA "
+                             "(default 5)")
+
+    parser.add_argument("--sizes",
+                        dest="sizes_file",
+                        default=None,
+                        help="JSON file with list of segment sizes per "
+                             "representation id")
+
+    parser.add_argument("-v", "--verbose",
+                        action="store_true",
+                        dest="verbose",
+                        help="Show the output of the clients")
+
+    args = parser.parse_args()
+    mpd = load_mpd(args.mpd_file)
+    segment_sizes = None
+    if args.sizes_file:
+        with open(args.sizes_file) as ifh:
+            segment_sizes = json.load(ifh)
+    for trace_file in args.trace_files:
+        trace = NetworkTrace.from_file(trace_file)
+        for algorithm in args.algorithms or ['abr']:
+            metrics = simulate(algorithm, mpd, trace, args.buffer_size, args.gp,
+                               segment_sizes, args.verbose)
+            print("%s %-8s QoE %8.3f bitrate %7.1f kbps rebuffer %6.2fs "
+                  "(%d) session %6.1fs" %
+                  (trace_file, algorithm, metrics['average_qoe'],
+                   metrics['average_bitrate'] / 1000,
+                   metrics['rebuffer_time'], metrics['rebuffer_count'],
+                   metrics['session_time']))
+
+
+if __name__ == "__main__":
+    main()
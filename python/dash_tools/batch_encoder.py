@@ -4,6 +4,33 @@
 Supports H.264/AVC and H.265/HEVC + AAC.
 Config files shall be in JSON format, see examples provided at
 https://github.com/Dash-Industry-Forum/media-tools/tree/restructure-for-distribution-packaging/python/example_configs
+
+Jobs are weighted by their CPU cost (video and mux 1.0, audio 0.25, or the
+"weight" value of the variant) and started as long as the sum of the weights
+of the running jobs fits the CPU budget given by -p. A new job is started as
+soon as a running job exits.
+
+With -m, all variants of an infile are encoded by one ffmpeg process which
+decodes the input once and splits the video to one output per variant.
+Each variant still gets its own lock file and log file.
+
+With -c SECONDS, video jobs for long inputs are split into chunks of about
+SECONDS which are encoded in parallel. A chunk always starts at a segment
+boundary, so GoPs and segments come out as for a single encode. The chunks
+are concatenated without re-encoding, and it is checked with ffprobe that
+there is still a keyframe at the start of every GoP.
+
+With -q DBFILE, jobs are kept in an SQLite job queue with their state,
+attempts, exit code, start and end times and output size. A restart
+resumes from the queue without checking output files, and jobs of workers
+that died on this host are queued again. More workers can pull from the
+same queue by running with only -q DBFILE. SQLite locking must work for the
+DBFILE, which is not the case for all NFS setups.
+
+For every finished job, the wall time, CPU user and system time, max RSS,
+output size and achieved bitrate compared to the configured rate are
+recorded. With -s FILE, they are written as a JSON list if FILE ends with
+.json, and as CSV otherwise.
 """
 
 # The copyright in this software is being made available under the BSD License,
@@ -36,19 +63,40 @@ https://github.com/Dash-Industry-Forum/media-tools/tree/restructure-for-distribu
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import csv
+import errno
 from os.path import normpath, splitext
 from os.path import join as pathjoin
 from os.path import split as pathsplit
 import sys
+import shutil
+import socket
+import sqlite3
 import subprocess
 import time
 import json
+from math import ceil
 
 FFMPEG = 'ffmpeg'
+FFPROBE = 'ffprobe'
 MAX_NR_PROCESSES = 4
+MAX_ATTEMPTS = 3
+
+# CPU weight of a job per contentType, overridden by "weight" in the config
+JOB_WEIGHTS = {'video': 1.0, 'mux': 1.0, 'audio': 0.25, 'concat': 0.1}
+
+# Columns of the per-job resource summary
+# Exit code recorded for a concatenated video without keyframes at all GoP starts
+BAD_KEYFRAMES_EXIT_CODE = 200
+
+STATS_FIELDS = ('nr', 'outFile', 'name', 'contentType', 'exitCode', 'weight',
+                'wallTime', 'userTime', 'systemTime', 'maxRssKb', 'outputBytes',
+                'duration', 'bitrateKbps', 'targetKbps', 'bitrateRatio')
 
 INPUT = "-i %(inFile)s"
+CHUNK_INPUT = "-ss %(chunkStart).3f -t %(chunkDuration).3f -i %(inFile)s"
 OUTPUT = "-y %(outFile)s"
+CONCAT = "-f concat -safe 0 -i %(chunkList)s -c copy"
 
 # Audio filters are used as with the -af option. Can be concatenated with a ,
 AUDIO_FILTERS = {'monops' : "pan=stereo:c0<c0+c1:c1<c0+c1"}
@@ -97,18 +145,46 @@ def make_x265_options(video_values):
     out_string = "".join(options)
     return out_string % values
 
-def make_video_filter(job):
-    "Create a video filter_top_boxes string."
-    media_filter = ""
+def make_video_options(job):
+    "Make x265 options for hevc jobs and x264 options otherwise."
+    if job.get('codec', "") in ("hevc", "h265"):
+        return make_x265_options(job)
+    return make_x264_options(job)
+
+def make_video_filters(job):
+    "Make a list of the video filters for a job."
     filters = []
-    #print job
     for k in ("deinterlace", "resolution", "width"):
         if job.has_key(k):
             filters.append(VIDEO_FILTERS[k] % job)
+    return filters
+
+def make_video_filter(job):
+    "Create a video filter_top_boxes string."
+    media_filter = ""
+    filters = make_video_filters(job)
     if len(filters) > 0:
         media_filter = "-vf '%s'" % ",".join(filters)
     return media_filter
 
+def make_split_filter(video_jobs):
+    """Create a filter graph which decodes the video once and splits it.
+
+    The output for video_jobs[i] is labeled [vi]. Filters that are the same
+    for all jobs, like deinterlacing, are applied before the split."""
+    filter_lists = [make_video_filters(job) for job in video_jobs]
+    common = []
+    while all(filter_lists) and \
+            all(filters[0] == filter_lists[0][0] for filters in filter_lists):
+        common.append(filter_lists[0][0])
+        filter_lists = [filters[1:] for filters in filter_lists]
+    split = "split=%d%s" % (len(video_jobs), "".join("[s%d]" % i for i in
+                                                    range(len(video_jobs))))
+    graph = ["[0:v]%s" % ",".join(common + [split])]
+    for i, filters in enumerate(filter_lists):
+        graph.append("[s%d]%s[v%d]" % (i, ",".join(filters or ["null"]), i))
+    return ";".join(graph)
+
 def make_audio_filter(job):
     "Create an audio filter_top_boxes string."
     media_filter = ""
@@ -130,25 +206,287 @@ AUDIO_OPTIONS = " -metadata:s:a:0 language=%(language)s -b:a %(arate)dk -ar " \
 #AUDIO_OPTIONS = "-b:a %(arate)dk -ar 48000 -ac 2 -acodec libfdk_aac -profile:a aac_he_v2"
 #AUDIO_OPTIONS = "-strict -2 -c:a aac -b:a %(arate)dk -ar 48000 -ac 2"
 
+
+def job_weight(job):
+    "Get the CPU weight of a job."
+    if job['contentType'] == 'ladder':
+        return sum(job_weight(variant) for variant in job['variants'])
+    return float(job.get('weight', JOB_WEIGHTS.get(job['contentType'], 1.0)))
+
+def make_ladder_jobs(jobs):
+    "Group jobs per infile into ladder jobs, each run as one ffmpeg process."
+    ladders = []
+    ladder_of_infile = {}
+    for job in jobs:
+        if job['inFile'] not in ladder_of_infile:
+            ladder = {'inFile': job['inFile'], 'contentType': 'ladder',
+                      'variants': []}
+            ladder_of_infile[job['inFile']] = ladder
+            ladders.append(ladder)
+        ladder_of_infile[job['inFile']]['variants'].append(job)
+    for ladder in ladders:
+        ladder['outFile'] = ", ".join(v['outFile'] for v in ladder['variants'])
+    return ladders
+
+
+def exact_frame_rate(frame_rate):
+    "Return the exact frame rate for 29.97 and 59.94, and frame_rate otherwise."
+    for nominal, exact in ((29.97, 30000 / 1001.0), (59.94, 60000 / 1001.0)):
+        if abs(frame_rate - nominal) < 1e-8:
+            return exact
+    return float(frame_rate)
+
+def make_chunk_jobs(job, duration, chunk_duration):
+    """Split a video job into jobs for chunks of chunk_duration seconds.
+
+    The chunk duration is rounded up to whole segments. Return the chunk jobs
+    and a concat job for job['outFile']."""
+    seg_dur = job['segmentDurationMs'] * 0.001
+    chunk_dur = max(1, int(ceil(chunk_duration / seg_dur - 1e-9))) * seg_dur
+    nr_chunks = max(1, int(ceil(duration / chunk_dur - 1e-9)))
+    base = splitext(job['outFile'])[0]
+    concat_job = dict(job, contentType='concat', chunks=[],
+                      chunkList="%s_chunks.txt" % base)
+    for i in range(nr_chunks):
+        chunk_base = "%s_chunk%03d" % (base, i)
+        chunk_job = dict(job, outFile=chunk_base + '.mp4', lockFile=chunk_base + '.X',
+                         get_logfile=chunk_base + '.log', chunkStart=i * chunk_dur,
+                         chunkDuration=chunk_dur, concatJob=concat_job)
+        if i == nr_chunks - 1:  # Make sure to get the end
+            chunk_job['chunkDuration'] = duration - chunk_job['chunkStart'] + seg_dur
+        concat_job['chunks'].append(chunk_job)
+    concat_job['chunksLeft'] = nr_chunks
+    concat_job['chunksFailed'] = 0
+    return concat_job['chunks'], concat_job
+
+def get_media_duration(path):
+    "Get the duration in seconds of a media file using ffprobe."
+    output = subprocess.check_output([FFPROBE, '-v', 'error', '-show_entries',
+                                      'format=duration', '-of', 'json', path])
+    return float(json.loads(output)['format']['duration'])
+
+def get_video_packets(path):
+    "Get a list of (pts_time, is_keyframe) for the video packets of a file using ffprobe."
+    output = subprocess.check_output([FFPROBE, '-v', 'error', '-select_streams', 'v:0',
+                                      '-show_entries', 'packet=pts_time,flags',
+                                      '-of', 'json', path])
+    return [(float(packet['pts_time']), 'K' in packet['flags'])
+            for packet in json.loads(output)['packets']]
+
+def find_missing_keyframes(packets, gop_duration, frame_duration):
+    """Find the GoP start times without keyframe.
+
+    packets is a list of (pts_time, is_keyframe) and times are relative to
+    the first keyframe. Return the GoP numbers that lack a keyframe."""
+    key_times = sorted(pts for pts, is_key in packets if is_key)
+    if not key_times:
+        return [0]
+    start = key_times[0]
+    end = max(pts for pts, _ in packets) - start
+    gops_with_key = set()
+    for pts in key_times:
+        nr, offset = divmod(pts - start + 0.5 * frame_duration, gop_duration)
+        if offset < frame_duration:
+            gops_with_key.add(int(nr))
+    nr_gops = int(end // gop_duration) + 1
+    return [nr for nr in range(nr_gops) if nr not in gops_with_key]
+
+def check_keyframe_cadence(job):
+    "Check that the output of a video job has a keyframe at every GoP start."
+    frame_duration = 1.0 / exact_frame_rate(job['frameRate'])
+    missing = find_missing_keyframes(get_video_packets(job['outFile']),
+                                     job['gopLength'] * frame_duration,
+                                     frame_duration)
+    if missing:
+        sys.stderr.write("%s: No keyframe at start of GoPs %s\n" %
+                         (job['outFile'], missing[:10]))
+    return not missing
+
+
+def job_target_rate(job):
+    "Get the configured bitrate in kbps of a job, or None."
+    rates = {'video': ('vrate',), 'audio': ('arate',), 'mux': ('vrate', 'arate')}
+    keys = rates.get(job['contentType'], ())
+    if not keys or not all(key in job for key in keys):
+        return None
+    return sum(job[key] for key in keys)
+
+def make_job_stats(job, nr, exit_code, wall_time, rusage):
+    """Make a dict with the resource usage and output of a finished job.
+
+    rusage is from os.wait4, and includes the processes waited for by the
+    job shell. The achieved bitrate is only calculated for single outputs."""
+    variants = job.get('variants', [job])
+    output_bytes = sum(os.path.getsize(v['outFile']) for v in variants
+                       if os.path.exists(v['outFile']))
+    stats = dict.fromkeys(STATS_FIELDS)
+    stats.update({'nr': nr, 'outFile': job['outFile'], 'name': job.get('name'),
+                  'contentType': job['contentType'], 'exitCode': exit_code,
+                  'weight': job_weight(job), 'wallTime': wall_time,
+                  'userTime': rusage.ru_utime, 'systemTime': rusage.ru_stime,
+                  'maxRssKb': rusage.ru_maxrss, 'outputBytes': output_bytes,
+                  'targetKbps': job_target_rate(job)})
+    if exit_code == 0 and len(variants) == 1 and output_bytes > 0:
+        try:
+            stats['duration'] = get_media_duration(job['outFile'])
+        except (OSError, ValueError, KeyError, subprocess.CalledProcessError):
+            pass
+        if stats['duration']:
+            stats['bitrateKbps'] = output_bytes * 8 / (1000 * stats['duration'])
+            if stats['targetKbps']:
+                stats['bitrateRatio'] = stats['bitrateKbps'] / stats['targetKbps']
+    return stats
+
+def write_job_stats(job_stats, path):
+    "Write job statistics as JSON if path ends with .json, and as CSV otherwise."
+    with open(path, 'wb') as ofh:
+        if path.endswith('.json'):
+            json.dump(job_stats, ofh, indent=1, sort_keys=True)
+            return
+        writer = csv.DictWriter(ofh, STATS_FIELDS)
+        writer.writeheader()
+        writer.writerows(job_stats)
+
+
+def is_process_alive(pid):
+    "Check if a process with pid exists on this host."
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class JobQueue(object):
+    """Persistent SQLite queue of encoding jobs shared by workers.
+
+    A job is identified by its outFile and goes from queued to running and
+    then to done or failed. A failed job is queued again until it has been
+    tried max_attempts times."""
+
+    def __init__(self, db_path, max_attempts=MAX_ATTEMPTS):
+        self.db = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (out_file TEXT PRIMARY "
+                        "KEY, spec TEXT, weight REAL, state TEXT, attempts "
+                        "INTEGER, exit_code INTEGER, worker TEXT, start_time "
+                        "REAL, end_time REAL, output_size INTEGER)")
+        self.max_attempts = max_attempts
+        self.worker = "%s:%d" % (socket.gethostname(), os.getpid())
+
+    def add_jobs(self, jobs):
+        "Add jobs that are not already in the queue. Return number added."
+        nr_before = self.nr_jobs()
+        self.db.execute("BEGIN IMMEDIATE")
+        for job in jobs:
+            self.db.execute("INSERT OR IGNORE INTO jobs (out_file, spec, weight, "
+                            "state, attempts) VALUES (?, ?, ?, 'queued', 0)",
+                            (job['outFile'], json.dumps(job), job_weight(job)))
+        self.db.execute("COMMIT")
+        return self.nr_jobs() - nr_before
+
+    def recover(self):
+        "Queue again the running jobs of workers on this host that have died."
+        host = socket.gethostname()
+        self.db.execute("BEGIN IMMEDIATE")
+        rows = self.db.execute("SELECT out_file, worker FROM jobs WHERE "
+                               "state = 'running'").fetchall()
+        nr_recovered = 0
+        for out_file, worker in rows:
+            worker_host, pid = worker.rsplit(':', 1)
+            if worker_host == host and not is_process_alive(int(pid)):
+                self.db.execute("UPDATE jobs SET state = 'queued' WHERE "
+                                "out_file = ?", (out_file,))
+                nr_recovered += 1
+        self.db.execute("COMMIT")
+        return nr_recovered
+
+    def claim(self, max_weight=None):
+        """Claim the first queued job with weight up to max_weight.
+
+        Return the job, or None if there is none."""
+        self.db.execute("BEGIN IMMEDIATE")
+        if max_weight is None:
+            row = self.db.execute("SELECT out_file, spec FROM jobs WHERE state = "
+                                  "'queued' ORDER BY rowid LIMIT 1").fetchone()
+        else:
+            row = self.db.execute("SELECT out_file, spec FROM jobs WHERE state = "
+                                  "'queued' AND weight <= ? ORDER BY rowid "
+                                  "LIMIT 1", (max_weight,)).fetchone()
+        if row is not None:
+            self.db.execute("UPDATE jobs SET state = 'running', attempts = "
+                            "attempts + 1, worker = ?, start_time = ?, "
+                            "end_time = NULL, exit_code = NULL WHERE "
+                            "out_file = ?", (self.worker, time.time(), row[0]))
+        self.db.execute("COMMIT")
+        if row is None:
+            return None
+        return json.loads(row[1])
+
+    def finish(self, job, exit_code):
+        "Record the exit code and output size of a job."
+        output_size = 0
+        for variant in job.get('variants', [job]):
+            if os.path.exists(variant['outFile']):
+                output_size += os.path.getsize(variant['outFile'])
+        self.db.execute("BEGIN IMMEDIATE")
+        attempts = self.db.execute("SELECT attempts FROM jobs WHERE out_file = ?",
+                                   (job['outFile'],)).fetchone()[0]
+        if exit_code == 0:
+            state = 'done'
+        elif attempts < self.max_attempts:
+            state = 'queued'
+        else:
+            state = 'failed'
+        self.db.execute("UPDATE jobs SET state = ?, exit_code = ?, end_time = ?, "
+                        "output_size = ? WHERE out_file = ?",
+                        (state, exit_code, time.time(), output_size,
+                         job['outFile']))
+        self.db.execute("COMMIT")
+
+    def nr_jobs(self, state=None):
+        "Get the number of jobs, or of jobs in a state."
+        if state is None:
+            return self.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE state = ?",
+                               (state,)).fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
 class BatchEncoder(object):
     "Encode a batch of files."
     #pylint: disable=too-many-instance-attributes
 
-    def __init__(self, config, infiles, outdir, max_procs, max_jobs):
+    def __init__(self, config, infiles, outdir, max_procs, max_jobs,
+                 multi_output=False, chunk_duration=0, job_queue=None):
         self.config = config
         self.infiles = infiles
         self.outdir = outdir
         self.max_procs = max_procs
         self.max_jobs = max_jobs
+        self.multi_output = multi_output
+        self.chunk_duration = chunk_duration
+        self.job_queue = job_queue
         self.jobs = []
-        self.processes = []
+        self.queue = []
+        self.processes = {}  # pid -> (proc, job, nr, start_time)
         self.nr_jobs_started = 0
         self.nr_jobs_done = 0
+        self.nr_jobs_failed = 0
+        self.load = 0.0  # Sum of weights of running jobs
+        self.busy_time = 0.0  # Sum of weight * runtime of finished jobs
+        self.job_stats = []  # Resource usage of finished jobs
+        self.utilization = 0.0
 
     def make_joblist(self):
         """Make a list of jobs with all variants for all infiles and create outfile directories.
 
-        The in/out mapping is file.* > outdir/variant_name/provider/file.mp4."""
+        The in/out mapping is file.* > outdir/variant_name/provider/file.mp4.
+        With multi_output, there is one ladder job per infile. Otherwise, with
+        a chunk_duration, video jobs for longer infiles are split in chunks.
+        With a job_queue, the jobs are added to it with absolute paths, and
+        existing outfiles are not checked since the queue knows what is done."""
 
         def get_task_lock_file(out_filename):
             "Get task-lock filename."
@@ -158,50 +496,173 @@ class BatchEncoder(object):
             "Get logfile name"
             return "%s.log" % splitext(out_filename)[0]
 
-        for infile in self.infiles:
+        infiles, top_outdir = self.infiles, self.outdir
+        if self.job_queue is not None and infiles:
+            # Workers started in other directories claim the queued jobs
+            infiles = [os.path.abspath(infile) for infile in infiles]
+            top_outdir = os.path.abspath(top_outdir)
+        for infile in infiles:
             if not os.path.exists(infile):
                 print "Warning: infile %s does not exist. Skipping it" % infile
                 continue
             infile_base = splitext(pathsplit(infile)[1])[0]
             for variant in self.config:
-                outdir = normpath(pathjoin(self.outdir, infile_base))
+                outdir = normpath(pathjoin(top_outdir, infile_base))
                 if not os.path.exists(outdir):
                     os.makedirs(outdir)
                 outfile = pathjoin(outdir, variant['name'] + '.mp4')
                 taskfile = get_task_lock_file(outfile)
                 logfile = get_logfile(outfile)
-                if os.path.exists(taskfile) or (not os.path.exists(outfile)):
+                if (self.job_queue is not None or os.path.exists(taskfile) or
+                        not os.path.exists(outfile)):
                     job = {'inFile' : infile, 'outFile' : outfile, 'lockFile' : taskfile,
                            'get_logfile' : logfile}
                     job.update(variant)
                     self.jobs.append(job)
                     if len(self.jobs) == self.max_jobs:
                         break
-
-    def start_next_job(self):
-        "Start a new job as a process."
-        if self.nr_jobs_started >= len(self.jobs):
-            return
-        job = self.jobs[self.nr_jobs_started]
+        if self.multi_output:
+            self.jobs = make_ladder_jobs(self.jobs)
+        elif self.chunk_duration > 0:
+            self.jobs = self.make_chunked_jobs(self.jobs)
+        if self.job_queue is not None:
+            nr_added = self.job_queue.add_jobs(self.jobs)
+            print "Added %d new jobs to queue" % nr_added
+
+    def make_chunked_jobs(self, jobs):
+        "Replace video jobs for infiles longer than chunk_duration by chunk jobs."
+        chunked_jobs = []
+        durations = {}
+        for job in jobs:
+            if job['contentType'] == "video":
+                if job['inFile'] not in durations:
+                    durations[job['inFile']] = get_media_duration(job['inFile'])
+                duration = durations[job['inFile']]
+                if duration > self.chunk_duration:
+                    chunk_jobs, _ = make_chunk_jobs(job, duration, self.chunk_duration)
+                    chunked_jobs.extend(chunk_jobs)
+                    continue
+            chunked_jobs.append(job)
+        return chunked_jobs
+
+    def start_job(self, job):
+        "Start a job as a process."
         cmd_line = self.create_cmd(job)
-        file_handle = open(job['get_logfile'], "w")
+        variants = job.get('variants', [job])
+        file_handle = open(variants[0]['get_logfile'], "w")
         file_handle.write("CMD: %s\n\n" % cmd_line)
-        try:
-            os.unlink(job['lockFile'])
-        except OSError:
-            pass
-        open(job['lockFile'], "wb").write("running")
+        for variant in variants:
+            try:
+                os.unlink(variant['lockFile'])
+            except OSError:
+                pass
+            open(variant['lockFile'], "wb").write("running")
         proc = subprocess.Popen(cmd_line, shell=True, stdout=file_handle, stderr=file_handle)
+        file_handle.close()
         print ''
         print "> %s" % cmd_line
         self.nr_jobs_started += 1
-        self.processes.append((proc, job, self.nr_jobs_started))
+        self.processes[proc.pid] = (proc, job, self.nr_jobs_started, time.time())
+        self.load += job_weight(job)
         print "Started job %d for %s with pid=%d" % (self.nr_jobs_started, job['outFile'], proc.pid)
 
+    def start_jobs(self):
+        """Start queued jobs in order as long as they fit in the CPU budget.
+
+        A job heavier than the whole budget is started when nothing else runs."""
+        if self.job_queue is not None:
+            while True:
+                max_weight = None
+                if self.processes:
+                    max_weight = self.max_procs - self.load + 1e-9
+                job = self.job_queue.claim(max_weight)
+                if job is None:
+                    return
+                self.start_job(job)
+        for job in list(self.queue):
+            weight = job_weight(job)
+            if self.processes and self.load + weight > self.max_procs + 1e-9:
+                continue
+            self.queue.remove(job)
+            self.start_job(job)
+
+    def wait_for_job(self):
+        """Block until one of the jobs exits.
+
+        Return (proc, job, nr, runtime, rusage) with proc.returncode set."""
+        while True:
+            try:
+                pid, status, rusage = os.wait4(-1, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid in self.processes:
+                break
+        proc, job, nr, start_time = self.processes.pop(pid)
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        return proc, job, nr, time.time() - start_time, rusage
+
+    def finish_job(self, job):
+        "Remove the lock files of a job and copy a shared log to all variants."
+        variants = job.get('variants', [job])
+        for variant in variants[1:]:
+            shutil.copyfile(variants[0]['get_logfile'], variant['get_logfile'])
+        for variant in variants:
+            os.unlink(variant['lockFile'])
+
+    def check_output(self, job):
+        """Check the keyframe cadence of the output of a concat job.
+
+        A bad output is moved to outFile.bad so that it is not taken for a
+        finished variant. Return True if the output is OK."""
+        #pylint: disable=no-self-use
+        if job['contentType'] != 'concat' or check_keyframe_cadence(job):
+            return True
+        os.rename(job['outFile'], job['outFile'] + '.bad')
+        sys.stderr.write("%s: Bad keyframe cadence. Output moved to %s.bad\n" %
+                         (job['outFile'], job['outFile']))
+        return False
+
+    def job_done(self, job, ok):
+        """Handle chunks and concatenation when a job is done.
+
+        When all chunks of a video job are encoded, the concat job is put first
+        in the queue. When the concat job is done and its keyframes are OK, the
+        chunks are removed."""
+        concat_job = job.get('concatJob')
+        if concat_job is not None:
+            concat_job['chunksLeft'] -= 1
+            if not ok:
+                concat_job['chunksFailed'] += 1
+            if concat_job['chunksLeft'] == 0:
+                if concat_job['chunksFailed'] > 0:
+                    sys.stderr.write("%d chunks for %s failed. Not concatenating\n" %
+                                     (concat_job['chunksFailed'], concat_job['outFile']))
+                    return
+                with open(concat_job['chunkList'], 'w') as ofh:
+                    for chunk in concat_job['chunks']:
+                        ofh.write("file '%s'\n" % pathsplit(chunk['outFile'])[1])
+                self.queue.insert(0, concat_job)
+        elif job['contentType'] == 'concat' and ok:
+            print "%s: Keyframe cadence OK" % job['outFile']
+            for chunk in job['chunks']:
+                os.unlink(chunk['outFile'])
+            os.unlink(job['chunkList'])
+
     def create_cmd(self, job):
         "Create command line from dictionary of parameters."
         #pylint: disable=no-self-use
-        make_video_options = (job.get('codec', "") in ("hevc", "h265")) and make_x265_options or make_x264_options
+        if job['contentType'] == "ladder":
+            return self.create_ladder_cmd(job)
+        if job['contentType'] == "concat":
+            return "%s %s %s" % (FFMPEG, CONCAT % job, OUTPUT % job)
+        input_option = INPUT
+        if 'chunkStart' in job:
+            input_option = CHUNK_INPUT
         if job['contentType'] == "video":
             spec_options = "-an %s %s" % (make_video_filter(job), make_video_options(job))
         elif job['contentType'] == "audio":
@@ -209,46 +670,81 @@ class BatchEncoder(object):
         elif job['contentType'] == "mux":
             spec_options = "%s %s %s %s" %(make_video_filter(job), make_video_options(job),
                                            make_audio_filter(job), AUDIO_OPTIONS)
-        all_options = "%s %s %s" % (INPUT, spec_options, OUTPUT)
+        all_options = "%s %s %s" % (input_option, spec_options, OUTPUT)
         options = all_options % job
         cmd_line = "%s %s" % (FFMPEG, options)
         return cmd_line
 
+    def create_ladder_cmd(self, job):
+        "Create command line with one output per variant of a ladder job."
+        #pylint: disable=no-self-use
+        variants = job['variants']
+        video_jobs = [v for v in variants if v['contentType'] in ("video", "mux")]
+        parts = [FFMPEG, INPUT % job]
+        if video_jobs:
+            parts.append("-filter_complex '%s'" % make_split_filter(video_jobs))
+        for variant in variants:
+            if variant in video_jobs:
+                parts.append("-map '[v%d]'" % video_jobs.index(variant))
+                parts.append(make_video_options(variant))
+            if variant['contentType'] in ("audio", "mux"):
+                parts.append("-map 0:a:0")
+                parts.append(make_audio_filter(variant))
+                parts.append(AUDIO_OPTIONS % variant)
+            parts.append(OUTPUT % variant)
+        return " ".join(part for part in parts if part)
+
     def run_jobs(self):
-        "Run and monitor the jobs."
-        while True:
-            finished = []
-            running_now = 00
-            for (proc, job, nr) in self.processes:
-                proc.poll()
-                if proc.returncode is not None:
-                    finished.append((proc, job, nr))
-                    if proc.returncode != 0:
-                        sys.stderr.write("Job %d with output file %s failed (%d)\n"
-                                         % (nr, job['outFile'], proc.returncode))
-                    else:
-                        print("Job %d with output file %s succeeded" %
-                              (nr, job['outFile']))
-                else:
-                    running_now += 1
-            if len(finished) > 0:
-                self.nr_jobs_done += 1
-                print "%d jobs done" % self.nr_jobs_done
-                for finished_job in finished:
-                    proc, job, nr = finished_job
-                    os.unlink(job['lockFile'])
-                    self.processes.remove(finished_job)
-            if running_now < self.max_procs:
-                self.start_next_job()
-            if len(self.processes) == 0:
-                break
-            time.sleep(1)
-        print "All done!"
+        "Run the jobs and start new ones as soon as running jobs exit."
+        self.queue = self.jobs[self.nr_jobs_started:]
+        start_time = time.time()
+        self.start_jobs()
+        while self.processes:
+            proc, job, nr, runtime, rusage = self.wait_for_job()
+            weight = job_weight(job)
+            self.load -= weight
+            self.busy_time += weight * runtime
+            exit_code = proc.returncode
+            if exit_code == 0 and not self.check_output(job):
+                exit_code = BAD_KEYFRAMES_EXIT_CODE
+            stats = make_job_stats(job, nr, exit_code, runtime, rusage)
+            self.job_stats.append(stats)
+            if exit_code != 0:
+                self.nr_jobs_failed += 1
+                sys.stderr.write("Job %d with output file %s failed (%d)\n"
+                                 % (nr, job['outFile'], exit_code))
+            else:
+                print("Job %d with output file %s succeeded in %.1fs "
+                      "(cpu %.1fs, max rss %d kB)" %
+                      (nr, job['outFile'], runtime,
+                       stats['userTime'] + stats['systemTime'], stats['maxRssKb']))
+            self.finish_job(job)
+            if self.job_queue is not None:
+                self.job_queue.finish(job, exit_code)
+            self.job_done(job, exit_code == 0)
+            self.nr_jobs_done += 1
+            self.start_jobs()
+            print("%d jobs done, %d running (load %.2f of %d), %d queued" %
+                  (self.nr_jobs_done, len(self.processes), self.load,
+                   self.max_procs, self.get_nr_queued()))
+        wall_time = time.time() - start_time
+        if wall_time > 0:
+            self.utilization = self.busy_time / (self.max_procs * wall_time)
+        print("All done! %d jobs (%d failed) in %.1fs, CPU budget utilization %.0f%%" %
+              (self.nr_jobs_done, self.nr_jobs_failed, wall_time, 100 * self.utilization))
 
     def get_nr_jobs(self):
         "Get the number of jobs."
+        if self.job_queue is not None:
+            return self.job_queue.nr_jobs('queued')
         return len(self.jobs)
 
+    def get_nr_queued(self):
+        "Get the number of jobs waiting to be started."
+        if self.job_queue is not None:
+            return self.job_queue.nr_jobs('queued')
+        return len(self.queue)
+
 
 def validate_framerate_gop_segment_duration(json_data):
     """Validate that we can get exactly the segment duration that is asked for.
@@ -322,27 +818,57 @@ def main():
     "Main function to run the script."
     import optparse
     import sys
-    parser = optparse.OptionParser(usage='%prog [options] configfile infile1 [infile2 ....] outdir')
+    parser = optparse.OptionParser(usage='%prog [options] configfile infile1 [infile2 ....] outdir\n'
+                                         '       %prog [options] -q dbfile')
     parser.add_option('-j', action="store", dest="max_jobs", default=0, type="int")
     parser.add_option('-p', action="store", dest="max_procs", default=MAX_NR_PROCESSES, type="int",
-                      help='default is [%default]')
+                      help='CPU budget as sum of job weights (video 1, audio 0.25). '
+                           'default is [%default]')
+    parser.add_option('-m', action="store_true", dest="multi_output", default=False,
+                      help='encode all variants of an infile with one ffmpeg process')
+    parser.add_option('-c', action="store", dest="chunk_duration", default=0, type="float",
+                      help='encode video in parallel chunks of about this many seconds')
+    parser.add_option('-q', action="store", dest="queue_file", default=None,
+                      help='SQLite job queue file, created if missing')
+    parser.add_option('-s', action="store", dest="stats_file", default=None,
+                      help='write per-job resource usage to this file (.json or CSV)')
     options, args = parser.parse_args()
-    if len(args) < 3:
+    if len(args) < 3 and not (options.queue_file and len(args) == 0):
         print parser.print_help()
         sys.exit(1)
-    config_file = args[0]
-    config = parse_config(config_file)
-    infiles = args[1:-1]
-    print "infiles = %s" % infiles
-    outdir = args[-1]
-    encoder = BatchEncoder(config, infiles, outdir, options.max_procs, options.max_jobs)
+    job_queue = None
+    if options.queue_file:
+        if options.chunk_duration > 0:
+            parser.error("Chunked encoding (-c) cannot be used with a job queue (-q)")
+        job_queue = JobQueue(options.queue_file)
+        nr_recovered = job_queue.recover()
+        if nr_recovered > 0:
+            print "Queued %d jobs of dead workers again" % nr_recovered
+    if args:
+        config_file = args[0]
+        config = parse_config(config_file)
+        infiles = args[1:-1]
+        print "infiles = %s" % infiles
+        outdir = args[-1]
+    else:
+        config, infiles, outdir = [], [], None
+    encoder = BatchEncoder(config, infiles, outdir, options.max_procs, options.max_jobs,
+                           options.multi_output, options.chunk_duration, job_queue)
     encoder.make_joblist()
     nr_jobs = encoder.get_nr_jobs()
     if nr_jobs > 0:
         print "Created %d jobs" % nr_jobs
         encoder.run_jobs()
+        if options.stats_file:
+            write_job_stats(encoder.job_stats, options.stats_file)
     else:
         print "No jobs created"
+    if job_queue is not None:
+        print "Queue: %d done, %d failed, %d queued, %d running" % tuple(
+            job_queue.nr_jobs(state) for state in ('done', 'failed', 'queued', 'running'))
+        job_queue.close()
+    if encoder.nr_jobs_failed > 0:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -14,9 +14,11 @@ from collections import OrderedDict
 import os
 os.environ['CUDA_VISIBLE_DEVICES']=''
 
-import numpy as np
-import tensorflow as tf
-import a3c
+try:
+    import numpy as np
+except ImportError:
+    np = None
+import pensieve_model
 
 ## The following parameters are specific to Pensieve ABR
 S_INFO = 6  # bit_rate, buffer_size, rebuffering_time, bandwidth_measurement, chunk_til_video_end
@@ -25,7 +27,9 @@ A_DIM = 6
 ACTOR_LR_RATE = 0.0001
 CRITIC_LR_RATE = 0.001
 
-NN_MODEL = './pensieve_pretrained_models/pretrain_linear_reward.ckpt'
+# Actor weights exported from pretrain_linear_reward.ckpt by pensieve_model.py
+NN_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'pensieve_pretrained_models', 'pretrain_linear_reward.npz')
 DEFAULT_QUALITY = 0  # default video quality without agent
 M_IN_K = 1000.0
 MILLISECONDS_IN_SECOND = 1000.0
@@ -115,6 +119,27 @@ class Config:
 
 class Client:
 
+    # Simulated network used instead of HTTP and tc, see abr_simulator.py
+    network = None
+
+    def make_fetcher(self):
+        "Make the fetcher for media segments."
+        if self.network is not None:
+            return self.network.make_fetcher(self.file_writer)
+        return common.Fetcher(self.file_writer)
+
+    def start_bandwidth_changer(self):
+        "Start the script that makes the server follow a network trace."
+        if self.network is None:
+            os.system('%s &' % self.bandwidth_changerscript_path)
+
+    def transfer_time(self, fetcher, duration):
+        "Transfer time of the last segment, without connection setup and time to first byte."
+        timing = fetcher.last_timing
+        if timing is None or timing.transfer <= 0:
+            return duration
+        return timing.transfer
+
     def download_init_segment(self, config, file_writer):
         # 1. Find the lowest bit rate representation id
         lowQualIndex = config.getLowestBitRateIndex()
@@ -126,7 +151,10 @@ class Client:
         init_url = os.path.join(fetchObj['base_url'], initName)
         print 'Using bitrate ', config.reps[lowQualIndex]['bandwidth'], ' for initial segment'
         print 'init url', init_url
-        data, duration, size = common.fetch_file(init_url)
+        if self.network is not None:
+            data, duration, size = self.network.fetch_file(init_url)
+        else:
+            data, duration, size = common.fetch_file(init_url)
         file_writer.write_file(initName, data)
         return duration, size
 
@@ -191,16 +219,16 @@ class AbrClient(Client):
         throughput = 0
         # download init segment
         duration, size = self.download_init_segment(self.config, self.file_writer)
-        fetcher = common.Fetcher(self.file_writer)
+        fetcher = self.make_fetcher()
         res_bitrates = [self.bitrates[0] / 1000]
         startNumber = self.config.reps[0]['startNr'] 
-        os.system('%s &' % self.bandwidth_changerscript_path)
+        self.start_bandwidth_changer()
         # Download the first segment with lowest quality
         duration, size = self.download_video_segment(self.config, fetcher, startNumber)
         res_end_time = [duration]
         last_quality  = self.bitrates[0]
         # Re-calculate throughput and measure latency.
-        throughput = size/duration
+        throughput = size/self.transfer_time(fetcher, duration)
         #print size, duration, throughput
         # Add the lowest quality to the buffer for first segment
         self.player.buffer_contents += [0]
@@ -233,7 +261,7 @@ class AbrClient(Client):
             self.player.deplete_buffer(int(duration * 1000))
             self.player.buffer_contents += [quality]
             # Recalculate throughput
-            throughput = size*8/duration
+            throughput = size*8/self.transfer_time(fetcher, duration)
             cur_seg += 1
 
         self.player.deplete_buffer(self.player.get_buffer_level())
@@ -306,8 +334,8 @@ class BolaClient(Client):
     def download(self):
        # download init segment
        self.download_init_segment(self.config, self.file_writer)
-       fetcher = common.Fetcher(self.file_writer)
-       os.system('%s &' % self.bandwidth_changerscript_path)
+       fetcher = self.make_fetcher()
+       self.start_bandwidth_changer()
        res_bitrates = [self.bitrates[0] / 1000]
        # Download the first segment
        duration, size = self.download_video_segment(self.config, fetcher, 1)
@@ -466,8 +494,8 @@ class BBAClient(Client):
     def download_bba0(self):
         # download init segment
        self.download_init_segment(self.config, self.file_writer)
-       fetcher = common.Fetcher(self.file_writer)
-       os.system('%s &' % self.bandwidth_changerscript_path)
+       fetcher = self.make_fetcher()
+       self.start_bandwidth_changer()
        res_bitrates = [self.bitrates[0] / 1000]
        
        # Download the first segment
@@ -537,8 +565,8 @@ class BBAClient(Client):
     def download_bba2(self):
        # download init segment
        self.download_init_segment(self.config, self.file_writer)
-       fetcher = common.Fetcher(self.file_writer)
-       os.system('%s &' % self.bandwidth_changerscript_path)
+       fetcher = self.make_fetcher()
+       self.start_bandwidth_changer()
        res_bitrates = [self.bitrates[0] / 1000]
        # get average segment sizes.
        average_segment_sizes = self.get_average_segment_sizes()
@@ -616,19 +644,14 @@ class PensieveClient(Client):
         self.segment_time = self.config.reps[0]['dur_s']*1000
         self.bandwidth_changerscript_path = options.bandwidth_changerscript_path
         self.player = videoplayer.VideoPlayer(self.segment_time, self.utilities, self.bitrates)
-        self.sess = tf.Session()
+        if np is None:
+            raise ImportError("PensieveClient needs numpy")
         self.quality_switch =  0
-        self.actor = a3c.ActorNetwork(self.sess, state_dim=[S_INFO, S_LEN], action_dim=A_DIM, learning_rate=ACTOR_LR_RATE)
-        self.critic = a3c.CriticNetwork(self.sess, state_dim=[S_INFO, S_LEN], learning_rate=CRITIC_LR_RATE)
-
-        self.sess.run(tf.initialize_all_variables())
-        self.saver = tf.train.Saver()
 
         # restore neural net parameters
         self.nn_model = NN_MODEL
-        if self.nn_model is not None:  # nn_model is the path to file
-            self.saver.restore(self.sess, self.nn_model)
-            print("Model restored.")
+        self.actor = pensieve_model.ActorModel(self.nn_model, A_DIM)
+        print("Model restored.")
 
         self.init_action = np.zeros(A_DIM)
         self.init_action[DEFAULT_QUALITY] = 1
@@ -726,8 +749,8 @@ class PensieveClient(Client):
     def download_pensieve(self):
         # Download init segment
         self.download_init_segment(self.config, self.file_writer)
-        fetcher = common.Fetcher(self.file_writer)
-        os.system('%s &' % self.bandwidth_changerscript_path)
+        fetcher = self.make_fetcher()
+        self.start_bandwidth_changer()
         res_bitrates = [self.bitrates[0] / 1000]
 
         # Download the first segment
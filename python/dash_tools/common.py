@@ -1,27 +1,34 @@
 from threading import Thread, Lock
-import urllib2
 import urlparse
 import time
 import os
 import pdb
 
+import httpio
+
 CREATE_DIRS = True
 
-def fetch_file(url):
-    "Fetch a specific file via http and return as string."
-    try:
-        start_time = time.time()
-        data = urllib2.urlopen(url).read()
-        end_time = time.time()
-        size = len(data)
+def fetch_file_timing(url, pool=httpio.POOL):
+    """Fetch a specific file via http, reusing keep-alive connections.
+
+    Return the data as string and an httpio.FetchTiming."""
+    start_time = time.time()
+    status, data, timing = httpio.fetch(url, pool)
+    if status != 200:
+        print "ERROR HTTP %d for %s" % (status, url)
+    else:
         start_time_tuple = time.gmtime(start_time)
         start_string = time.strftime("%Y-%m-%d-%H:%M:%S", start_time_tuple)
-        print "%s  %.3fs for %8dB %s" % (start_string, end_time - start_time, size, url)
-    except urllib2.HTTPError, exc:
-        print "ERROR %s for %s" % (exc, url)
-        data = exc.read()
+        print "%s  %.3fs (connect %.3fs first byte %.3fs transfer %.3fs) for %8dB %s" % (
+            start_string, timing.total, timing.connect, timing.first_byte,
+            timing.transfer, len(data), url)
+    return data, timing
+
+def fetch_file(url):
+    "Fetch a specific file via http and return as string."
+    data, timing = fetch_file_timing(url)
     # Return a triplet from here
-    return data, end_time - start_time, size
+    return data, timing.total, len(data)
 
 class FileWriter(object):
     "File writer that handles standard file system."
@@ -81,6 +88,9 @@ Fetcher class downloads a specific segment of the given 'fetch' type
 class Fetcher():
     def __init__(self, file_writer):
         self.file_writer = file_writer
+        # Timing of the last fetch, for throughput estimates without
+        # connection setup and time to first byte
+        self.last_timing = None
 
     def spec_media(self, rep, number):
         "Return specific media path element."
@@ -95,7 +105,8 @@ class Fetcher():
     def fetch_media_segment(self, rep, number):
         "Fetch a media segment given its number."
         media_url = self.make_media_url(rep, number)
-        return fetch_file(media_url)
+        data, self.last_timing = fetch_file_timing(media_url)
+        return data, self.last_timing.total, len(data)
 
     def store_segment(self, data, rep, number):
         "Store the segment to file."
@@ -0,0 +1,329 @@
+"""HTTP input with keep-alive connection pooling, chunked streaming and range reads."""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import socket
+import httplib
+import urlparse
+from collections import namedtuple
+from threading import Lock
+
+CHUNK_SIZE = 188 * 1024
+BLOCK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Phases of a fetch in seconds. connect is 0 for a reused connection,
+# first_byte is from sending the request until the response headers arrived
+# and transfer is the time to read the body.
+FetchTiming = namedtuple('FetchTiming', 'connect first_byte transfer total reused')
+
+
+class HttpError(Exception):
+    "Unexpected HTTP response status."
+
+    def __init__(self, url, status, reason=''):
+        Exception.__init__(self, '%d %s for %s' % (status, reason, url))
+        self.url = url
+        self.status = status
+
+
+def timed_connect(conn):
+    "Connect an HTTP connection and return the time it took."
+    start = time.time()
+    conn.connect()
+    return time.time() - start
+
+
+class PooledResponse(object):
+    "An HTTP response that hands its connection back to the pool when done."
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.bytes_read = 0
+        self.reused = False
+        self.connect_time = 0.0
+        self.first_byte_time = 0.0
+        self.received = time.time()
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        "Release the connection. Only a fully read keep-alive response can be reused."
+        if self.conn is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool(object):
+    "Idle keep-alive connections per (scheme, host), safe to share between threads."
+
+    def __init__(self, timeout=10, max_idle_per_host=4, debuglevel=0):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.debuglevel = debuglevel
+        self.idle = {}
+        self.lock = Lock()
+        self.nr_connects = 0
+        self.nr_requests = 0
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        conn.set_debuglevel(self.debuglevel)
+        with self.lock:
+            self.nr_connects += 1
+        return conn
+
+    def acquire(self, key):
+        "Return (connection, reused)."
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self._connect(key), False
+
+    def release(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+    def request(self, url, method='GET', headers=None, max_redirects=MAX_REDIRECTS):
+        """Send a request, following redirects, and return a PooledResponse.
+
+        The connect and first byte times of the response are for the last
+        request if redirected."""
+        for _ in range(max_redirects + 1):
+            parts = urlparse.urlsplit(url)
+            key = (parts.scheme or 'http', parts.netloc)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            conn, reused = self.acquire(key)
+            connect_time = 0.0
+            if not reused:
+                connect_time = timed_connect(conn)
+            try:
+                start = time.time()
+                conn.request(method, path, headers=headers or {})
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection, try a fresh one
+                reused = False
+                conn = self._connect(key)
+                connect_time = timed_connect(conn)
+                start = time.time()
+                conn.request(method, path, headers=headers or {})
+                response = conn.getresponse()
+            with self.lock:
+                self.nr_requests += 1
+            pooled = PooledResponse(self, key, conn, response, url)
+            pooled.reused = reused
+            pooled.connect_time = connect_time
+            pooled.first_byte_time = pooled.received - start
+            if response.status in REDIRECT_CODES:
+                location = response.getheader('location')
+                pooled.read()
+                pooled.close()
+                if not location:
+                    raise HttpError(url, response.status, 'redirect without location')
+                url = urlparse.urljoin(url, location)
+                continue
+            return pooled
+        raise HttpError(url, response.status, 'too many redirects')
+
+
+POOL = ConnectionPool()
+
+
+def fetch(url, pool=POOL):
+    """Fetch url over a pooled keep-alive connection.
+
+    Return status, body and FetchTiming. Throughput estimated from the
+    transfer time does not include connection setup and server latency."""
+    start = time.time()
+    with pool.request(url) as response:
+        data = response.read()
+    end = time.time()
+    timing = FetchTiming(response.connect_time, response.first_byte_time,
+                         end - response.received, end - start, response.reused)
+    return response.status, data, timing
+
+
+def iter_chunks(url, chunk_size=CHUNK_SIZE, max_bytes=-1, pool=POOL):
+    "Generate the body of url in chunks of at most chunk_size bytes."
+    response = pool.request(url)
+    try:
+        if response.status != 200:
+            raise HttpError(url, response.status, response.response.reason)
+        while max_bytes != 0:
+            size = chunk_size if max_bytes < 0 else min(chunk_size, max_bytes)
+            data = response.read(size)
+            if not data:
+                break
+            max_bytes -= len(data)
+            yield data
+    finally:
+        response.close()
+
+
+class RangeReader(object):
+    """Read-only, sliceable view of a remote resource, fetched with Range requests.
+
+    Data is fetched in blocks of block_size bytes when sliced, so parsers that
+    only look at box headers transfer little more than those headers."""
+
+    def __init__(self, url, block_size=BLOCK_SIZE, pool=POOL):
+        self.url = url
+        self.block_size = block_size
+        self.pool = pool
+        self.blocks = {}
+        self.bytes_read = 0
+        self.nr_requests = 0
+        self.size = self._fetch_first_block()
+
+    def _fetch(self, start=None, end=None):
+        """Fetch bytes [start, end), or everything, and return (data, total size).
+
+        The total size is None if the server does not know it."""
+        headers = {}
+        if start is not None:
+            headers['Range'] = 'bytes=%d-%d' % (start, end - 1)
+        with self.pool.request(self.url, headers=headers) as response:
+            self.nr_requests += 1
+            data = response.read()
+            self.bytes_read += response.bytes_read
+            if response.status == 206:
+                content_range = response.getheader('content-range', '')
+                total = content_range.rsplit('/', 1)[-1]
+                return data, int(total) if total.isdigit() else None
+            if response.status == 200:
+                # No range support, the whole resource was returned
+                return data, len(data)
+            if response.status == 416:
+                return '', 0
+            raise HttpError(self.url, response.status, response.response.reason)
+
+    def _fetch_first_block(self):
+        data, size = self._fetch(0, self.block_size)
+        if size is None:
+            # Content-Range with unknown total (*), so get the whole resource
+            data, size = self._fetch()
+            if size is None:
+                raise HttpError(self.url, 206, 'unknown size')
+        if size == len(data) and size > self.block_size:
+            # Full body, keep it all
+            for i in range(0, size, self.block_size):
+                self.blocks[i // self.block_size] = data[i:i + self.block_size]
+        else:
+            self.blocks[0] = data
+        return size
+
+    def _load(self, first, last):
+        "Make sure blocks first to last are cached, fetching missing runs in one request each."
+        block = first
+        while block <= last:
+            if block in self.blocks:
+                block += 1
+                continue
+            run_end = block
+            while run_end + 1 <= last and run_end + 1 not in self.blocks:
+                run_end += 1
+            start = block * self.block_size
+            end = min((run_end + 1) * self.block_size, self.size)
+            data, _ = self._fetch(start, end)
+            for i in range(block, run_end + 1):
+                offset = (i - block) * self.block_size
+                self.blocks[i] = data[offset:offset + self.block_size]
+            block = run_end + 1
+
+    def read(self, offset, length):
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return ''
+        first = offset // self.block_size
+        last = (end - 1) // self.block_size
+        self._load(first, last)
+        data = ''.join(self.blocks[i] for i in range(first, last + 1))
+        start = offset - first * self.block_size
+        return data[start:start + end - offset]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step != 1:
+                raise ValueError('RangeReader does not support slice steps')
+            return self.read(start, stop - start)
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('RangeReader index out of range')
+        return self.read(index, 1)
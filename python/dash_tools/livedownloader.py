@@ -38,9 +38,9 @@ import sys
 import time
 from threading import Thread, Lock
 import signal
-import urllib2
 import urlparse
 
+import httpio
 import mpdparser
 
 CREATE_DIRS = True
@@ -80,18 +80,20 @@ class FileWriter(object):
 
 
 def fetch_file(url):
-    "Fetch a specific file via http and return as string."
-    try:
-        start_time = time.time()
-        data = urllib2.urlopen(url).read()
-        size = len(data)
-        end_time = time.time()
+    """Fetch a specific file via http and return as string.
+
+    The connections are kept alive in httpio.POOL, which is shared by all
+    FetchThreads."""
+    start_time = time.time()
+    status, data, timing = httpio.fetch(url)
+    if status != 200:
+        print "ERROR HTTP %d for %s" % (status, url)
+    else:
         start_time_tuple = time.gmtime(start_time)
         start_string = time.strftime("%Y-%m-%d-%H:%M:%S", start_time_tuple)
-        print "%s  %.3fs for %8dB %s" % (start_string, end_time - start_time, size, url)
-    except urllib2.HTTPError, exc:
-        print "ERROR %s for %s" % (exc, url)
-        data = exc.read()
+        print "%s  %.3fs (connect %.3fs first byte %.3fs transfer %.3fs) for %8dB %s" % (
+            start_string, timing.total, timing.connect, timing.first_byte,
+            timing.transfer, len(data), url)
     return data
 
 
@@ -150,6 +152,8 @@ class Fetcher(object):
 
     def start_fetch(self, number_segments=-1):
         "Start a fetch."
+        # Keep one idle connection per thread
+        httpio.POOL.max_idle_per_host = max(httpio.POOL.max_idle_per_host, len(self.fetches))
         for fetch in self.fetches:
             init_url = os.path.join(fetch['base_url'], fetch['init'])
             data = fetch_file(init_url)
@@ -1381,7 +1381,9 @@ class trun_box(full_box):
             (self.has_sample_size and 4) + (self.has_sample_flags and 4) + \
             (self.has_sample_composition_time_offset and 4)
         if self.has_sample_duration:
-            self.total_duration = sum([struct.unpack_from('>I', self.fmap, self.offset + self.sample_array_offset + i * self.sample_row_size)[0] for i in range(self.sample_count)])
+            start = self.offset + self.sample_array_offset
+            samples = self.fmap[start:start + self.sample_count * self.sample_row_size]
+            self.total_duration = sum([struct.unpack_from('>I', samples, i * self.sample_row_size)[0] for i in range(self.sample_count)])
         else:
             self.total_duration = self.parent.find('tfhd').default_sample_duration * self.sample_count
         # Note. One may need to go all the way to trex to find the default
@@ -1392,7 +1394,7 @@ class trun_box(full_box):
                       (self.has_sample_duration and 4) +
                       (self.has_sample_size and 4) +
                       (self.has_sample_flags and 4))
-            self.first_cto = struct.unpack_from('>i', self.fmap, offset)[0]  # Interpret as signed (works for version 0 (unsigned) as well)
+            self.first_cto = struct.unpack('>i', self.fmap[offset:offset+4])[0]  # Interpret as signed (works for version 0 (unsigned) as well)
 
         self.decoration += ' tdur:%d' % self.total_duration
 
@@ -2511,12 +2513,19 @@ class emsg_box(full_box):
         i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
         i.next() # prime
 
-        self.scheme_id_uri = read_string(i)
-        self.value = read_string(i)
-        self.timescale = i.send('>I')[0]
-        self.presentation_time_delta = i.send('>I')[0]
+        if self.version == 0:
+            self.scheme_id_uri = read_string(i)
+            self.value = read_string(i)
+            self.timescale = i.send('>I')[0]
+            self.presentation_time_delta = i.send('>I')[0]
+        else:
+            self.timescale = i.send('>I')[0]
+            self.presentation_time = i.send('>Q')[0]
         self.event_duration = i.send('>I')[0]
         self.id = i.send('>I')[0]
+        if self.version != 0:
+            self.scheme_id_uri = read_string(i)
+            self.value = read_string(i)
 
         self.message_data = []
         x = False
@@ -36,44 +36,44 @@ Displays the box hierarchy
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import sys
-import httplib
-import urlparse
 import optparse
 
 import mp4
+import httpio
 
-def fetch(url, key=None):
+def fetch(url, key=None, range_requests=True):
     if not url.startswith('http'):
         data = open(url, 'rb').read()
         print 'read data of length: {0}'.format(len(data))
         print '--'
+    elif range_requests:
+        # Only the byte ranges that the box parsers look at are transferred
+        print 'reading {0} with range requests...'.format(url)
+        data = httpio.RangeReader(url)
+        print 'remote size: {0}'.format(len(data))
+        print '--'
     else:
-        url_parts = urlparse.urlparse(url)
-        conn = httplib.HTTPConnection(url_parts.netloc)
-        conn.set_debuglevel(1)
-        conn.connect()
         print 'downloading {0}...'.format(url)
-        conn.request('GET', url_parts.path)
-        res = conn.getresponse()
-        
-        if res.status == 302:
-            return fetch(res.getheader('location'))
-        
+        chunks = list(httpio.iter_chunks(url))
+        data = ''.join(chunks)
         print '--'
-
-        data = res.read()
         print 'fetched data of length: {0}'.format(len(data))
         print '--'
 
-    if data:
-        root = mp4.mp4(data, len(data), key=key) 
+    if len(data):
+        root = mp4.mp4(data, len(data), key=key)
         print root.description()
     else:
         print data
+    if isinstance(data, httpio.RangeReader):
+        print '--'
+        print 'transferred {0} bytes in {1} range requests'.format(data.bytes_read, data.nr_requests)
 
 def main():
     parser = optparse.OptionParser(usage='%prog <file path>|<http url>')
     parser.add_option('-v', '--verbose', help='increase verbosity', action='count', default=1)
+    parser.add_option('-F', '--full-download', help='download the whole resource instead of using range requests',
+                      action='store_false', default=True, dest='range_requests')
     (opts, args) = parser.parse_args()
     
     if not args:
@@ -88,7 +88,7 @@ def main():
         with open(args[1]) as f:
             key = f.read()
             key = [ord(c) for c in key]
-    fetch(args[0], key)
+    fetch(args[0], key, opts.range_requests)
 
 if __name__=='__main__':
     main()
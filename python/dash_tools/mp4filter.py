@@ -54,6 +54,7 @@ class MP4Filter(object):
         else:
             self.data = data
         self.output = ""
+        self.keep_output = True # Set to False if only filterbox side effects are needed
         self.relevant_boxes = [] # Boxes at top-level to filter_top_boxes
         self.top_level_boxes = []  # List of top_level boxes (size, type)
         #print "MP4Filter with %s" % file_name
@@ -67,18 +68,20 @@ class MP4Filter(object):
 
     def filter_top_boxes(self):
         "Top level box parsing. The lower-level parsing is done in self.filterbox(). "
-        self.output = ""
+        output_parts = []
+        output_size = 0
         pos = 0
         while pos < len(self.data):
             size, box_type = self.check_box(self.data[pos:pos + 8])
             self.top_level_boxes.append((size, box_type))
             box_data = self.data[pos:pos+size]
             if box_type in self.relevant_boxes:
-                self.output += self.filterbox(box_type, box_data,
-                                              len(self.output))
-            else:
-                self.output += box_data
+                box_data = self.filterbox(box_type, box_data, output_size)
+            if self.keep_output:
+                output_parts.append(box_data)
+            output_size += len(box_data)
             pos += size
+        self.output = "".join(output_parts)
         self.finalize()
         return self.output
 
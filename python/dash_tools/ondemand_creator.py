@@ -2,8 +2,13 @@
 
 Intended to be used as a second step after batch_encoder.py with the
 same configuration file.
-Uses MP4Box to create the initial DASH OnDemand asset, but improves it
-in a second step by resegmenting the audio to correct average segment duration.
+By default, the tracks are packaged natively by ondemand_packager.py, which
+writes CMAF tracks with sidx and the MPD directly. Video segments start at
+sync samples and audio segments get the correct average segment duration.
+
+With --mp4box, MP4Box is used to create the initial DASH OnDemand asset,
+which is then improved in a second step by resegmenting the audio to correct
+average segment duration.
 
 Configuration is JSON file input and same as for batch_encoder.py, but only
 segmentDurationMs and the variant names are used.
@@ -27,17 +32,25 @@ One can therefore make a minimal configuration like:
 
 If languages are in the mdhd box they will be extracted automatically.
 
+The per-track steps (native packaging, or audio resegmentation and the
+sidx fix-up after MP4Box) are run in a pool of worker processes.
+The number of workers is set by --jobs and defaults to the number of CPUs.
+The MPD is written (or patched) once at the end.
+
 """
 import os
 import sys
 import json
+import time
 import subprocess
+import multiprocessing
 from cStringIO import StringIO
 from xml import sax
 from xml.sax import handler, saxutils, xmlreader
 from argparse import ArgumentParser
 
 from track_resegmenter import TrackResegmenter
+from ondemand_packager import package_track, write_mpd
 from backup_handler import make_backup, BackupError
 
 MP4BOX = "MP4Box"  # path to MP4Box of late-enough version.
@@ -54,6 +67,17 @@ def check_mp4box_version():
     return None
 
 
+def resegment_track(job):
+    """Resegment a track file in place and return (sidx_range, seconds).
+
+    Module-level function, so that it can be run in a worker process."""
+    file_name, dur_ms = job
+    start = time.time()
+    resegmenter = TrackResegmenter(file_name, dur_ms, file_name)
+    resegmenter.resegment()
+    return resegmenter.sidx_range, time.time() - start
+
+
 class MPDSidxFilter(saxutils.XMLFilterBase):
     "Filter that changes the indexRange for sidx box in MPD given dict."
 
@@ -92,11 +116,16 @@ class DashOnDemandCreator(object):
 
     Also fix audio segment durations to agree with video."""
 
-    def __init__(self, config_file, directory, mpd_file_name):
+    def __init__(self, config_file, directory, mpd_file_name, workers=None,
+                 use_mp4box=False):
         self.directory = directory
         self.mpd_name = mpd_file_name
+        self.workers = workers or multiprocessing.cpu_count()
+        self.use_mp4box = use_mp4box
         self.tracks = {'video': [], 'audio': []}
         self.segment_duration_ms = None
+        self.timings = []
+        self.track_timings = []
         self._parse_config_file(config_file)
 
     def _parse_config_file(self, config_file):
@@ -116,12 +145,50 @@ class DashOnDemandCreator(object):
 
     def process(self):
         "Process the actual media and create DASH OnDemand content."
-        self.segment_media(self.tracks, self.segment_duration_ms)
-        sidx_ranges = self.resegment_audio_tracks(self.tracks,
-                                                  self.segment_duration_ms)
-        print "New sidx ranges %s" % sidx_ranges
+        self.timings = []
+        self.track_timings = []
         mpd_path = self.file_path(self.mpd_name)
-        self.fix_sidx_ranges_in_mpd(mpd_path, sidx_ranges)
+        if self.use_mp4box:
+            self._timed("segment", self.segment_media, self.tracks,
+                        self.segment_duration_ms)
+            sidx_ranges = self._timed("resegment", self.resegment_audio_tracks,
+                                      self.tracks, self.segment_duration_ms)
+            print "New sidx ranges %s" % sidx_ranges
+            self._timed("mpd", self.fix_sidx_ranges_in_mpd, mpd_path,
+                        sidx_ranges)
+        else:
+            representations = self._timed("package", self.package_tracks,
+                                          self.tracks, self.segment_duration_ms)
+            self._timed("mpd", write_mpd, mpd_path, representations,
+                        self.segment_duration_ms / 1000.0)
+        self.print_timings()
+
+    def _timed(self, stage, func, *args):
+        "Run func(*args) and record the wall clock time for stage."
+        start = time.time()
+        result = func(*args)
+        self.timings.append((stage, time.time() - start))
+        return result
+
+    def print_timings(self):
+        for stage, seconds in self.timings:
+            print "%-20s %8.2fs" % (stage, seconds)
+        print "%-20s %8.2fs" % ("total", sum(t[1] for t in self.timings))
+        for track, seconds in self.track_timings:
+            print "  %-18s %8.2fs" % (track, seconds)
+
+    def run_jobs(self, func, jobs):
+        "Run func for each job, in a process pool if more than one worker."
+        nr_workers = min(self.workers, len(jobs))
+        if nr_workers <= 1:
+            return [func(job) for job in jobs]
+        pool = multiprocessing.Pool(nr_workers)
+        try:
+            results = pool.map(func, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        return results
 
     def segment_media(self, tracks, dur_ms):
         "Call MP4Box to segment the media."
@@ -144,14 +211,26 @@ class DashOnDemandCreator(object):
     def file_path(self, name):
         return os.path.join(self.directory, name)
 
+    def package_tracks(self, tracks, dur_ms):
+        "Package all tracks in parallel and return their Representations."
+        names = tracks['video'] + tracks['audio']
+        jobs = [(track, self.file_path('{0}.mp4'.format(track)),
+                 self.file_path('{0}_dashinit.mp4'.format(track)), dur_ms)
+                for track in names]
+        results = self.run_jobs(package_track, jobs)
+        self.track_timings.extend((track, seconds) for track, (_, seconds)
+                                  in zip(names, results))
+        return [rep for rep, _ in results]
+
     def resegment_audio_tracks(self, tracks, dur_ms):
+        "Resegment all audio tracks in parallel and return new sidx ranges."
+        jobs = [(self.file_path('{0}_dashinit.mp4'.format(track)), dur_ms)
+                for track in tracks['audio']]
+        results = self.run_jobs(resegment_track, jobs)
         sidx_ranges = {}
-        for track in tracks['audio']:
-            file_name = self.file_path('{0}_dashinit.mp4'.format(track))
-            # out_name = '{0}_dashout.mp4'.format(track)
-            resegmenter = TrackResegmenter(file_name, dur_ms, file_name)
-            resegmenter.resegment()
-            sidx_ranges[track] = resegmenter.sidx_range
+        for track, (sidx_range, seconds) in zip(tracks['audio'], results):
+            self.track_timings.append((track, seconds))
+            sidx_ranges[track] = sidx_range
         return sidx_ranges
 
     def _fix_sidx_ranges(self, input_file, output, sidx_for_representations):
@@ -204,6 +283,20 @@ def main():
                         default="manifest.mpd",
                         help="DASH Ondemand MPD file name")
 
+    parser.add_argument("-j", "--jobs",
+                        action="store",
+                        dest="jobs",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes for per-track "
+                             "work (default: number of CPUs)")
+
+    parser.add_argument("--mp4box",
+                        action="store_true",
+                        dest="use_mp4box",
+                        help="Segment with MP4Box instead of the native "
+                             "packager")
+
     parser.add_argument("-v", "--verbose",
                         action="store_true",
                         dest="verbose",
@@ -212,7 +305,8 @@ def main():
     args = parser.parse_args()
 
     dc = DashOnDemandCreator(args.config_file, args.directory,
-                             args.manifest_filename)
+                             args.manifest_filename, args.jobs,
+                             args.use_mp4box)
     dc.process()
 
 
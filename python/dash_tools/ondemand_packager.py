@@ -0,0 +1,605 @@
+"""Package progressive MP4 tracks as DASH OnDemand CMAF tracks with an MPD.
+
+Native replacement for MP4Box -dash -profile onDemand on the output of
+batch_encoder.py. Each single-track progressive MP4 file is converted into
+a CMAF track file with header (ftyp + moov with mvex), sidx, and one
+moof/mdat fragment per segment. Video segments start at the sync sample
+closest to each segment boundary and audio segments are cut by accumulated
+duration, just like track_resegmenter.py does. The sample data is copied
+range by range from the input file, so it is never held in memory.
+
+The MPD has one AdaptationSet for the video and one per audio language and
+codec, with SegmentBase indexRange pointing at the sidx of each track.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2017, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from array import array
+from collections import namedtuple, OrderedDict
+from fractions import Fraction
+from xml.sax.saxutils import escape
+
+from structops import str_to_uint16, str_to_uint32, uint32_to_str
+from track_data_extractor import TrackDataExtractor, SampleTable
+from track_resegmenter import TrackResegmenter
+
+SYNC_SAMPLE_FLAGS = 0x2000000  # Does not depend on other samples
+NON_SYNC_SAMPLE_FLAGS = 0x1010000  # Depends on others and is non-sync
+
+CONTENT_TYPES = {'vide': 'video', 'soun': 'audio'}
+
+# Sizes of the VisualSampleEntry and AudioSampleEntry fields before child boxes
+VISUAL_SAMPLE_ENTRY_SIZE = 86
+AUDIO_SAMPLE_ENTRY_SIZE = 36
+
+Representation = namedtuple("Representation",
+                            "id content_type file_name codecs bandwidth lang "
+                            "width height frame_rate sample_rate channels "
+                            "duration init_range index_range")
+
+
+def make_box(box_type, payload):
+    "Return box of box_type with payload."
+    return uint32_to_str(8 + len(payload)) + box_type + payload
+
+
+def make_full_box(box_type, version, flags, payload):
+    "Return full box of box_type with version, flags, and payload."
+    return make_box(box_type, uint32_to_str((version << 24) | flags) + payload)
+
+
+# Replacements for the sample table boxes in the fragmented moov
+EMPTY_SAMPLE_TABLES = {
+    'stts': make_full_box('stts', 0, 0, uint32_to_str(0)),
+    'stsc': make_full_box('stsc', 0, 0, uint32_to_str(0)),
+    'stsz': make_full_box('stsz', 0, 0, uint32_to_str(0) * 2),
+    'stz2': make_full_box('stsz', 0, 0, uint32_to_str(0) * 2),
+    'stco': make_full_box('stco', 0, 0, uint32_to_str(0)),
+    'co64': make_full_box('stco', 0, 0, uint32_to_str(0)),
+    'ctts': '',
+    'stss': '',
+    'stps': '',
+    'sdtp': '',
+    'sbgp': ''}
+
+FTYP = make_box('ftyp', 'iso6' + uint32_to_str(0) + 'iso6cmfcdash')
+
+
+def read_uint32_array(data, offset, count):
+    "Read count big-endian unsigned 32-bit values starting at offset."
+    values = array('I', data[offset:offset + 4 * count])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def child_boxes(data, pos):
+    "Yield (box_type, box data) for the boxes in data from pos."
+    while pos + 8 <= len(data):
+        size = str_to_uint32(data[pos:pos + 4])
+        if size < 8:
+            break
+        yield data[pos + 4:pos + 8], data[pos:pos + size]
+        pos += size
+
+
+def decode_language(code):
+    "Return ISO-639-2/T language from packed mdhd value, 'und' if not set."
+    lang = "".join(chr(((code >> shift) & 0x1f) + 0x60) for shift in (10, 5, 0))
+    if not lang.isalpha():
+        return 'und'
+    return lang
+
+
+def read_descriptor(data, pos):
+    "Return tag, payload start and payload end of MPEG-4 descriptor at pos."
+    tag = ord(data[pos])
+    pos += 1
+    size = 0
+    for _ in range(4):
+        byte = ord(data[pos])
+        pos += 1
+        size = (size << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            break
+    return tag, pos, pos + size
+
+
+def avc_codecs(fourcc, avcc):
+    "RFC 6381 codecs string from avcC box."
+    return "%s.%02x%02x%02x" % (fourcc, ord(avcc[9]), ord(avcc[10]),
+                                ord(avcc[11]))
+
+
+def hevc_codecs(fourcc, hvcc):
+    "RFC 6381 codecs string from hvcC box (ISO/IEC 14496-15 Annex E)."
+    byte = ord(hvcc[9])
+    profile_space = byte >> 6
+    tier = (byte >> 5) & 0x1
+    profile_idc = byte & 0x1f
+    compatibility = int('{0:032b}'.format(str_to_uint32(hvcc[10:14]))[::-1], 2)
+    constraints = [ord(c) for c in hvcc[14:20]]
+    while constraints and constraints[-1] == 0:
+        constraints.pop()
+    parts = [fourcc, "%s%d" % (['', 'A', 'B', 'C'][profile_space], profile_idc),
+             "%X" % compatibility, "%s%d" % ("LH"[tier], ord(hvcc[20]))]
+    parts.extend("%X" % c for c in constraints)
+    return ".".join(parts)
+
+
+def mp4a_codecs(esds):
+    "RFC 6381 codecs string (e.g. mp4a.40.2) from esds box."
+    tag, pos, end = read_descriptor(esds, 12)
+    if tag != 3:  # ES_Descriptor
+        return "mp4a"
+    flags = ord(esds[pos + 2])
+    pos += 3
+    if flags & 0x80:  # streamDependenceFlag
+        pos += 2
+    if flags & 0x40:  # URL_Flag
+        pos += 1 + ord(esds[pos])
+    if flags & 0x20:  # OCRstreamFlag
+        pos += 2
+    tag, pos, end = read_descriptor(esds, pos)
+    if tag != 4:  # DecoderConfigDescriptor
+        return "mp4a"
+    codecs = "mp4a.%02x" % ord(esds[pos])
+    tag, pos, end = read_descriptor(esds, pos + 13)
+    if tag == 5 and end > pos:  # DecoderSpecificInfo
+        audio_object_type = ord(esds[pos]) >> 3
+        if audio_object_type == 31:
+            audio_object_type = 32 + (((ord(esds[pos]) & 0x7) << 3) |
+                                      (ord(esds[pos + 1]) >> 5))
+        codecs += ".%d" % audio_object_type
+    return codecs
+
+
+class ProgressiveTrackExtractor(TrackDataExtractor):
+    """Extract samples from a single-track progressive MP4 file.
+
+    The moov is rewritten for fragmented output while parsing, with
+    empty sample tables, zero durations and an added mvex box."""
+
+    def __init__(self, file_name, verbose=False):
+        super(ProgressiveTrackExtractor, self).__init__(file_name, verbose)
+        self.relevant_boxes = ["moov"]
+        self.nr_tracks = 0
+        self.content_type = None
+        self.lang = 'und'
+        self.fourcc = None
+        self.codecs = None
+        self.width = None
+        self.height = None
+        self.sample_rate = None
+        self.channels = None
+        self.tables = {}
+        self.moov = ""
+
+    def filterbox(self, box_type, data, file_pos, path=""):
+        "Parse progressive moov and return its fragmented version."
+        containers = ("moov", "moov.trak", "moov.trak.mdia",
+                      "moov.trak.mdia.minf", "moov.trak.mdia.minf.stbl")
+        if path == "":
+            path = box_type
+        else:
+            path = "%s.%s" % (path, box_type)
+        if path in containers:
+            if path == "moov.trak":
+                self.nr_tracks += 1
+            children = []
+            pos = 8
+            while pos < len(data):
+                size, child_type = self.check_box(data[pos:pos + 8])
+                children.append(self.filterbox(child_type, data[pos:pos + size],
+                                               file_pos, path))
+                pos += size
+            if path == "moov":
+                children.append(self._generate_mvex())
+            output = make_box(box_type, "".join(children))
+        elif path == "moov.mvex":
+            raise ValueError("Input is already fragmented")
+        elif path == "moov.mvhd":
+            output = self.process_mvhd(data)
+        elif path == "moov.trak.tkhd":
+            output = self.process_tkhd(data)
+        elif path == "moov.trak.mdia.mdhd":
+            output = self.process_mdhd(data)
+        elif path == "moov.trak.mdia.hdlr":
+            self.content_type = CONTENT_TYPES.get(data[16:20])
+            output = data
+        elif path == "moov.trak.mdia.minf.stbl.stsd":
+            self.process_stsd(data)
+            output = data
+        elif box_type in EMPTY_SAMPLE_TABLES and path.startswith(containers[-1]):
+            self.tables[box_type] = data
+            output = EMPTY_SAMPLE_TABLES[box_type]
+        else:
+            output = data
+        if path == "moov":
+            self.moov = output
+        return output
+
+    def process_mvhd(self, data):
+        "Set movie duration to 0."
+        if ord(data[8]) == 1:
+            return data[:32] + '\x00' * 8 + data[40:]
+        return data[:24] + '\x00' * 4 + data[28:]
+
+    def process_tkhd(self, data):
+        "Extract trackID and set duration to 0."
+        if ord(data[8]) == 1:
+            self.track_id = str_to_uint32(data[28:32])
+            return data[:36] + '\x00' * 8 + data[44:]
+        self.track_id = str_to_uint32(data[20:24])
+        return data[:28] + '\x00' * 4 + data[32:]
+
+    def process_mdhd(self, data):
+        "Extract timescale and language and set duration to 0."
+        TrackDataExtractor.process_mdhd(self, data)
+        if ord(data[8]) == 1:
+            self.lang = decode_language(str_to_uint16(data[40:42]))
+            return data[:32] + '\x00' * 8 + data[40:]
+        self.lang = decode_language(str_to_uint16(data[28:30]))
+        return data[:24] + '\x00' * 4 + data[28:]
+
+    def process_stsd(self, data):
+        "Extract codecs string and video or audio properties."
+        entry = data[16:16 + str_to_uint32(data[16:20])]
+        self.fourcc = fourcc = entry[4:8]
+        self.codecs = fourcc
+        if fourcc in ('avc1', 'avc3', 'hvc1', 'hev1'):
+            self.width = str_to_uint16(entry[32:34])
+            self.height = str_to_uint16(entry[34:36])
+            for child_type, child in child_boxes(entry, VISUAL_SAMPLE_ENTRY_SIZE):
+                if child_type == 'avcC':
+                    self.codecs = avc_codecs(fourcc, child)
+                elif child_type == 'hvcC':
+                    self.codecs = hevc_codecs(fourcc, child)
+        elif self.content_type == 'audio':
+            self.channels = str_to_uint16(entry[24:26])
+            self.sample_rate = str_to_uint32(entry[32:36]) >> 16
+            for child_type, child in child_boxes(entry, AUDIO_SAMPLE_ENTRY_SIZE):
+                if child_type == 'esds':
+                    self.codecs = mp4a_codecs(child)
+
+    def _generate_mvex(self):
+        trex = make_full_box('trex', 0, 0, uint32_to_str(self.track_id) +
+                             uint32_to_str(1) +  # sample_description_index
+                             uint32_to_str(0) * 3)  # duration, size, flags
+        return make_box('mvex', trex)
+
+    def finalize(self):
+        if self.nr_tracks != 1:
+            raise ValueError("Only single-track files supported, not %d tracks"
+                             % self.nr_tracks)
+        self._build_sample_table()
+        self.samples.freeze()
+        duration = self.samples.end_time(-1) if len(self.samples) else 0
+        self.input_segments = [{'sequence_number': 1,
+                                'base_media_decode_time': 0,
+                                'duration': duration}]
+
+    def header_data(self):
+        return FTYP + self.moov
+
+    def _build_sample_table(self):
+        "Combine the sample tables into self.samples."
+        tables = self.tables
+        stts = tables['stts']
+        runs = read_uint32_array(stts, 16, 2 * str_to_uint32(stts[12:16]))
+        durations = array('I')
+        for i in range(0, len(runs), 2):
+            durations.extend(array('I', [runs[i + 1]]) * runs[i])
+        nr_samples = len(durations)
+        sizes = self._sample_sizes()
+        if len(sizes) != nr_samples:
+            raise ValueError("stts has %d samples and stsz %d" %
+                             (nr_samples, len(sizes)))
+        ctos = array('i', [0]) * nr_samples
+        if 'ctts' in tables:
+            ctts = tables['ctts']
+            runs = read_uint32_array(ctts, 16, 2 * str_to_uint32(ctts[12:16]))
+            pos = 0
+            for i in range(0, len(runs), 2):
+                cto = runs[i + 1]
+                if cto >= 0x80000000:  # Negative offsets, also in version 0
+                    cto -= 0x100000000
+                ctos[pos:pos + runs[i]] = array('i', [cto]) * runs[i]
+                pos += runs[i]
+        if 'stss' in tables:
+            stss = tables['stss']
+            sync_samples = set(read_uint32_array(stss, 16, str_to_uint32(stss[12:16])))
+        else:
+            sync_samples = None
+        offsets = self._sample_offsets(sizes)
+        samples = self.samples = SampleTable()
+        start = 0
+        for i in range(nr_samples):
+            if sync_samples is None or i + 1 in sync_samples:
+                flags = SYNC_SAMPLE_FLAGS
+            else:
+                flags = NON_SYNC_SAMPLE_FLAGS
+            samples.append(start, durations[i], sizes[i], offsets[i], flags,
+                           ctos[i])
+            start += durations[i]
+
+    def _sample_sizes(self):
+        "Sample sizes from stsz or stz2."
+        if 'stsz' in self.tables:
+            stsz = self.tables['stsz']
+            sample_size = str_to_uint32(stsz[12:16])
+            sample_count = str_to_uint32(stsz[16:20])
+            if sample_size != 0:
+                return array('I', [sample_size]) * sample_count
+            return read_uint32_array(stsz, 20, sample_count)
+        stz2 = self.tables['stz2']
+        field_size = ord(stz2[15])
+        sample_count = str_to_uint32(stz2[16:20])
+        if field_size == 16:
+            values = array('H', stz2[20:20 + 2 * sample_count])
+            if sys.byteorder == 'little':
+                values.byteswap()
+            return array('I', values)
+        if field_size == 8:
+            return array('I', array('B', stz2[20:20 + sample_count]))
+        sizes = array('I')
+        for byte in array('B', stz2[20:20 + (sample_count + 1) // 2]):
+            sizes.append(byte >> 4)
+            sizes.append(byte & 0xf)
+        return sizes[:sample_count]
+
+    def _sample_offsets(self, sizes):
+        "Sample file offsets from stsc and stco or co64."
+        if 'co64' in self.tables:
+            co64 = self.tables['co64']
+            words = read_uint32_array(co64, 16, 2 * str_to_uint32(co64[12:16]))
+            chunk_offsets = [(words[i] << 32) | words[i + 1]
+                             for i in range(0, len(words), 2)]
+        else:
+            stco = self.tables['stco']
+            chunk_offsets = read_uint32_array(stco, 16, str_to_uint32(stco[12:16]))
+        stsc = self.tables['stsc']
+        entries = read_uint32_array(stsc, 16, 3 * str_to_uint32(stsc[12:16]))
+        offsets = []
+        sample_nr = 0
+        try:
+            for i in range(0, len(entries), 3):
+                first_chunk, samples_per_chunk = entries[i], entries[i + 1]
+                if i + 3 < len(entries):
+                    end_chunk = entries[i + 3]
+                else:
+                    end_chunk = len(chunk_offsets) + 1
+                for chunk in range(first_chunk, end_chunk):
+                    offset = chunk_offsets[chunk - 1]
+                    for _ in range(samples_per_chunk):
+                        offsets.append(offset)
+                        offset += sizes[sample_nr]
+                        sample_nr += 1
+        except IndexError:
+            sample_nr = -1
+        if sample_nr != len(sizes):
+            raise ValueError("stsc and stco do not match %d samples" %
+                             len(sizes))
+        return offsets
+
+
+def peak_bitrate(starts, sizes, window, timescale):
+    """Highest bitrate in bits/s over windows of window ticks, starting at each sample.
+
+    This is the @bandwidth with minBufferTime equal to window, since media
+    delivered at that rate then arrives before it is needed."""
+    peak = 0
+    window_bytes = 0
+    end = 0
+    nr_samples = len(starts)
+    for i in range(nr_samples):
+        window_end = starts[i] + window
+        while end < nr_samples and starts[end] < window_end:
+            window_bytes += sizes[end]
+            end += 1
+        peak = max(peak, window_bytes)
+        window_bytes -= sizes[i]
+    return 8.0 * peak * timescale / window
+
+
+class ProgressivePackager(TrackResegmenter):
+    """Package a progressive MP4 track as a DASH OnDemand/CMAF track.
+
+    Call resegment() to write the output and then representation() to
+    get the data for the MPD."""
+
+    def _create_extractor(self):
+        return ProgressiveTrackExtractor(self.input_file, self.verbose)
+
+    def _find_cut_samples(self):
+        self.sync_only = self.input_parser.content_type == 'video'
+        last_sample = len(self.input_parser.samples) - 1
+        # A cut at the last sample would drop it, so keep it in the last segment
+        return [cut for cut in TrackResegmenter._find_cut_samples(self)
+                if cut < last_sample]
+
+    def representation(self, rep_id):
+        "Return the Representation of the packaged track."
+        ip = self.input_parser
+        samples = ip.samples
+        nr_samples = len(samples)
+        duration = float(samples.end_time(-1) - samples.start[0]) / ip.track_timescale
+        # Peak over windows of minBufferTime, i.e. the segment duration
+        window = self.duration_ms * ip.track_timescale // 1000
+        bandwidth = int(round(max(8 * samples.data_size(0, nr_samples) / duration,
+                                  peak_bitrate([int(t) for t in samples.start],
+                                               [int(s) for s in samples.size],
+                                               window, ip.track_timescale))))
+        frame_rate = None
+        if ip.content_type == 'video' and samples.is_constant('dur', 0, nr_samples):
+            rate = Fraction(ip.track_timescale, int(samples.dur[0]))
+            frame_rate = str(rate)
+        return Representation(rep_id, ip.content_type,
+                              os.path.basename(self.output_file), ip.codecs,
+                              bandwidth, ip.lang, ip.width, ip.height, frame_rate,
+                              ip.sample_rate, ip.channels, duration,
+                              self.init_range, self.sidx_range)
+
+
+def package_track(job):
+    """Package a track and return (Representation, seconds).
+
+    Module-level function, so that it can be run in a worker process."""
+    rep_id, input_file, output_file, dur_ms = job
+    start = time.time()
+    packager = ProgressivePackager(input_file, dur_ms, output_file)
+    packager.resegment()
+    return packager.representation(rep_id), time.time() - start
+
+
+MPD_TEMPLATE = '''\
+<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011" type="static" minBufferTime="PT%(min_buffer_time).3fS" mediaPresentationDuration="PT%(duration).3fS">
+  <Period id="p0">
+%(adaptation_sets)s  </Period>
+</MPD>
+'''
+
+AS_TEMPLATE = '''\
+    <AdaptationSet contentType="%(content_type)s" mimeType="%(content_type)s/mp4"%(lang)s segmentAlignment="true" subsegmentAlignment="true" subsegmentStartsWithSAP="1">
+%(representations)s    </AdaptationSet>
+'''
+
+REP_TEMPLATE = '''\
+      <Representation id="%(id)s" bandwidth="%(bandwidth)d" codecs="%(codecs)s"%(attributes)s>
+%(children)s        <BaseURL>%(file_name)s</BaseURL>
+        <SegmentBase indexRangeExact="true" indexRange="%(index_range)s">
+          <Initialization range="%(init_range)s"/>
+        </SegmentBase>
+      </Representation>
+'''
+
+CHANNEL_CONFIG_TEMPLATE = '''\
+        <AudioChannelConfiguration schemeIdUri="urn:mpeg:dash:23003:3:audio_channel_configuration:2011" value="%d"/>
+'''
+
+
+def make_representation(rep):
+    "Representation element for rep."
+    attributes = ""
+    children = ""
+    if rep.content_type == 'video':
+        attributes = ' width="%d" height="%d"' % (rep.width, rep.height)
+        if rep.frame_rate:
+            attributes += ' frameRate="%s"' % rep.frame_rate
+    elif rep.content_type == 'audio':
+        attributes = ' audioSamplingRate="%d"' % rep.sample_rate
+        children = CHANNEL_CONFIG_TEMPLATE % rep.channels
+    return REP_TEMPLATE % {'id': escape(rep.id), 'bandwidth': rep.bandwidth,
+                           'codecs': rep.codecs, 'attributes': attributes,
+                           'children': children,
+                           'file_name': escape(rep.file_name),
+                           'index_range': rep.index_range,
+                           'init_range': rep.init_range}
+
+
+def make_mpd(representations, min_buffer_time=2.0):
+    """Return OnDemand MPD for representations.
+
+    Video representations share one AdaptationSet, and audio is grouped by
+    language and codec."""
+    adaptation_sets = OrderedDict()
+    for rep in sorted(representations, key=lambda r: r.content_type != 'video'):
+        if rep.content_type == 'video':
+            key = ('video', rep.codecs[:4], None)
+        else:
+            key = (rep.content_type, rep.codecs[:4], rep.lang)
+        adaptation_sets.setdefault(key, []).append(rep)
+    as_parts = []
+    for (content_type, _, lang), reps in adaptation_sets.items():
+        lang_attr = ''
+        if content_type == 'audio':
+            lang_attr = ' lang="%s"' % lang
+        as_parts.append(AS_TEMPLATE % {
+            'content_type': content_type, 'lang': lang_attr,
+            'representations': "".join(make_representation(r) for r in reps)})
+    return MPD_TEMPLATE % {'min_buffer_time': min_buffer_time,
+                           'duration': max(r.duration for r in representations),
+                           'adaptation_sets': "".join(as_parts)}
+
+
+def write_mpd(mpd_path, representations, min_buffer_time=2.0):
+    "Write OnDemand MPD for representations to mpd_path."
+    with open(mpd_path, 'wb') as ofh:
+        ofh.write(make_mpd(representations, min_buffer_time))
+
+
+def output_path(input_file):
+    "Output track file name, same as MP4Box uses."
+    return os.path.splitext(input_file)[0] + "_dashinit.mp4"
+
+
+def main():
+    parser = ArgumentParser(usage="usage: %(prog)s [options] input_file ...")
+
+    parser.add_argument("input_files",
+                        nargs="+",
+                        help="Progressive MP4 files with one track each")
+
+    parser.add_argument("-d", "--duration",
+                        action="store",
+                        dest="duration",
+                        type=float,
+                        default=2000,
+                        help="Segment duration in milliseconds")
+
+    parser.add_argument("-m", "--manifest",
+                        action="store",
+                        dest="manifest",
+                        default="manifest.mpd",
+                        help="Output MPD file, written in the directory of "
+                             "the first input file if only a name")
+
+    args = parser.parse_args()
+
+    representations = []
+    for input_file in args.input_files:
+        rep_id = os.path.splitext(os.path.basename(input_file))[0]
+        rep, seconds = package_track((rep_id, input_file, output_path(input_file),
+                                      args.duration))
+        print("Packaged %s in %.2fs" % (input_file, seconds))
+        representations.append(rep)
+    mpd_path = args.manifest
+    if not os.path.dirname(mpd_path):
+        mpd_path = os.path.join(os.path.dirname(args.input_files[0]), mpd_path)
+    write_mpd(mpd_path, representations, args.duration / 1000.0)
+
+
+if __name__ == "__main__":
+    main()
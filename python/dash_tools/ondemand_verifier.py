@@ -24,15 +24,44 @@ BAD_NON_CONSISTENT_TFDT_TIMELIINE = 0x10
 BAD_OTHER = 0x80
 
 A result of 0, means nothing bad found.
+
+With --jobs N, the tracks of all assets are parsed in a pool of N worker
+processes, so both assets and the representations within an asset are
+verified concurrently. Log records from the workers are collected and
+written by the main process, asset by asset, in the same order as when
+running serially.
+
+With --cache FILE, the per-track results are stored in an SQLite database
+and reused on later runs for tracks whose path, size, modification time and
+header digest are unchanged, so only new or changed tracks are parsed.
+
+With --report FILE, a JSON object per asset is written as one line to FILE
+with the badness, segment counts and durations per representation, the
+mismatches found, time spent reading, parsing and checking, and the number
+of bytes read.
 """
 
 import os
 import sys
+import json
+import time
+import struct
+import hashlib
+import sqlite3
+import itertools
 import logging
+import multiprocessing
 import traceback
 import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
-from collections import defaultdict, namedtuple, Counter, OrderedDict
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, Counter, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from mp4 import mp4
 
@@ -78,6 +107,9 @@ TrackDurations = namedtuple('TrackDurations', 'name durations')
 
 ASDurations = namedtuple('ASDurations', 'name durations total_dur nr_segs')
 
+TrackResult = namedtuple('TrackResult',
+                         'name segment_data sidx_segment_data sidx_ok stats')
+
 
 class BadManifestError(Exception):
     pass
@@ -86,16 +118,107 @@ class MultipleTrunError(Exception):
     "There is more than one trun in a segment. Against CMAF."
     pass
 
+class TrackError(Exception):
+    "Checking a track in a worker process failed."
+    pass
+
+
+
+# Top-level boxes needed for verification. Other payloads (mdat) are skipped.
+HEADER_BOXES = ('ftyp', 'moov', 'sidx', 'styp', 'emsg', 'moof')
+
+
+class TrackHeaders(object):
+    """Sliceable view of a track file with only the header boxes read.
+
+    The top-level box headers are walked with seek, and only the bodies of
+    HEADER_BOXES are read. Slices of skipped data are returned as zeros,
+    which is fine since the mp4 parser only looks at their box headers."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = []
+        self.parts = []
+        self.bytes_read = 0
+        with open(path, 'rb') as ifh:
+            ifh.seek(0, os.SEEK_END)
+            self.size = ifh.tell()
+            offset = 0
+            while offset + 8 <= self.size:
+                ifh.seek(offset)
+                header = ifh.read(16)
+                size, box_type = struct.unpack('>I4s', header[:8])
+                header_size = 8
+                if size == 1:
+                    size = struct.unpack('>Q', header[8:16])[0]
+                    header_size = 16
+                elif size == 0:
+                    size = self.size - offset
+                if size < header_size:
+                    raise ValueError("%s: Bad size %d for box %s at offset %d"
+                                     % (path, size, box_type, offset))
+                self.bytes_read += len(header)
+                if box_type in HEADER_BOXES:
+                    rest = ifh.read(max(size - len(header), 0))
+                    self.bytes_read += len(rest)
+                    data = header[:size] + rest
+                else:
+                    data = header[:header_size]
+                self.offsets.append(offset)
+                self.parts.append(data)
+                offset += size
+
+    def __len__(self):
+        return self.size
+
+    def read(self, offset, length):
+        end = min(offset + length, self.size)
+        output = []
+        i = bisect_right(self.offsets, offset) - 1
+        while offset < end:
+            if i >= 0 and offset < self.offsets[i] + len(self.parts[i]):
+                start = offset - self.offsets[i]
+                chunk = self.parts[i][start:start + end - offset]
+                i += 1
+            else:
+                i += 1
+                next_offset = end
+                if i < len(self.offsets):
+                    next_offset = min(self.offsets[i], end)
+                chunk = '\x00' * (next_offset - offset)
+            output.append(chunk)
+            offset += len(chunk)
+        return ''.join(output)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.size)
+            return self.read(start, stop - start)
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('TrackHeaders index out of range')
+        return self.read(index, 1)
 
 
 class CMAFTrack(object):
-    "Check and possibly fix a CMAF track."
+    """Check and possibly fix a CMAF track.
+
+    data is the track bytes or a TrackHeaders view, see from_file()."""
     def __init__(self, name, data):
         self.name = name
         self.root = mp4(data)
         self.segment_data = self._find_subsegment_data(self.root)
         self.sidx_segment_data = self._get_sidx_segment_data(self.root)
 
+    @classmethod
+    def from_file(cls, name, path):
+        "Create from a track file, reading only the header boxes."
+        headers = TrackHeaders(path)
+        log.debug("%s: Read %d of %d bytes" % (name, headers.bytes_read,
+                                               headers.size))
+        return cls(name, headers)
+
     def _find_subsegment_data(self, mp4_root):
         "Find the segments and return size, offset, decode_time, duration"
         timescale = mp4_root.find('moov.trak.mdia.mdhd').timescale
@@ -268,13 +391,167 @@ def get_trackgroups_from_dash_manifest(manifest_path):
     return track_file_paths
 
 
-def check_alignment(manifest_path, verbose):
+def analyze_track(track_path):
+    "Parse a track and check it on its own. Return a TrackResult."
+    name = os.path.basename(track_path)
+    start = time.time()
+    headers = TrackHeaders(track_path)
+    read_time = time.time() - start
+    log.debug("%s: Read %d of %d bytes" % (name, headers.bytes_read,
+                                           headers.size))
+    track = CMAFTrack(name, headers)
+    sidx_ok = compare_segments_and_sidx(name, track)
+    stats = {'size': headers.size, 'bytes_read': headers.bytes_read,
+             'read_time': read_time,
+             'parse_time': time.time() - start - read_time}
+    return TrackResult(name, track.segment_data, track.sidx_segment_data,
+                       sidx_ok, stats)
+
+
+class LogCollector(logging.Handler):
+    "Collect log messages in a worker process."
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+def analyze_track_job(track_path):
+    """Run analyze_track with the log messages collected instead of written.
+
+    Return (TrackResult, error, log records)."""
+    collector = LogCollector()
+    logger = logging.getLogger()
+    handlers = logger.handlers
+    logger.handlers = [collector]
+    result = error = None
+    try:
+        result = analyze_track(track_path)
+    except Exception, e:
+        error = "%s: %s" % (os.path.basename(track_path), e)
+    finally:
+        logger.handlers = handlers
+    return result, error, collector.records
+
+
+HEADER_DIGEST_SIZE = 65536  # Max bytes of the header region to hash
+
+
+def header_digest(track_path):
+    "SHA-1 of the top-level boxes before the first moof (at most 64 kB)."
+    with open(track_path, 'rb') as ifh:
+        data = ifh.read(HEADER_DIGEST_SIZE)
+    end = 0
+    while end + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[end:end + 8])
+        if box_type in ('moof', 'mdat') or size < 8:
+            break
+        end += size
+    return hashlib.sha1(data[:end]).hexdigest()
+
+
+class VerificationCache(object):
+    """Persistent SQLite cache of analyze_track_job results.
+
+    A result is reused if the size, mtime and header digest of the track
+    file are the same as when it was stored."""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS tracks (path TEXT PRIMARY "
+                        "KEY, size INTEGER, mtime REAL, digest TEXT, "
+                        "result TEXT)")
+        self.nr_hits = 0
+        self.nr_misses = 0
+
+    def lookup(self, track_path):
+        """Return (cached job result or None, file identity).
+
+        The identity is None if the file cannot be read."""
+        try:
+            stat = os.stat(track_path)
+            identity = (stat.st_size, stat.st_mtime, header_digest(track_path))
+        except (IOError, OSError):
+            return None, None
+        row = self.db.execute("SELECT size, mtime, digest, result FROM tracks "
+                              "WHERE path = ?",
+                              (os.path.abspath(track_path),)).fetchone()
+        if row is None or tuple(row[:3]) != identity:
+            self.nr_misses += 1
+            return None, identity
+        self.nr_hits += 1
+        result, records = json.loads(row[3])
+        if len(result) != len(TrackResult._fields):  # Older format
+            self.nr_hits -= 1
+            self.nr_misses += 1
+            return None, identity
+        result = TrackResult(*result)
+        result.stats['cached'] = True
+        return (result, None, records), identity
+
+    def store(self, track_path, identity, job_result):
+        "Store a successful job result."
+        result, error, records = job_result
+        if error is not None or identity is None:
+            return
+        self.db.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)",
+                        (os.path.abspath(track_path),) + identity +
+                        (json.dumps([result, records]),))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def get_track_result(track_path, track_results):
+    "TrackResult from worker results if available, else analyze in process."
+    if track_results is None or track_path not in track_results:
+        return analyze_track(track_path)
+    result, error, records = track_results[track_path]
+    for level, message in records:
+        log.log(level, message)
+    if error is not None:
+        raise TrackError(error)
+    return result
+
+
+def representation_report(track_path, track):
+    "Report data for a track."
+    segment_data = track.segment_data
+    timescale = float(segment_data['timescale'])
+    durations = [seg['duration'] for seg in segment_data['segments']]
+    rep = {'track': track.name, 'path': track_path,
+           'nr_segments': len(durations), 'timescale': segment_data['timescale'],
+           'duration': sum(durations) / timescale}
+    if durations:
+        rep['min_segment_duration'] = min(durations) / timescale
+        rep['max_segment_duration'] = max(durations) / timescale
+    rep.update(track.stats)
+    return rep
+
+
+def check_alignment(manifest_path, verbose, track_results=None, report=None):
     """Check alignment and return badness as mask.
 
     Compare sidx vs subsegment timestamp/sizes inside one track.
     Compare between representations inside on adaptation set.
     Compare between adaptation sets (for video and audio).
+
+    track_results maps track paths to results of analyze_track_job.
+    If report is a dict, representations and mismatches are added to it.
     """
+    start = time.time()
+    track_time = 0  # Time getting the track results
+    if report is None:
+        report = {}
+    representations = report.setdefault('representations', [])
+    mismatches = report.setdefault('mismatches', [])
     badness = 0
     track_groups = get_trackgroups_from_dash_manifest(manifest_path)
     tg_segment_data = OrderedDict()
@@ -286,16 +563,17 @@ def check_alignment(manifest_path, verbose):
         segment_timescale = None
         sidx_timescale = None
         for i, track_path in enumerate(track_group):
-            name = os.path.basename(track_path)
-            try:
-                data = open(track_path, 'rb').read()
-            except IOError as e:
-                raise e
-            track = CMAFTrack(name, data)
+            track_start = time.time()
+            track = get_track_result(track_path, track_results)
+            track_time += time.time() - track_start
+            representations.append(representation_report(track_path, track))
+            name = track.name
             segment_data = track.segment_data
             if i == 0:  # Take one segment timeline per group
                 tg_segment_data[name] = segment_data
             badness |= segment_data['badness']
+            if segment_data['badness'] & BAD_NON_CONSISTENT_TFDT_TIMELIINE:
+                mismatches.append({'type': 'tfdt_timeline', 'track': name})
             sidx_segment_data = track.sidx_segment_data
             this_seg_timescale = segment_data['timescale']
             this_sidx_timescale = sidx_segment_data['timescale']
@@ -325,71 +603,121 @@ def check_alignment(manifest_path, verbose):
                           "with segment decode %d or pres %s" % (
                     name, first_sidx_time, first_decode_time, first_pres_time))
                 badness |= BAD_SIDX
+                mismatches.append({'type': 'sidx_first_time', 'track': name,
+                                   'value': first_sidx_time})
             if first_decode_time != 0:
                 log.error("%s: First tfdt decode_time is not zero but %d" %
                           (name, first_decode_time))
                 badness |= BAD_NONZERO_FIRST_TIME
-            if not compare_segments_and_sidx(name, track):
+                mismatches.append({'type': 'first_decode_time', 'track': name,
+                                   'value': first_decode_time})
+            if not track.sidx_ok:
                 log.error("%s: SIDX/Segment mismatch" % track_path)
                 badness |= BAD_SIDX
+                mismatches.append({'type': 'sidx', 'track': name})
             track_durs = [t['duration'] for t in
                           segment_data['segments']]
             track_durations.append(TrackDurations(track_path, track_durs))
-    nr_bad_tracks = check_track_group_alignment(track_durations)
+    bad_tracks = []
+    nr_bad_tracks = check_track_group_alignment(track_durations, bad_tracks)
     if nr_bad_tracks > 0:
         badness |= BAD_ALIGNMENT
-    nr_inter_alignment_issues = _check_inter_as_alignment(tg_segment_data)
+        mismatches.append({'type': 'alignment',
+                           'tracks': [os.path.basename(t) for t in bad_tracks]})
+    nr_inter_alignment_issues = _check_inter_as_alignment(tg_segment_data,
+                                                          mismatches)
     if nr_inter_alignment_issues > 0:
         print("There %d warnings on alignment issues between adaptation sets. "
               "See log." % nr_inter_alignment_issues)
+    times = report.setdefault('time', {})
+    times['check'] = times.get('check', 0) + time.time() - start - track_time
     return badness
 
 
-def _check_inter_as_alignment(tg_segment_data):
-    "Check alignment between adaptation sets. This is not critical bud bad"
-
-    def average(list):
-        return sum(list) / len(list)
+def _check_inter_as_alignment(tg_segment_data, issues=None):
+    """Check alignment between adaptation sets. This is not critical bud bad
 
+    The issues are added to the list issues, if given."""
+    if issues is None:
+        issues = []
     as_timing = []
     nr_inter_alignment_issues = 0
     for name, seg_data in tg_segment_data.iteritems():
         inv_timescale = 1.0 / seg_data['timescale']
         durs = [s['duration'] * inv_timescale for s in seg_data['segments']]
         total_dur = sum(durs)
-        as_timing.append(ASDurations(name, durs, total_dur, len(durs)))
+        if np is not None:
+            durs = np.array(durs)
+            acc_durs = np.cumsum(durs)
+        else:
+            acc_durs = _accumulate(durs)
+        as_timing.append((ASDurations(name, durs, total_dur, len(durs)),
+                          acc_durs))
     for i in range(len(as_timing) - 1):
-        as1 = as_timing[i]
+        as1, acc1 = as_timing[i]
         for j in range(i + 1, len(as_timing)):
-            as2 = as_timing[j]
+            as2, acc2 = as_timing[j]
             if as1.nr_segs != as2.nr_segs:
                 log.warning('Nr segments differs for %s vs %s: %d vs %d' %
                             (as1.name, as2.name, as1.nr_segs, as2.nr_segs))
                 nr_inter_alignment_issues += 1
+                issues.append({'type': 'inter_as_segment_count',
+                               'sets': [as1.name, as2.name]})
             common_length_minus1 = min(as1.nr_segs, as2.nr_segs) - 1
-            avg1 = average(as1.durations[:common_length_minus1])
-            avg2 = average(as2.durations[:common_length_minus1])
-            if abs(avg1 - avg2) > MAX_AVERAGE_DURATION_DIFF:
-                log.warning('Average seg dur for %s differs from %s by %.2fs' %
-                            (as1.name, as2.name, abs(avg1 - avg2)))
-                nr_inter_alignment_issues += 1
+            if common_length_minus1 > 0:
+                # Averages from the accumulated durations of each set
+                avg1 = acc1[common_length_minus1 - 1] / common_length_minus1
+                avg2 = acc2[common_length_minus1 - 1] / common_length_minus1
+                if abs(avg1 - avg2) > MAX_AVERAGE_DURATION_DIFF:
+                    log.warning('Average seg dur for %s differs from %s by '
+                                '%.2fs' % (as1.name, as2.name,
+                                           abs(avg1 - avg2)))
+                    nr_inter_alignment_issues += 1
+                    issues.append({'type': 'inter_as_average_duration',
+                                   'sets': [as1.name, as2.name]})
             if abs(as1.total_dur - as2.total_dur) > TOTAL_DUR_DIFF_THRESHOLD:
                 log.warning('Total dur differs for %s vs %s: %.1fs vs %.1fs' %
                             (as1.name, as2.name, as1.total_dur, as2.total_dur))
                 nr_inter_alignment_issues += 1
-            nr_seg_diffs = 0
-            for nr, (d1, d2) in enumerate(zip(as1.durations, as2.durations)):
-                if abs(d1 - d2) > SEGMENT_DUR_DIFF_THRESHOLD:
-                    nr_seg_diffs += 1
+                issues.append({'type': 'inter_as_total_duration',
+                               'sets': [as1.name, as2.name]})
+            diff_nrs = _differing_segments(as1.durations, as2.durations,
+                                           SEGMENT_DUR_DIFF_THRESHOLD)
+            if log.isEnabledFor(logging.DEBUG):
+                for nr in diff_nrs:
                     log.debug('Seg dur diff %d %s vs %s: %.2fs vs %.2fs' %
-                              (nr, as1.name, as2.name, d1, d2))
-            if nr_seg_diffs > 0:
+                              (nr, as1.name, as2.name, as1.durations[nr],
+                               as2.durations[nr]))
+            if diff_nrs:
                 log.warning("%s vs %s, %d segment durations differ"
-                            % (as1.name, as2.name, nr_seg_diffs))
+                            % (as1.name, as2.name, len(diff_nrs)))
                 nr_inter_alignment_issues += 1
+                issues.append({'type': 'inter_as_segment_durations',
+                               'sets': [as1.name, as2.name],
+                               'segments': diff_nrs})
     return nr_inter_alignment_issues
 
 
+def _accumulate(values):
+    "Running sums of values."
+    total = 0
+    sums = []
+    for value in values:
+        total += value
+        sums.append(total)
+    return sums
+
+
+def _differing_segments(durs1, durs2, threshold):
+    "Numbers of the segments where durations differ more than threshold."
+    length = min(len(durs1), len(durs2))
+    if np is not None:
+        diffs = np.abs(durs1[:length] - durs2[:length])
+        return [int(nr) for nr in np.nonzero(diffs > threshold)[0]]
+    return [nr for nr in range(length)
+            if abs(durs1[nr] - durs2[nr]) > threshold]
+
+
 def compare_segments_and_sidx(track_name, track):
     "Check that sidx is compatible with segment data."
     seg_data = track.segment_data
@@ -426,41 +754,61 @@ def compare_segments_and_sidx(track_name, track):
     return equal
 
 
-def check_track_group_alignment(track_durations):
-    "Check if all tracks in group are aligned."
+def duration_digest(durations):
+    "Digest of a sequence of segment durations."
+    return hashlib.sha1(array('L', durations).tostring()).hexdigest()
+
+
+def check_track_group_alignment(track_durations, bad_tracks=None):
+    """Check if all tracks in group are aligned.
+
+    Tracks with identical duration sequences are grouped in classes by a
+    digest of the sequence. A track mismatches all tracks outside its class,
+    and differences are only logged between class representatives.
+    The names of bad tracks are added to the list bad_tracks, if given."""
+    if bad_tracks is None:
+        bad_tracks = []
     if len(track_durations) == 1:
         return 0
-    nr_mismatches = defaultdict(int)
-    for i in range(len(track_durations) - 1):
-        for j in range(i + 1, len(track_durations)):
-            if track_durations[i].durations != track_durations[j].durations:
-                name1 = track_durations[i].name
-                name2 = track_durations[j].name
-                diffs = []
-                for dur1, dur2 in zip(track_durations[i].durations,
-                                      track_durations[j].durations):
-                    diffs.append(dur1 - dur2)
-                    if dur1 != dur2:
-                        log.debug("Duration diff between %s and %s: %d != %d" %
-                                  (name1, name2, dur1, dur2))
-                log.info("Diffs between %s and %s: %s" % (name1, name2,
-                                                          Counter(diffs)))
-                nr_mismatches[name1] += 1
-                nr_mismatches[name2] += 1
+    classes = OrderedDict()  # digest -> tracks with that timeline
+    for track in track_durations:
+        classes.setdefault(duration_digest(track.durations), []).append(track)
+    if len(classes) == 1:
+        return 0
+    reference = max(classes.values(), key=len)[0]
+    for tracks in classes.values():
+        log.info("Timeline shared by %d tracks: %s" % (
+            len(tracks), ", ".join(t.name for t in tracks)))
+        representative = tracks[0]
+        if representative is reference:
+            continue
+        diffs = []
+        for dur1, dur2 in zip(representative.durations, reference.durations):
+            diffs.append(dur1 - dur2)
+            if dur1 != dur2:
+                log.debug("Duration diff between %s and %s: %d != %d" %
+                          (representative.name, reference.name, dur1, dur2))
+        log.info("Diffs between %s and %s: %s" % (representative.name,
+                                                  reference.name,
+                                                  Counter(diffs)))
     nr_bad_tracks = 0
     if len(track_durations) > 2:
-        for name, mismatches in nr_mismatches.iteritems():
+        for tracks in classes.values():
+            mismatches = len(track_durations) - len(tracks)
             if mismatches > 1:
-                log.error("Track %s is not aligned with %d other tracks" %
-                          (name, mismatches))
-                nr_bad_tracks += 1
-    elif len(track_durations) == 2:
-        if nr_mismatches:
-            nr_bad_tracks = 1
+                for track in tracks:
+                    log.error("Track %s is not aligned with %d other tracks" %
+                              (track.name, mismatches))
+                    nr_bad_tracks += 1
+                    bad_tracks.append(track.name)
+    else:
+        nr_bad_tracks = 1
+        bad_tracks.extend(track.name for track in track_durations)
     return nr_bad_tracks
 
 
-def setup_logging(log_level, log_to_stdout):
+def setup_logging(log_level, log_to_stdout, log_file=LOGFILE):
+    "Add a handler for log_file, or stdout, to the root logger and return it."
     log_level = log_level.upper()
 
     # default loglevel is warning
@@ -470,32 +818,44 @@ def setup_logging(log_level, log_to_stdout):
     if log_to_stdout:
         log_handler = logging.StreamHandler()
     else:
-        print("dashondemand_verifier: Logging to %s" % LOGFILE)
-        if os.path.exists(LOGFILE):
-            os.remove(LOGFILE)
-        log_handler = logging.FileHandler(LOGFILE)
+        print("dashondemand_verifier: Logging to %s" % log_file)
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        log_handler = logging.FileHandler(log_file)
     formatter = logging.Formatter('%(levelname)s - %(message)s')
     log_handler.setFormatter(formatter)
     logger.addHandler(log_handler)
+    return log_handler
 
 
-def check_asset(mpd_path, verbose):
-    "Check a an asset defined by an MPD path."
+def check_asset(mpd_path, verbose, track_results=None, report=None):
+    """Check a an asset defined by an MPD path.
+
+    If report is a dict, the report data for the asset is added to it."""
     print "Checking %s" % mpd_path
     log.info("Checking %s" % mpd_path)
+    start = time.time()
+    if report is None:
+        report = {}
+    report.update({'mpd': mpd_path, 'representations': [], 'mismatches': [],
+                   'time': {'check': 0}, 'error': None})
     badness = 0
     try:
         try:
             check_dash_manifest(mpd_path, verbose)
+            report['time']['check'] = time.time() - start
         except BadManifestError, e:
             badness = BAD_MANIFEST
+            report['error'] = str(e)
             log.error(e)
             if verbose:
                 print(e)
                 traceback.print_tb(sys.exc_traceback)
         else:
-            badness |= check_alignment(mpd_path, verbose)
+            badness |= check_alignment(mpd_path, verbose, track_results,
+                                       report)
     except Exception, e:
+        report['error'] = str(e)
         log.error(e)
         if verbose:
             print(e)
@@ -506,16 +866,97 @@ def check_asset(mpd_path, verbose):
                                                badness_string(badness))
     else:
         print "Asset %s is OK" % mpd_path
+    reps = report['representations']
+    report['badness'] = badness
+    report['badness_string'] = badness_string(badness)
+    report['bytes_read'] = sum(r['bytes_read'] for r in reps)
+    report['bytes_total'] = sum(r['size'] for r in reps)
+    report['time'].update({'total': time.time() - start,
+                           'read': sum(r['read_time'] for r in reps),
+                           'parse': sum(r['parse_time'] for r in reps)})
     return badness
 
 
-def check_asset_tree(verbose, asset_dir, names):
-    badness = 0
-    for name in names:
-        path = os.path.join(asset_dir, name)
-        base, ext = os.path.splitext(path)
-        if ext == '.mpd':
-            badness |= check_asset(path, verbose)
+def find_manifests(asset_dir):
+    "Return the mpd files in the tree at asset_dir."
+    mpd_paths = []
+    for dir_path, _, names in os.walk(asset_dir):
+        for name in names:
+            if os.path.splitext(name)[1] == '.mpd':
+                mpd_paths.append(os.path.join(dir_path, name))
+    return mpd_paths
+
+
+def manifest_track_paths(mpd_path):
+    "Track files of an asset, or [] if the manifest cannot be read."
+    try:
+        return [path for group in get_trackgroups_from_dash_manifest(mpd_path)
+                for path in group]
+    except Exception:  # Reported by check_asset
+        return []
+
+
+def check_assets(mpd_paths, verbose, jobs=1, cache=None, report_file=None):
+    """Check assets and return list of badness values.
+
+    With jobs > 1, the tracks of all assets are parsed in a process pool,
+    and each asset is checked as soon as its tracks are done.
+    Tracks found in cache (a VerificationCache) are not parsed again.
+    If report_file is given, a JSON report line per asset is written to it."""
+
+    def check(mpd_path, track_results=None):
+        report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                             time.gmtime())}
+        badness = check_asset(mpd_path, verbose, track_results, report)
+        if report_file is not None:
+            report_file.write(json.dumps(report, sort_keys=True) + '\n')
+            report_file.flush()
+        return badness
+
+    if jobs <= 1 and cache is None:
+        return [check(mpd_path) for mpd_path in mpd_paths]
+    asset_tracks = []
+    todo = []  # Tracks to parse, in the order they are needed
+    for mpd_path in mpd_paths:
+        tracks = []
+        for path in manifest_track_paths(mpd_path):
+            cached, identity = None, None
+            if cache is not None:
+                cached, identity = cache.lookup(path)
+            if cached is None:
+                todo.append(path)
+            tracks.append((path, cached, identity))
+        asset_tracks.append((mpd_path, tracks))
+    pool = None
+    if jobs > 1 and todo:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(analyze_track_job, todo)
+    else:
+        results = itertools.imap(analyze_track_job, todo)
+    try:
+        badness_values = []
+        for mpd_path, tracks in asset_tracks:
+            track_results = {}
+            for path, cached, identity in tracks:
+                if cached is None:
+                    cached = results.next()
+                    if cache is not None:
+                        cache.store(path, identity, cached)
+                track_results[path] = cached
+            badness_values.append(check(mpd_path, track_results))
+            if cache is not None:
+                cache.commit()
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+    return badness_values
+
 
 usage = """usage: %(prog)s [options] file/dir ...
 
@@ -548,6 +989,11 @@ def main():
                         dest="log_to_stdout",
                         help="Log to stdout instead of file")
 
+    parser.add_argument("--log-file",
+                        dest="log_file",
+                        default=LOGFILE,
+                        help="Log file (default %s)" % LOGFILE)
+
     parser.add_argument("-l", "--log-level",
                         dest="log_level",
                         default="WARNING",
@@ -558,15 +1004,56 @@ def main():
                         action="store_true",
                         dest="verbose")
 
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        type=int,
+                        default=1,
+                        help="Number of worker processes for parsing tracks "
+                             "(default 1)")
+
+    parser.add_argument("-c", "--cache",
+                        dest="cache_file",
+                        default=None,
+                        help="SQLite file with results of earlier runs, "
+                             "created if missing")
+
+    parser.add_argument("-r", "--report",
+                        dest="report_file",
+                        default=None,
+                        help="Write a JSON line per asset to this file")
+
     args = parser.parse_args()
-    setup_logging(args.log_level, args.log_to_stdout)
-    badness = 0
+    setup_logging(args.log_level, args.log_to_stdout, args.log_file)
+    mpd_paths = []
+    counted = []  # Only individual files count in the exit value
     for asset_path in args.manifest_files:
         if os.path.isdir(asset_path):
             print("Traversing tree looking for mpd files at %s" % asset_path)
-            os.path.walk(asset_path, check_asset_tree, args.verbose)
+            tree_paths = find_manifests(asset_path)
+            mpd_paths.extend(tree_paths)
+            counted.extend([False] * len(tree_paths))
         else:
-            asset_badness = check_asset(asset_path, args.verbose)
+            mpd_paths.append(asset_path)
+            counted.append(True)
+    cache = None
+    if args.cache_file:
+        cache = VerificationCache(args.cache_file)
+    report_file = None
+    if args.report_file:
+        report_file = open(args.report_file, 'w')
+    try:
+        badness_values = check_assets(mpd_paths, args.verbose, args.jobs,
+                                      cache, report_file)
+    finally:
+        if report_file is not None:
+            report_file.close()
+        if cache is not None:
+            cache.close()
+            print("Cache: %d tracks reused, %d parsed" % (cache.nr_hits,
+                                                          cache.nr_misses))
+    badness = 0
+    for asset_badness, count in zip(badness_values, counted):
+        if count:
             badness |= asset_badness
     sys.exit(badness)
 
@@ -0,0 +1,279 @@
+"""Pensieve actor network inference with NumPy only.
+
+The pretrained Pensieve model is a TensorFlow checkpoint of the a3c.py
+actor and critic networks. Running it needs a TensorFlow session, which
+takes seconds to start and hundreds of MB of memory, just for a small
+forward pass per segment. export_actor reads the actor weights straight
+from the checkpoint files and saves them as an .npz file, and ActorModel
+implements the forward pass of a3c.ActorNetwork.predict in NumPy.
+TensorFlow is only needed for training with a3c.py.
+
+The checkpoint is read without TensorFlow. The .index file is an
+uncompressed SSTable from tensor name to a BundleEntryProto with dtype,
+shape, shard, offset and size of the tensor in the .data file.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2017, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import struct
+from collections import OrderedDict
+from argparse import ArgumentParser
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SSTABLE_MAGIC = 0xdb4775248b80fb57
+FOOTER_SIZE = 48
+BLOCK_TRAILER_SIZE = 5  # compression type and crc32c
+
+# TensorFlow DataType enum to NumPy dtype
+DTYPES = {1: '<f4', 2: '<f8', 3: '<i4', 9: '<i8', 10: '?'}
+
+# Layers of a3c.ActorNetwork as named by tflearn, in order of creation.
+# The fully connected layers have W of shape (in, out), and the conv_1d
+# layers W of shape (filter_size, 1, in_channels, nb_filter).
+ACTOR_LAYERS = ['FullyConnected', 'FullyConnected_1', 'Conv1D', 'Conv1D_1',
+                'Conv1D_2', 'FullyConnected_2', 'FullyConnected_3',
+                'FullyConnected_4']
+ACTOR_SCOPE = 'actor'
+
+
+def read_varint(data, pos):
+    "Read a protobuf varint. Return value and new position."
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def parse_fields(data):
+    "Parse a protobuf message into a list of (field_number, value)."
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field_nr, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type %d" % wire_type)
+        fields.append((field_nr, value))
+    return fields
+
+
+def read_block_handle(data, pos=0):
+    "Read an SSTable BlockHandle. Return offset, size and new position."
+    offset, pos = read_varint(data, pos)
+    size, pos = read_varint(data, pos)
+    return offset, size, pos
+
+
+def parse_block(data):
+    "Parse an SSTable block into a list of (key, value)."
+    nr_restarts = struct.unpack('<I', data[-4:])[0]
+    end = len(data) - 4 * (nr_restarts + 1)
+    entries = []
+    key = ''
+    pos = 0
+    while pos < end:
+        shared, pos = read_varint(data, pos)
+        non_shared, pos = read_varint(data, pos)
+        value_length, pos = read_varint(data, pos)
+        key = key[:shared] + data[pos:pos + non_shared]
+        pos += non_shared
+        entries.append((key, data[pos:pos + value_length]))
+        pos += value_length
+    return entries
+
+
+def read_sstable(path):
+    "Read all entries of an uncompressed SSTable file."
+    with open(path, 'rb') as ifh:
+        data = ifh.read()
+    footer = data[-FOOTER_SIZE:]
+    if struct.unpack('<Q', footer[-8:])[0] != SSTABLE_MAGIC:
+        raise ValueError("%s is not a checkpoint index" % path)
+    _, _, pos = read_block_handle(footer)  # metaindex
+    index_offset, index_size, _ = read_block_handle(footer, pos)
+
+    def read_block(offset, size):
+        if data[offset + size] != '\x00':
+            raise ValueError("Compressed checkpoint index is not supported")
+        return parse_block(data[offset:offset + size])
+
+    entries = []
+    for _, handle in read_block(index_offset, index_size):
+        offset, size, _ = read_block_handle(handle)
+        entries.extend(read_block(offset, size))
+    return entries
+
+
+def read_checkpoint(ckpt_prefix, scope=None):
+    """Read the tensors of a TensorFlow checkpoint as NumPy arrays.
+
+    ckpt_prefix is the path without .index, as given to tf.train.Saver.
+    If scope is given, only the tensors with names starting with scope/
+    are read."""
+    nr_shards = 1
+    tensors = OrderedDict()
+    shard_data = {}
+    for name, value in read_sstable(ckpt_prefix + '.index'):
+        fields = parse_fields(value)
+        if name == '':  # BundleHeaderProto
+            nr_shards = dict(fields).get(1, 1)
+            continue
+        if scope is not None and not name.startswith(scope + '/'):
+            continue
+        entry = dict(fields)
+        dtype = entry.get(1)
+        if dtype not in DTYPES:
+            raise ValueError("Tensor %s has unsupported dtype %s" % (name, dtype))
+        shape = [dict(parse_fields(dim)).get(1, 0)
+                 for nr, dim in parse_fields(entry.get(2, '')) if nr == 2]
+        shard = entry.get(3, 0)
+        if shard not in shard_data:
+            with open('%s.data-%05d-of-%05d' % (ckpt_prefix, shard, nr_shards),
+                      'rb') as ifh:
+                shard_data[shard] = ifh.read()
+        offset = entry.get(4, 0)
+        data = shard_data[shard][offset:offset + entry.get(5, 0)]
+        tensors[name] = np.frombuffer(data, DTYPES[dtype]).reshape(shape)
+    return tensors
+
+
+def export_actor(ckpt_prefix, npz_path):
+    "Save the actor weights of a Pensieve checkpoint to an .npz file."
+    tensors = read_checkpoint(ckpt_prefix, ACTOR_SCOPE)
+    weights = {}
+    for layer in ACTOR_LAYERS:
+        for param in ('W', 'b'):
+            name = '%s/%s/%s' % (ACTOR_SCOPE, layer, param)
+            if name not in tensors:
+                raise ValueError("No %s in checkpoint %s" % (name, ckpt_prefix))
+            weights['%s/%s' % (layer, param)] = tensors[name]
+    np.savez(npz_path, **weights)
+    return weights
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class ActorModel(object):
+    """The a3c.ActorNetwork forward pass with weights from export_actor.
+
+    predict takes inputs of shape (batch, S_INFO, S_LEN) and returns the
+    action probabilities of shape (batch, A_DIM)."""
+
+    def __init__(self, npz_path, a_dim=6):
+        if np is None:
+            raise ImportError("ActorModel needs numpy")
+        self.a_dim = a_dim
+        with np.load(npz_path) as weights:
+            self.params = dict((name, weights[name].astype(np.float64))
+                               for name in weights.files)
+
+    def dense(self, layer, x):
+        return np.dot(x, self.params[layer + '/W']) + self.params[layer + '/b']
+
+    def conv_1d(self, layer, x):
+        """tflearn.conv_1d with 'same' padding and stride 1.
+
+        x has shape (batch, steps, channels)."""
+        w = self.params[layer + '/W']
+        filter_size = w.shape[0]
+        steps = x.shape[1]
+        pad_before = (filter_size - 1) // 2
+        out = np.zeros((x.shape[0], steps, w.shape[3])) + self.params[layer + '/b']
+        for tap in range(filter_size):
+            # Taps that only see the zero padding add nothing
+            shift = tap - pad_before
+            if abs(shift) >= steps:
+                continue
+            start, end = max(0, -shift), min(steps, steps - shift)
+            out[:, start:end] += np.dot(x[:, start + shift:end + shift], w[tap, 0])
+        return out.reshape(x.shape[0], -1)
+
+    def predict(self, inputs):
+        inputs = np.asarray(inputs, dtype=np.float64)
+        split_0 = relu(self.dense('FullyConnected', inputs[:, 0:1, -1]))
+        split_1 = relu(self.dense('FullyConnected_1', inputs[:, 1:2, -1]))
+        split_2 = relu(self.conv_1d('Conv1D', inputs[:, 2:3, :]))
+        split_3 = relu(self.conv_1d('Conv1D_1', inputs[:, 3:4, :]))
+        split_4 = relu(self.conv_1d('Conv1D_2', inputs[:, 4:5, :self.a_dim]))
+        split_5 = relu(self.dense('FullyConnected_2', inputs[:, 4:5, -1]))
+        merge_net = np.concatenate([split_0, split_1, split_2, split_3, split_4,
+                                    split_5], axis=1)
+        dense_net_0 = relu(self.dense('FullyConnected_3', merge_net))
+        return softmax(self.dense('FullyConnected_4', dense_net_0))
+
+
+def main():
+    parser = ArgumentParser(usage="usage: %(prog)s [options] checkpoint npzfile")
+
+    parser.add_argument("checkpoint",
+                        help="Checkpoint prefix, e.g. pensieve_pretrained_models/"
+                             "pretrain_linear_reward.ckpt")
+
+    parser.add_argument("npz_file", help="Output file for the actor weights")
+
+    args = parser.parse_args()
+    if not os.path.exists(args.checkpoint + '.index'):
+        parser.error("No checkpoint %s" % args.checkpoint)
+    weights = export_actor(args.checkpoint, args.npz_file)
+    for name in sorted(weights):
+        print("%-20s %s" % (name, weights[name].shape))
+
+
+if __name__ == "__main__":
+    main()
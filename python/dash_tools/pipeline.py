@@ -0,0 +1,312 @@
+"""Run the encode, package and verify steps for many titles as a pipeline.
+
+Each title (infile) goes through the stages
+  encode:  one batch_encoder job per variant (or one ladder job with -m)
+  package: ondemand_creator.py on the title directory, once all its
+           variants are encoded
+  verify:  ondemand_verifier.py on the MPD of the packaged title
+Every stage has its own bounded pool of workers, so that packaging and
+verification of one title runs while other titles are still encoding.
+A failed task stops the later stages of its title, but not other titles.
+
+Progress is printed as tasks finish, and a summary of the latency per stage
+is printed at the end. With --report FILE, one JSON line per task is
+written with title, stage, queue time, start and end time and exit code.
+
+The stage runners are plain functions of a task dict that return an exit
+code, and can be replaced by passing runners to Pipeline.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2017, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import shutil
+import time
+import threading
+import subprocess
+from Queue import Queue
+from collections import OrderedDict
+from argparse import ArgumentParser
+
+from batch_encoder import BatchEncoder, parse_config
+
+STAGES = ('encode', 'package', 'verify')
+DEFAULT_WORKERS = {'encode': 4, 'package': 2, 'verify': 2}
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CREATOR = os.path.join(SCRIPT_DIR, 'ondemand_creator.py')
+VERIFIER = os.path.join(SCRIPT_DIR, 'ondemand_verifier.py')
+
+
+def run_command(cmd, log_path):
+    "Run a command (string for shell, else list) with output to log_path."
+    with open(log_path, 'w') as log_file:
+        log_file.write("CMD: %s\n\n" % cmd)
+        log_file.flush()
+        return subprocess.call(cmd, shell=isinstance(cmd, basestring),
+                               stdout=log_file, stderr=log_file)
+
+
+def run_encode(task):
+    "Run the ffmpeg command of a batch_encoder job, or of a ladder job with variants."
+    variants = task['job'].get('variants', [task['job']])
+    for variant in variants:
+        open(variant['lockFile'], "wb").write("running")
+    exit_code = run_command(task['cmd'], variants[0]['get_logfile'])
+    for variant in variants[1:]:
+        shutil.copyfile(variants[0]['get_logfile'], variant['get_logfile'])
+    for variant in variants:
+        os.unlink(variant['lockFile'])
+    return exit_code
+
+
+def run_package(task):
+    "Package a title directory with ondemand_creator.py."
+    cmd = [sys.executable, CREATOR, '-c', task['configFile'], '-d',
+           task['titleDir'], '-m', os.path.basename(task['mpdPath']), '-j', '1']
+    return run_command(cmd, os.path.join(task['titleDir'], 'package.log'))
+
+
+def run_verify(task):
+    "Verify the MPD of a title with ondemand_verifier.py."
+    cmd = [sys.executable, VERIFIER, '--stdout', task['mpdPath']]
+    return run_command(cmd, os.path.join(task['titleDir'], 'verify.log'))
+
+
+DEFAULT_RUNNERS = {'encode': run_encode, 'package': run_package,
+                   'verify': run_verify}
+
+
+class Pipeline(object):
+    """Encode, package and verify titles with one worker pool per stage.
+
+    workers and runners are dicts with stage as key, and override
+    DEFAULT_WORKERS and DEFAULT_RUNNERS."""
+    #pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config_file, infiles, outdir, workers=None,
+                 runners=None, multi_output=False, mpd_name='manifest.mpd'):
+        self.config_file = config_file
+        self.infiles = infiles
+        self.outdir = outdir
+        self.workers = dict(DEFAULT_WORKERS, **(workers or {}))
+        self.runners = dict(DEFAULT_RUNNERS, **(runners or {}))
+        self.multi_output = multi_output
+        self.mpd_name = mpd_name
+        self.queues = dict((stage, Queue()) for stage in STAGES)
+        self.results = Queue()
+        self.threads = []
+        self.titles = OrderedDict()  # title -> {'titleDir', 'pending', 'failed'}
+        self.records = []
+        self.nr_outstanding = 0
+
+    def make_encode_tasks(self):
+        "Make the encode tasks with the jobs of batch_encoder."
+        encoder = BatchEncoder(parse_config(self.config_file), self.infiles,
+                               self.outdir, 1, 0, self.multi_output)
+        encoder.make_joblist()
+        for infile in self.infiles:
+            if os.path.exists(infile):
+                title = os.path.splitext(os.path.basename(infile))[0]
+                self.titles[title] = {'titleDir': os.path.normpath(
+                    os.path.join(self.outdir, title)), 'pending': 0,
+                                      'failed': False}
+        tasks = []
+        for job in encoder.jobs:
+            title = os.path.splitext(os.path.basename(job['inFile']))[0]
+            name = job.get('name', 'ladder')
+            tasks.append({'stage': 'encode', 'title': title, 'name': name,
+                          'job': job, 'cmd': encoder.create_cmd(job)})
+            self.titles[title]['pending'] += 1
+        return tasks
+
+    def title_task(self, stage, title):
+        "Make a package or verify task for a title."
+        title_dir = self.titles[title]['titleDir']
+        return {'stage': stage, 'title': title, 'name': title,
+                'titleDir': title_dir, 'configFile': self.config_file,
+                'mpdPath': os.path.join(title_dir, self.mpd_name)}
+
+    def worker(self, stage):
+        "Run tasks of a stage until getting None."
+        runner = self.runners[stage]
+        queue = self.queues[stage]
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            start = time.time()
+            error = None
+            try:
+                exit_code = runner(task)
+            except Exception, e:  #pylint: disable=broad-except
+                exit_code = -1
+                error = str(e)
+            self.results.put((task, start, time.time(), exit_code, error))
+
+    def submit(self, task):
+        "Queue a task for its stage."
+        task['queued'] = time.time()
+        self.nr_outstanding += 1
+        self.queues[task['stage']].put(task)
+
+    def task_done(self, task, start, end, exit_code, error):
+        "Record a finished task and submit the tasks that depend on it."
+        self.nr_outstanding -= 1
+        record = {'title': task['title'], 'stage': task['stage'],
+                  'name': task['name'], 'queued': task['queued'],
+                  'start': start, 'end': end, 'exit_code': exit_code,
+                  'error': error}
+        self.records.append(record)
+        title = self.titles[task['title']]
+        label = "%s %s/%s" % (task['stage'], task['title'], task['name'])
+        if exit_code != 0:
+            title['failed'] = True
+            sys.stderr.write("%s failed (%d)%s\n" % (label, exit_code,
+                                                      error and ": " + error or ""))
+        else:
+            print "%s done in %.1fs (%d tasks running or queued)" % (
+                label, end - start, self.nr_outstanding)
+        if title['failed']:
+            return
+        if task['stage'] == 'encode':
+            title['pending'] -= 1
+            if title['pending'] == 0:
+                self.submit(self.title_task('package', task['title']))
+        elif task['stage'] == 'package':
+            self.submit(self.title_task('verify', task['title']))
+
+    def run(self):
+        "Run the pipeline until all titles are done or failed."
+        for stage in STAGES:
+            for _ in range(self.workers[stage]):
+                thread = threading.Thread(target=self.worker, args=(stage,))
+                thread.daemon = True
+                thread.start()
+                self.threads.append((stage, thread))
+        for task in self.make_encode_tasks():
+            self.submit(task)
+        for title, data in self.titles.items():
+            if data['pending'] == 0:  # Already encoded
+                self.submit(self.title_task('package', title))
+        while self.nr_outstanding > 0:
+            self.task_done(*self.results.get())
+        for stage, thread in self.threads:
+            self.queues[stage].put(None)
+        for stage, thread in self.threads:
+            thread.join()
+
+    def stage_summary(self):
+        """Get latency statistics per stage.
+
+        Return dict of stage -> dict with nr_tasks, nr_failed, and mean/max
+        of run time and of wait time in queue."""
+        summary = OrderedDict()
+        for stage in STAGES:
+            records = [r for r in self.records if r['stage'] == stage]
+            if not records:
+                continue
+            run_times = [r['end'] - r['start'] for r in records]
+            wait_times = [r['start'] - r['queued'] for r in records]
+            summary[stage] = {
+                'nr_tasks': len(records),
+                'nr_failed': len([r for r in records if r['exit_code'] != 0]),
+                'mean_run_time': sum(run_times) / len(run_times),
+                'max_run_time': max(run_times),
+                'mean_wait_time': sum(wait_times) / len(wait_times),
+                'max_wait_time': max(wait_times)}
+        return summary
+
+    def failed_titles(self):
+        "Get the titles that failed in some stage."
+        return [title for title, data in self.titles.items() if data['failed']]
+
+    def print_summary(self):
+        "Print the latency per stage and the failed titles."
+        for stage, stats in self.stage_summary().items():
+            print("%-8s %3d tasks %3d failed  run %.1fs (max %.1fs)  "
+                  "wait %.1fs (max %.1fs)" %
+                  (stage, stats['nr_tasks'], stats['nr_failed'],
+                   stats['mean_run_time'], stats['max_run_time'],
+                   stats['mean_wait_time'], stats['max_wait_time']))
+        failed = self.failed_titles()
+        if failed:
+            print "Failed titles: %s" % ", ".join(failed)
+
+    def write_report(self, report_path):
+        "Write the task records as JSON lines."
+        with open(report_path, 'w') as ofh:
+            for record in self.records:
+                ofh.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def main():
+    parser = ArgumentParser(usage="usage: %(prog)s [options] configfile "
+                                  "infile1 [infile2 ...] outdir")
+
+    parser.add_argument("args", nargs="+", help="configfile, infiles and outdir")
+
+    for stage in STAGES:
+        parser.add_argument("--%s-workers" % stage,
+                            dest="%s_workers" % stage,
+                            type=int,
+                            default=DEFAULT_WORKERS[stage],
+                            help="Number of %s workers (default %d)" %
+                            (stage, DEFAULT_WORKERS[stage]))
+
+    parser.add_argument("-m", "--multi-output",
+                        action="store_true",
+                        dest="multi_output",
+                        help="Encode all variants of a title with one ffmpeg "
+                             "process")
+
+    parser.add_argument("-r", "--report",
+                        dest="report_file",
+                        default=None,
+                        help="Write a JSON line per task to this file")
+
+    args = parser.parse_args()
+    if len(args.args) < 3:
+        parser.error("configfile, at least one infile, and outdir are needed")
+    workers = dict((stage, getattr(args, "%s_workers" % stage))
+                   for stage in STAGES)
+    pipeline = Pipeline(args.args[0], args.args[1:-1], args.args[-1], workers,
+                        multi_output=args.multi_output)
+    pipeline.run()
+    pipeline.print_summary()
+    if args.report_file:
+        pipeline.write_report(args.report_file)
+    sys.exit(len(pipeline.failed_titles()))
+
+
+if __name__ == "__main__":
+    main()
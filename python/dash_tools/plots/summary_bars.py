@@ -0,0 +1,42 @@
+"""Bar plot of one metric per algorithm from an abr_benchmark.py summary.
+
+usage: python plot_xxx.py summaryfile [buffer_size]
+"""
+import os
+import sys
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from abr_benchmark import read_summary
+
+# Label and color per algorithm, in plotting order
+ALGORITHMS = [('abr', 'SimpleABR', 'yellow'),
+              ('bola', 'BOLA', 'red'),
+              ('bba0', 'BBA0', 'green'),
+              ('bba2', 'BBA2', 'blue'),
+              ('pensieve', 'Pensieve', 'cyan')]
+
+
+def plot_metric(metric, xlabel):
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    summary = read_summary(sys.argv[1])
+    if len(sys.argv) > 2:
+        buffer_size = int(sys.argv[2])
+    else:
+        buffer_size = summary[0]['buffer_size']
+    values = dict((row['algorithm'], row[metric]) for row in summary
+                  if row['buffer_size'] == buffer_size)
+    algorithms = [a for a in ALGORITHMS if a[0] in values]
+    height = [values[a[0]] for a in algorithms]
+    bars = [a[1] for a in algorithms]
+    y_pos = np.arange(len(bars))
+
+    plt.bar(y_pos, height, color=[a[2] for a in algorithms], edgecolor='black')
+    plt.xticks(y_pos, bars)
+    plt.ylabel("Average value")
+    plt.xlabel(xlabel)
+    plt.show()
@@ -0,0 +1,419 @@
+"""Routines for decoding SCTE-35 splice_info_sections and writing them as events.
+
+The decoded cues can be written as JSON lines, as emsg boxes for injection
+into CMAF segments, or as Event elements of an MPD EventStream."""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import base64
+import binascii
+import json
+from collections import namedtuple
+from struct import unpack_from
+
+from structops import uint32_to_str, uint64_to_str
+
+SCTE35_TABLE_ID = 0xfc
+PTS_MODULO = 1 << 33
+TIMESCALE = 90000
+
+EMSG_SCHEME = 'urn:scte:scte35:2013:bin'
+MPD_SCHEME = 'urn:scte:scte35:2014:xml+bin'
+SCTE35_XML_NS = 'http://www.scte.org/schemas/35/2016'
+
+# Splice command types (SCTE 35 2016, Table 7)
+SPLICE_NULL = 0x00
+SPLICE_SCHEDULE = 0x04
+SPLICE_INSERT = 0x05
+TIME_SIGNAL = 0x06
+BANDWIDTH_RESERVATION = 0x07
+PRIVATE_COMMAND = 0xff
+
+COMMAND_NAMES = {SPLICE_NULL : 'splice_null',
+                 SPLICE_SCHEDULE : 'splice_schedule',
+                 SPLICE_INSERT : 'splice_insert',
+                 TIME_SIGNAL : 'time_signal',
+                 BANDWIDTH_RESERVATION : 'bandwidth_reservation',
+                 PRIVATE_COMMAND : 'private_command'}
+
+# Splice descriptor tags (SCTE 35 2016, Table 16)
+AVAIL_DESCRIPTOR = 0x00
+DTMF_DESCRIPTOR = 0x01
+SEGMENTATION_DESCRIPTOR = 0x02
+TIME_DESCRIPTOR = 0x03
+AUDIO_DESCRIPTOR = 0x04
+
+SpliceInfo = namedtuple("SpliceInfo", "pts_adjustment tier command_type command "
+                        "descriptors section")
+SpliceInsert = namedtuple("SpliceInsert", "splice_event_id cancel out_of_network "
+                          "immediate pts_time duration auto_return "
+                          "unique_program_id avail_num avails_expected")
+TimeSignal = namedtuple("TimeSignal", "pts_time")
+SegmentationDescriptor = namedtuple("SegmentationDescriptor", "segmentation_event_id "
+                                    "cancel duration upid_type upid type_id "
+                                    "segment_num segments_expected")
+SpliceDescriptor = namedtuple("SpliceDescriptor", "tag identifier data")
+
+
+class Scte35Error(Exception):
+    "Error in SCTE-35 section data."
+
+
+def read_pts(data, pos):
+    "Read a 33-bit PTS from the 5 bytes at pos (7 leading bits ignored)."
+    high, low = unpack_from('>BI', data, pos)
+    return ((high & 0x01) << 32) | low
+
+
+def parse_splice_time(data, pos):
+    "Return (pts_time or None, new position)."
+    if ord(data[pos]) & 0x80:
+        return read_pts(data, pos), pos + 5
+    return None, pos + 1
+
+
+def parse_splice_insert(data, pos):
+    "Return (SpliceInsert, new position)."
+    splice_event_id, flags = unpack_from('>IB', data, pos)
+    pos += 5
+    cancel = bool(flags & 0x80)
+    out_of_network = immediate = auto_return = False
+    pts_time = duration = None
+    unique_program_id = avail_num = avails_expected = 0
+    if not cancel:
+        flags = ord(data[pos])
+        pos += 1
+        out_of_network = bool(flags & 0x80)
+        program_splice = flags & 0x40
+        duration_flag = flags & 0x20
+        immediate = bool(flags & 0x10)
+        if program_splice and not immediate:
+            pts_time, pos = parse_splice_time(data, pos)
+        if not program_splice:
+            component_count = ord(data[pos])
+            pos += 1
+            for _ in range(component_count):
+                pos += 1 # component_tag
+                if not immediate:
+                    # Use the first component's splice time for the event
+                    component_pts, pos = parse_splice_time(data, pos)
+                    if pts_time is None:
+                        pts_time = component_pts
+        if duration_flag:
+            auto_return = bool(ord(data[pos]) & 0x80)
+            duration = read_pts(data, pos)
+            pos += 5
+        unique_program_id, avail_num, avails_expected = unpack_from('>HBB', data, pos)
+        pos += 4
+    return SpliceInsert(splice_event_id, cancel, out_of_network, immediate,
+                        pts_time, duration, auto_return, unique_program_id,
+                        avail_num, avails_expected), pos
+
+
+def parse_segmentation_descriptor(data):
+    "Parse the part of a segmentation_descriptor after the identifier."
+    segmentation_event_id, flags = unpack_from('>IB', data, 0)
+    pos = 5
+    cancel = bool(flags & 0x80)
+    duration = None
+    upid_type = type_id = segment_num = segments_expected = 0
+    upid = ''
+    if not cancel:
+        flags = ord(data[pos])
+        pos += 1
+        program_segmentation = flags & 0x80
+        duration_flag = flags & 0x40
+        if not program_segmentation:
+            component_count = ord(data[pos])
+            pos += 1 + 6 * component_count
+        if duration_flag:
+            high, low = unpack_from('>BI', data, pos)
+            duration = (high << 32) | low
+            pos += 5
+        upid_type, upid_length = unpack_from('>BB', data, pos)
+        pos += 2
+        upid = data[pos:pos + upid_length]
+        pos += upid_length
+        type_id, segment_num, segments_expected = unpack_from('>BBB', data, pos)
+    return SegmentationDescriptor(segmentation_event_id, cancel, duration, upid_type,
+                                  upid, type_id, segment_num, segments_expected)
+
+
+def parse_descriptors(data, pos, end):
+    "Parse the splice descriptor loop."
+    descriptors = []
+    while pos + 6 <= end:
+        tag = ord(data[pos])
+        length = ord(data[pos + 1])
+        identifier = data[pos + 2:pos + 6]
+        body = data[pos + 6:pos + 2 + length]
+        pos += 2 + length
+        if pos > end:
+            raise Scte35Error('Splice descriptor overruns descriptor loop')
+        if tag == SEGMENTATION_DESCRIPTOR and identifier == 'CUEI':
+            descriptors.append(parse_segmentation_descriptor(body))
+        else:
+            descriptors.append(SpliceDescriptor(tag, identifier, body))
+    return descriptors
+
+
+def parse_splice_info_section(section):
+    "Decode a complete splice_info_section into a SpliceInfo record."
+    if len(section) < 17:
+        raise Scte35Error('Section too short (%d bytes)' % len(section))
+    table_id, length_field = unpack_from('>BH', section, 0)
+    if table_id != SCTE35_TABLE_ID:
+        raise Scte35Error('Bad table_id 0x%02x' % table_id)
+    section_length = length_field & 0x0fff
+    if section_length + 3 > len(section):
+        raise Scte35Error('Section length %d exceeds data' % section_length)
+    end = section_length + 3 - 4 # CRC_32
+    encrypted = ord(section[4]) & 0x80
+    pts_adjustment = read_pts(section, 4)
+    tier_and_length = unpack_from('>I', section, 9)[0]
+    tier = (tier_and_length >> 12) & 0x0fff
+    command_length = tier_and_length & 0x0fff
+    command_type = ord(section[13])
+    pos = 14
+    if encrypted:
+        # Commands and descriptors cannot be decoded, keep the raw section
+        return SpliceInfo(pts_adjustment, tier, command_type, None, [], section[:end + 4])
+
+    command = None
+    if command_type == SPLICE_INSERT:
+        command, command_end = parse_splice_insert(section, pos)
+    elif command_type == TIME_SIGNAL:
+        pts_time, command_end = parse_splice_time(section, pos)
+        command = TimeSignal(pts_time)
+    elif command_length == 0xfff:
+        raise Scte35Error('Unknown length of splice command 0x%02x' % command_type)
+    if command_length != 0xfff:
+        command_end = pos + command_length
+
+    descriptor_loop_length = unpack_from('>H', section, command_end)[0]
+    pos = command_end + 2
+    descriptors = parse_descriptors(section, pos, min(pos + descriptor_loop_length, end))
+    return SpliceInfo(pts_adjustment, tier, command_type, command, descriptors,
+                      section[:end + 4])
+
+
+def splice_pts(info):
+    "The adjusted PTS of the splice point, or None if immediate or unknown."
+    command = info.command
+    if command is None or command.pts_time is None:
+        return None
+    return (command.pts_time + info.pts_adjustment) % PTS_MODULO
+
+
+def media_time(pts, first_pts):
+    "Map a 90kHz PTS to media time in ticks from first_pts, handling one wrap."
+    return (pts - int(first_pts)) % PTS_MODULO
+
+
+def event_duration(info):
+    "The event duration in 90kHz ticks, or None if not signalled."
+    if isinstance(info.command, SpliceInsert) and info.command.duration is not None:
+        return info.command.duration
+    for desc in info.descriptors:
+        if isinstance(desc, SegmentationDescriptor) and desc.duration is not None:
+            return desc.duration
+    return None
+
+
+def event_id(info, default=0):
+    "The splice or segmentation event id of the cue."
+    if isinstance(info.command, SpliceInsert):
+        return info.command.splice_event_id
+    for desc in info.descriptors:
+        if isinstance(desc, SegmentationDescriptor):
+            return desc.segmentation_event_id
+    return default
+
+
+def cue_to_dict(info, first_pts=0):
+    "Convert a SpliceInfo to a dict suitable for JSON output."
+    result = {'command' : COMMAND_NAMES.get(info.command_type, 'reserved'),
+              'command_type' : info.command_type,
+              'pts_adjustment' : info.pts_adjustment,
+              'tier' : info.tier}
+    pts = splice_pts(info)
+    if pts is not None:
+        result['pts'] = pts
+        result['media_time'] = media_time(pts, first_pts) / float(TIMESCALE)
+    duration = event_duration(info)
+    if duration is not None:
+        result['duration'] = duration / float(TIMESCALE)
+    if isinstance(info.command, SpliceInsert):
+        result['splice_insert'] = dict((k, v) for k, v in info.command._asdict().items()
+                                       if k not in ('pts_time', 'duration'))
+    descriptors = []
+    for desc in info.descriptors:
+        if isinstance(desc, SegmentationDescriptor):
+            d = desc._asdict()
+            d['upid'] = binascii.hexlify(desc.upid)
+            if desc.duration is not None:
+                d['duration'] = desc.duration / float(TIMESCALE)
+            d['tag'] = SEGMENTATION_DESCRIPTOR
+        else:
+            d = {'tag' : desc.tag, 'identifier' : desc.identifier,
+                 'data' : binascii.hexlify(desc.data)}
+        descriptors.append(d)
+    result['descriptors'] = descriptors
+    result['section'] = base64.b64encode(info.section)
+    return result
+
+
+def make_string(text):
+    return text + '\x00'
+
+
+def make_emsg(info, first_pts=0, segment_start=0, timescale=TIMESCALE, default_id=0,
+              version=0):
+    """Make an emsg box carrying the cue. The message data is the binary splice_info_section.
+
+    A version 0 box has the presentation time relative to segment_start, the
+    media time in timescale units of the segment the box is injected into.
+    A version 1 box has a 64-bit presentation time from media start, or
+    segment_start for a cue without splice time. 32-bit fields that
+    overflow give a ValueError."""
+    pts = splice_pts(info)
+    if pts is None:
+        presentation_time = 0 if version == 0 else segment_start
+    else:
+        presentation_time = media_time(pts, first_pts) * timescale // TIMESCALE
+        if version == 0:
+            presentation_time = max(presentation_time - segment_start, 0)
+    if version == 0 and presentation_time > 0xffffffff:
+        raise ValueError("emsg presentation_time_delta %d does not fit in 32 bits, "
+                         "use version 1" % presentation_time)
+    duration = event_duration(info)
+    if duration is None:
+        duration = 0xffffffff
+    else:
+        duration = duration * timescale // TIMESCALE
+        if duration >= 0xffffffff:
+            raise ValueError("emsg event_duration %d does not fit in 32 bits" % duration)
+    scheme_and_value = make_string(EMSG_SCHEME) + make_string('')
+    if version == 0:
+        fields = [scheme_and_value, uint32_to_str(timescale),
+                  uint32_to_str(presentation_time), uint32_to_str(duration),
+                  uint32_to_str(event_id(info, default_id))]
+    else:
+        fields = [uint32_to_str(timescale), uint64_to_str(presentation_time),
+                  uint32_to_str(duration), uint32_to_str(event_id(info, default_id)),
+                  scheme_and_value]
+    payload = ''.join([uint32_to_str(version << 24)] + fields + [info.section])
+    return uint32_to_str(8 + len(payload)) + 'emsg' + payload
+
+
+class JsonEventWriter(object):
+    "Write one JSON object per cue and line."
+
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+
+    def write(self, info, first_pts=0):
+        self.file_handle.write(json.dumps(cue_to_dict(info, first_pts), sort_keys=True) + '\n')
+
+    def close(self):
+        self.file_handle.flush()
+
+
+class EmsgEventWriter(object):
+    """Write one version 1 emsg box per cue with presentation time from media start.
+
+    The 64-bit presentation time handles recordings longer than the 13.25
+    hours that fit in 32 bits at 90kHz."""
+
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+        self.nr_events = 0
+
+    def write(self, info, first_pts=0):
+        self.file_handle.write(make_emsg(info, first_pts, default_id=self.nr_events,
+                                         version=1))
+        self.nr_events += 1
+
+    def close(self):
+        self.file_handle.flush()
+
+
+class MpdEventStreamWriter(object):
+    "Write an MPD EventStream element with one Event per cue (SCTE 214-1)."
+
+    def __init__(self, file_handle, timescale=TIMESCALE):
+        self.file_handle = file_handle
+        self.timescale = timescale
+        self.nr_events = 0
+        self.file_handle.write('<EventStream schemeIdUri="%s" timescale="%d">\n' %
+                               (MPD_SCHEME, timescale))
+
+    def write(self, info, first_pts=0):
+        attributes = ['id="%d"' % event_id(info, self.nr_events)]
+        pts = splice_pts(info)
+        if pts is not None:
+            attributes.append('presentationTime="%d"' %
+                              (media_time(pts, first_pts) * self.timescale // TIMESCALE))
+        duration = event_duration(info)
+        if duration is not None:
+            attributes.append('duration="%d"' % (duration * self.timescale // TIMESCALE))
+        self.file_handle.write('  <Event %s>\n' % ' '.join(attributes))
+        self.file_handle.write('    <Signal xmlns="%s">\n' % SCTE35_XML_NS)
+        self.file_handle.write('      <Binary>%s</Binary>\n' % base64.b64encode(info.section))
+        self.file_handle.write('    </Signal>\n  </Event>\n')
+        self.nr_events += 1
+
+    def close(self):
+        self.file_handle.write('</EventStream>\n')
+        self.file_handle.flush()
+
+
+EVENT_WRITERS = {'json' : JsonEventWriter,
+                 'emsg' : EmsgEventWriter,
+                 'mpd' : MpdEventStreamWriter}
+
+
+def cue_summary(info, first_pts=0):
+    "One-line description of a cue."
+    text = '%s' % COMMAND_NAMES.get(info.command_type, 'reserved 0x%02x' % info.command_type)
+    pts = splice_pts(info)
+    if pts is not None:
+        text += ' pts=%d media_time=%.3f' % (pts, media_time(pts, first_pts) / float(TIMESCALE))
+    duration = event_duration(info)
+    if duration is not None:
+        text += ' duration=%.3f' % (duration / float(TIMESCALE))
+    if isinstance(info.command, SpliceInsert):
+        text += ' event_id=%d out_of_network=%d' % (info.command.splice_event_id,
+                                                    info.command.out_of_network)
+    for desc in info.descriptors:
+        if isinstance(desc, SegmentationDescriptor):
+            text += ' segmentation(id=%d, type=0x%02x)' % (desc.segmentation_event_id,
+                                                          desc.type_id)
+    return text
@@ -0,0 +1,84 @@
+"""
+Test the benchmark of the ABR clients
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+from abr_benchmark import make_runs, run_simulations, summarize, write_table
+from abr_benchmark import read_summary, SUMMARY_FIELDS
+
+SERVER_PATH = os.path.join(test_utils.TEST_PATH, "..", "server")
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.mpd_path = os.path.join(SERVER_PATH, "static", "manifest.mpd")
+        self.traces = [os.path.join(SERVER_PATH, "3G_trace.json"),
+                       os.path.join(self.tmp_dir, "slow.json")]
+        with open(self.traces[1], 'wb') as ofh:
+            json.dump([{'duration_ms': 1000, 'bandwidth_kbps': 500}], ofh)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parallel_same_as_serial(self):
+        runs = make_runs(self.mpd_path, ['abr', 'bba0'], self.traces, [10, 20])
+        serial = run_simulations(runs)
+        self.assertEqual(len(serial), 8)
+        self.assertEqual(run_simulations(runs, 3), serial)
+        summary = summarize(serial)
+        self.assertEqual([(r['algorithm'], r['buffer_size'], r['nr_runs'])
+                          for r in summary],
+                         [('abr', 10, 2), ('abr', 20, 2), ('bba0', 10, 2), ('bba0', 20, 2)])
+        group = [r for r in serial if r['algorithm'] == 'abr' and r['buffer_size'] == 20]
+        self.assertAlmostEqual(summary[1]['qoe'], (group[0]['qoe'] + group[1]['qoe']) / 2)
+        self.assertAlmostEqual(summary[1]['average_bitrate_reward'],
+                               summary[1]['bitrate_reward'] / group[0]['nr_segments'])
+        for name in ('summary.csv', 'summary.json'):
+            path = os.path.join(self.tmp_dir, name)
+            write_table(summary, SUMMARY_FIELDS, path)
+            for row, read_row in zip(summary, read_summary(path)):
+                for field in SUMMARY_FIELDS:
+                    self.assertAlmostEqual(read_row[field], row[field])
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBenchmark)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,87 @@
+"""
+Test the offline simulator of the ABR clients
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+import unittest
+
+import test_utils
+from abr_simulator import NetworkTrace, load_mpd, simulate
+
+SERVER_PATH = os.path.join(test_utils.TEST_PATH, "..", "server")
+
+class TestNetworkTrace(unittest.TestCase):
+
+    def test_transfer_time(self):
+        trace = NetworkTrace([(1, 8000, 0.1), (1, 16000, 0.1)])
+        # 0.1s latency, 0.9s at 8kbps and 800 bits at 16kbps
+        self.assertAlmostEqual(trace.transfer_time(0, 1000), 1.05)
+        # The trace is repeated
+        self.assertAlmostEqual(trace.transfer_time(1.5, 3000), 2.1)
+        self.assertAlmostEqual(trace.transfer_time(11.5, 3000), 2.1)
+
+    def test_bad_trace(self):
+        self.assertRaises(ValueError, NetworkTrace, [(1, 0, 0.1)])
+
+
+class TestSimulate(unittest.TestCase):
+
+    def setUp(self):
+        self.mpd = load_mpd(os.path.join(SERVER_PATH, "static", "manifest.mpd"))
+        self.trace = NetworkTrace.from_file(os.path.join(SERVER_PATH, "3G_trace.json"))
+
+    def test_clients(self):
+        for algorithm in ('abr', 'bola', 'bba0', 'bba2'):
+            start = time.time()
+            metrics = simulate(algorithm, self.mpd, self.trace)
+            self.assertTrue(time.time() - start < 1)
+            # Init segment and 48 media segments (49 for AbrClient)
+            self.assertEqual(metrics['nr_downloads'], 50 if algorithm == 'abr' else 49)
+            self.assertTrue(metrics['session_time'] > 100)
+            self.assertTrue(metrics['play_time'] >= 48 * 3.99)
+            self.assertEqual(simulate(algorithm, self.mpd, self.trace), metrics)
+
+    def test_fast_network(self):
+        fast = NetworkTrace([(1, 100e6, 0.01)])
+        metrics = simulate('abr', self.mpd, fast)
+        self.assertEqual(metrics['rebuffer_count'], 0)
+        self.assertTrue(metrics['average_bitrate'] > 4000000)
+        self.assertTrue(simulate('abr', self.mpd, self.trace)['average_qoe'] <
+                        metrics['average_qoe'])
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestNetworkTrace)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSimulate))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
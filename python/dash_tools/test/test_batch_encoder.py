@@ -0,0 +1,289 @@
+"""
+Test batch encoding of ladders, chunks and job queues
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import csv
+import json
+import shutil
+import socket
+import tempfile
+import unittest
+
+import test_utils
+import batch_encoder
+from batch_encoder import BatchEncoder, JobQueue, find_missing_keyframes
+from batch_encoder import write_job_stats
+
+# Stands in for ffmpeg. Logs start and end and writes its arguments to
+# the output files.
+STUB_FFMPEG = """#!/bin/sh
+outs=""
+prev=""
+for arg in "$@"; do
+    if [ "$prev" = "-y" ]; then outs="$outs $arg"; fi
+    prev=$arg
+done
+echo "start$outs" >> %(events)s
+sleep 0.3
+echo "end$outs" >> %(events)s
+for out in $outs; do echo "$@" > $out; done
+"""
+
+# Stands in for ffprobe. The input is 10s and there is a keyframe every 2s.
+STUB_FFPROBE = """#!/bin/sh
+case "$*" in
+    *format=duration*) echo '{"format": {"duration": "10.000000"}}';;
+    *) echo '{"packets": [
+{"pts_time": "0.080000", "flags": "K_"}, {"pts_time": "0.120000", "flags": "__"},
+{"pts_time": "2.080000", "flags": "K_"}, {"pts_time": "4.080000", "flags": "K_"},
+{"pts_time": "6.080000", "flags": "K_"}, {"pts_time": "8.080000", "flags": "K_"},
+{"pts_time": "10.040000", "flags": "__"}]}';;
+esac
+"""
+
+VIDEO = {"contentType": "video", "frameRate": 25, "gopLength": 50,
+         "segmentDurationMs": 2000, "vrate": 1000, "name": "v1"}
+
+class TestBatchEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.events = os.path.join(self.tmp_dir, 'events')
+        stub = os.path.join(self.tmp_dir, 'ffmpeg')
+        with open(stub, 'w') as ofh:
+            ofh.write(STUB_FFMPEG % {'events': self.events})
+        os.chmod(stub, 0755)
+        probe_stub = os.path.join(self.tmp_dir, 'ffprobe')
+        with open(probe_stub, 'w') as ofh:
+            ofh.write(STUB_FFPROBE)
+        os.chmod(probe_stub, 0755)
+        self.old_ffmpeg = batch_encoder.FFMPEG
+        self.old_ffprobe = batch_encoder.FFPROBE
+        batch_encoder.FFMPEG = stub
+        batch_encoder.FFPROBE = probe_stub
+        self.infile = os.path.join(self.tmp_dir, 'movie.mov')
+        open(self.infile, 'w').close()
+
+    def tearDown(self):
+        batch_encoder.FFMPEG = self.old_ffmpeg
+        batch_encoder.FFPROBE = self.old_ffprobe
+        shutil.rmtree(self.tmp_dir)
+
+    def test_weighted_jobs(self):
+        config = [VIDEO]
+        for i in range(4):
+            config.append({"contentType": "audio", "language": "eng",
+                           "arate": 64, "name": "a%d" % i})
+        encoder = BatchEncoder(config, [self.infile],
+                               os.path.join(self.tmp_dir, 'out'), 1, 0)
+        encoder.make_joblist()
+        encoder.run_jobs()
+        self.assertEqual(encoder.nr_jobs_done, 5)
+        self.assertEqual(len(encoder.job_stats), 5)
+        for stats in encoder.job_stats:
+            self.assertEqual(stats['exitCode'], 0)
+            self.assertTrue(stats['wallTime'] >= 0.3)
+            self.assertTrue(stats['maxRssKb'] > 0)
+            self.assertEqual(stats['outputBytes'], os.path.getsize(stats['outFile']))
+            # The stub ffprobe says 10s
+            self.assertAlmostEqual(stats['bitrateKbps'], stats['outputBytes'] * 0.0008)
+            self.assertEqual(stats['targetKbps'], 1000 if stats['name'] == 'v1' else 64)
+            self.assertAlmostEqual(stats['bitrateRatio'],
+                                   stats['bitrateKbps'] / stats['targetKbps'])
+        csv_path = os.path.join(self.tmp_dir, 'stats.csv')
+        write_job_stats(encoder.job_stats, csv_path)
+        rows = list(csv.DictReader(open(csv_path, 'rb')))
+        self.assertEqual([row['name'] for row in rows],
+                         [stats['name'] for stats in encoder.job_stats])
+        json_path = os.path.join(self.tmp_dir, 'stats.json')
+        write_job_stats(encoder.job_stats, json_path)
+        self.assertEqual(json.load(open(json_path)), encoder.job_stats)
+        self.assertTrue(0 < encoder.utilization <= 1)
+        running = []
+        max_running = 0
+        for line in open(self.events):
+            event, path = line.split()
+            if event == 'start':
+                running.append(os.path.basename(path))
+                # The video job fills the whole budget
+                self.assertTrue('v1.mp4' not in running[:-1])
+                max_running = max(max_running, len(running))
+            else:
+                running.remove(os.path.basename(path))
+        self.assertEqual(max_running, 4)
+        for job in encoder.jobs:
+            self.assertTrue(os.path.exists(job['outFile']))
+            self.assertFalse(os.path.exists(job['lockFile']))
+
+    def test_ladder(self):
+        config = [dict(VIDEO, deinterlace=1, width=w, name="v%d" % w)
+                  for w in (640, 1280)]
+        config.append(dict(VIDEO, deinterlace=1, name="vfull"))
+        config.append({"contentType": "audio", "language": "eng",
+                       "arate": 64, "name": "a1"})
+        encoder = BatchEncoder(config, [self.infile],
+                               os.path.join(self.tmp_dir, 'out'), 4, 0, True)
+        encoder.make_joblist()
+        self.assertEqual(encoder.get_nr_jobs(), 1)
+        encoder.run_jobs()
+        self.assertEqual(len(open(self.events).readlines()), 2)
+        variants = encoder.jobs[0]['variants']
+        args = open(variants[0]['outFile']).read()
+        self.assertTrue("[0:v]yadif=0:-1:0,split=3[s0][s1][s2];"
+                        "[s0]scale=640:-1[v0];[s1]scale=1280:-1[v1];"
+                        "[s2]null[v2] " in args)
+        self.assertEqual(args.count("-map"), 4)
+        for variant in variants:
+            self.assertEqual(open(variant['outFile']).read(), args)
+            self.assertTrue(open(variant['get_logfile']).read().startswith(
+                "CMD: %s -i " % batch_encoder.FFMPEG))
+            self.assertFalse(os.path.exists(variant['lockFile']))
+
+    def test_chunks(self):
+        outdir = os.path.join(self.tmp_dir, 'out')
+        encoder = BatchEncoder([VIDEO], [self.infile], outdir, 4, 0,
+                               chunk_duration=3)
+        encoder.make_joblist()
+        chunks = encoder.jobs
+        self.assertEqual([(c['chunkStart'], c['chunkDuration']) for c in chunks],
+                         [(0, 4), (4, 4), (8, 4)])
+        encoder.run_jobs()
+        self.assertEqual(encoder.nr_jobs_done, 4)
+        events = [line.split() for line in open(self.events)]
+        # All chunks run in parallel, then they are concatenated
+        self.assertEqual([e[0] for e in events], ['start'] * 3 + ['end'] * 3 +
+                         ['start', 'end'])
+        outfile = os.path.join(outdir, 'movie', 'v1.mp4')
+        self.assertTrue("-f concat -safe 0 -i %s_chunks.txt -c copy -y %s" %
+                        (outfile[:-4], outfile) in open(outfile).read())
+        # Chunk logs are kept, chunk files and the chunk list are removed
+        self.assertEqual(sorted(os.listdir(os.path.dirname(outfile))),
+                         ['v1.log', 'v1.mp4', 'v1_chunk000.log', 'v1_chunk001.log',
+                          'v1_chunk002.log'])
+
+    def test_chunks_bad_keyframes(self):
+        # The keyframe at 4s is lost in the concatenated output
+        with open(batch_encoder.FFPROBE, 'w') as ofh:
+            ofh.write(STUB_FFPROBE.replace('"4.080000", "flags": "K_"',
+                                           '"4.080000", "flags": "__"'))
+        outdir = os.path.join(self.tmp_dir, 'out')
+        encoder = BatchEncoder([VIDEO], [self.infile], outdir, 4, 0,
+                               chunk_duration=3)
+        encoder.make_joblist()
+        encoder.run_jobs()
+        self.assertEqual((encoder.nr_jobs_done, encoder.nr_jobs_failed), (4, 1))
+        concat_stats = encoder.job_stats[-1]
+        self.assertEqual((concat_stats['contentType'], concat_stats['exitCode']),
+                         ('concat', batch_encoder.BAD_KEYFRAMES_EXIT_CODE))
+        # The bad output is moved away and the chunks are kept
+        self.assertEqual(sorted(os.listdir(os.path.join(outdir, 'movie'))),
+                         ['v1.log', 'v1.mp4.bad', 'v1_chunk000.log', 'v1_chunk000.mp4',
+                          'v1_chunk001.log', 'v1_chunk001.mp4', 'v1_chunk002.log',
+                          'v1_chunk002.mp4', 'v1_chunks.txt'])
+
+    def test_missing_keyframes(self):
+        frame = 0.04
+        packets = [(0.08 + i * frame, i % 25 == 0) for i in range(250)]
+        self.assertEqual(find_missing_keyframes(packets, 2.0, frame), [])
+        packets[100] = (packets[100][0], False)
+        self.assertEqual(find_missing_keyframes(packets, 2.0, frame), [2])
+        packets[101] = (packets[101][0], True)  # One frame late
+        self.assertEqual(find_missing_keyframes(packets, 2.0, frame), [2])
+
+    def test_queue(self):
+        outdir = os.path.join(self.tmp_dir, 'out')
+        db_path = os.path.join(self.tmp_dir, 'queue.db')
+        config = [VIDEO, {"contentType": "audio", "language": "eng",
+                          "arate": 64, "name": "a1"}]
+        job_queue = JobQueue(db_path)
+        encoder = BatchEncoder(config, [self.infile], outdir, 4, 0, job_queue=job_queue)
+        encoder.make_joblist()
+        self.assertEqual(encoder.get_nr_jobs(), 2)
+        # A worker on this host died while running the first job
+        self.assertEqual(job_queue.claim()['name'], 'v1')
+        job_queue.db.execute("UPDATE jobs SET worker = ?",
+                             ("%s:%d" % (socket.gethostname(), 2 ** 22 + 1),))
+        job_queue.close()
+        job_queue = JobQueue(db_path)
+        self.assertEqual(job_queue.recover(), 1)
+        encoder = BatchEncoder(config, [self.infile], outdir, 4, 0, job_queue=job_queue)
+        encoder.make_joblist()
+        encoder.run_jobs()
+        rows = job_queue.db.execute("SELECT out_file, state, attempts, exit_code, "
+                                    "output_size FROM jobs ORDER BY rowid").fetchall()
+        self.assertEqual([tuple(row[1:4]) for row in rows],
+                         [('done', 2, 0), ('done', 1, 0)])
+        for row in rows:
+            self.assertEqual(row[4], os.path.getsize(row[0]))
+        # Failing jobs are retried up to max_attempts
+        batch_encoder.FFMPEG = 'false'
+        job_queue = JobQueue(os.path.join(self.tmp_dir, 'fail.db'), max_attempts=2)
+        encoder = BatchEncoder(config[1:], [self.infile], outdir, 4, 0, job_queue=job_queue)
+        encoder.make_joblist()
+        encoder.run_jobs()
+        self.assertEqual(encoder.nr_jobs_done, 2)
+        self.assertEqual(job_queue.db.execute("SELECT state, attempts, exit_code "
+                                              "FROM jobs").fetchall(),
+                         [('failed', 2, 1)])
+
+    def test_queue_other_directory(self):
+        tmp_dir = os.path.realpath(self.tmp_dir)
+        worker_dir = os.path.join(tmp_dir, 'worker')
+        os.mkdir(worker_dir)
+        cwd = os.getcwd()
+        try:
+            os.chdir(tmp_dir)
+            job_queue = JobQueue('queue.db')
+            encoder = BatchEncoder([VIDEO], ['movie.mov'], 'out', 4, 0, job_queue=job_queue)
+            encoder.make_joblist()
+            job_queue.close()
+            # A worker started elsewhere with only the queue file
+            os.chdir(worker_dir)
+            job_queue = JobQueue(os.path.join(tmp_dir, 'queue.db'))
+            encoder = BatchEncoder([], [], None, 4, 0, job_queue=job_queue)
+            encoder.make_joblist()
+            encoder.run_jobs()
+        finally:
+            os.chdir(cwd)
+        outfile = os.path.join(tmp_dir, 'out', 'movie', 'v1.mp4')
+        self.assertEqual(job_queue.db.execute("SELECT out_file, state FROM "
+                                              "jobs").fetchall(), [(outfile, 'done')])
+        self.assertTrue(os.path.join(tmp_dir, 'movie.mov') in open(outfile).read().split())
+        self.assertEqual(os.listdir(worker_dir), [])
+        job_queue.close()
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBatchEncoder)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,164 @@
+"""
+Test HTTP input with keep-alive connection pooling, chunks and range reads
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+
+import test_utils
+import httpio
+import mp4
+
+from structops import uint32_to_str
+
+BIG_MDAT_SIZE = 4 * 1024 * 1024
+
+class RangeRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Keep-alive file server with support for single byte ranges.
+
+    The total size in Content-Range is * for URLs with the query ?unknown."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as ifh:
+            data = ifh.read()
+        range_header = self.headers.get('Range')
+        if range_header:
+            start, end = range_header.split('=')[1].split('-')
+            start, end = int(start), min(int(end), len(data) - 1)
+            self.send_response(206)
+            total = '*' if self.path.endswith('?unknown') else str(len(data))
+            self.send_header('Content-Range', 'bytes %d-%d/%s' % (start, end, total))
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # Clients closing connections early
+
+class TestHttpInput(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        data_dir = os.path.join(test_utils.TEST_PATH, 'data')
+        with open(os.path.join(data_dir, 'video_init.mp4'), 'rb') as ifh:
+            init = ifh.read()
+        with open(os.path.join(data_dir, 'video_segment.m4s'), 'rb') as ifh:
+            segment = ifh.read()
+        # A progressive-like file with a large mdat between the headers
+        cls.asset = init + uint32_to_str(8 + BIG_MDAT_SIZE) + 'mdat' + '\x00' * BIG_MDAT_SIZE + segment
+        with open(os.path.join(cls.tmp_dir, 'asset.mp4'), 'wb') as ofh:
+            ofh.write(cls.asset)
+        os.chdir(cls.tmp_dir)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:%d/asset.mp4' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.chdir(test_utils.TEST_PATH)
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_chunks_over_keep_alive_connection(self):
+        pool = httpio.ConnectionPool()
+        for _ in range(2):
+            chunks = list(httpio.iter_chunks(self.url, chunk_size=100000, pool=pool))
+            self.assertTrue(max(len(c) for c in chunks) <= 100000)
+            self.assertEqual(''.join(chunks), self.asset)
+        self.assertEqual(pool.nr_requests, 2)
+        self.assertEqual(pool.nr_connects, 1)
+
+    def test_fetch_timing(self):
+        pool = httpio.ConnectionPool()
+        timings = []
+        for _ in range(3):
+            status, data, timing = httpio.fetch(self.url, pool)
+            self.assertEqual((status, data), (200, self.asset))
+            self.assertAlmostEqual(timing.total, timing.connect + timing.first_byte +
+                                   timing.transfer, places=2)
+            timings.append(timing)
+        self.assertEqual([t.reused for t in timings], [False, True, True])
+        self.assertEqual(timings[1].connect, 0)
+        self.assertEqual(pool.nr_connects, 1)
+        status, _, timing = httpio.fetch(self.url.replace('asset', 'missing'), pool)
+        self.assertEqual((status, timing.reused), (404, True))
+
+    def test_max_bytes(self):
+        chunks = list(httpio.iter_chunks(self.url, chunk_size=1000, max_bytes=2500))
+        self.assertEqual(''.join(chunks), self.asset[:2500])
+
+    def test_range_reader_skips_mdat(self):
+        reader = httpio.RangeReader(self.url, block_size=4096)
+        self.assertEqual(len(reader), len(self.asset))
+        self.assertEqual(reader[100:200], self.asset[100:200])
+        remote = mp4.mp4(reader, len(reader))
+        local = mp4.mp4(self.asset, len(self.asset))
+        self.assertEqual(remote.description(), local.description())
+        self.assertEqual([b.type for b in remote.children],
+                         ['ftyp', 'moov', 'mdat', 'styp', 'moof', 'mdat'])
+        self.assertTrue(reader.bytes_read < 64 * 1024)
+
+    def test_range_reader_unknown_size(self):
+        reader = httpio.RangeReader(self.url + '?unknown', block_size=4096)
+        self.assertEqual(len(reader), len(self.asset))
+        self.assertEqual(reader[-100:], self.asset[-100:])
+        self.assertEqual(reader.nr_requests, 2)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestHttpInput)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,117 @@
+"""
+Test creation of multi-bitrate DASH OnDemand assets
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+from ondemand_creator import DashOnDemandCreator
+from ondemand_verifier import check_asset
+from test_track_resegmenter import make_track
+from test_ondemand_packager import make_progressive
+
+MPD = """<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011">
+ <Period>
+  <AdaptationSet>
+   <Representation id="a1"><SegmentBase indexRange="800-900"/></Representation>
+   <Representation id="a2"><SegmentBase indexRange="800-900"/></Representation>
+  </AdaptationSet>
+ </Period>
+</MPD>
+"""
+
+class TestDashOnDemandCreator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        config = [{"contentType": "audio",
+                   "variants": [{"name": "a1"}, {"name": "a2"}]}]
+        self.config_file = os.path.join(self.tmp_dir, 'config.json')
+        with open(self.config_file, 'w') as ofh:
+            json.dump(config, ofh)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_creator(self, workers):
+        for track in ('a1', 'a2'):
+            os.rename(make_track(self.tmp_dir, 'audio'),
+                      os.path.join(self.tmp_dir, '%s_dashinit.mp4' % track))
+        return DashOnDemandCreator(self.config_file, self.tmp_dir,
+                                   'manifest.mpd', workers)
+
+    def test_parallel_resegment(self):
+        creator = self.make_creator(2)
+        sidx_ranges = creator.resegment_audio_tracks(creator.tracks, 500)
+        self.assertEqual(sorted(sidx_ranges.keys()), ['a1', 'a2'])
+        self.assertEqual(sidx_ranges['a1'], sidx_ranges['a2'])
+        self.assertEqual([t[0] for t in creator.track_timings], ['a1', 'a2'])
+        data = [open(creator.file_path('%s_dashinit.mp4' % track), 'rb').read()
+                for track in ('a1', 'a2')]
+        self.assertEqual(data[0], data[1])
+
+    def test_process(self):
+        config = [{"contentType": "video", "segmentDurationMs": 2000,
+                   "variants": [{"name": "v1"}]},
+                  {"contentType": "audio", "variants": [{"name": "a1"}]}]
+        with open(self.config_file, 'w') as ofh:
+            json.dump(config, ofh)
+        for media_type, track in (('video', 'v1'), ('audio', 'a1')):
+            os.rename(make_progressive(self.tmp_dir, media_type)[0],
+                      os.path.join(self.tmp_dir, '%s.mp4' % track))
+        creator = DashOnDemandCreator(self.config_file, self.tmp_dir,
+                                      'manifest.mpd', 2)
+        creator.process()
+        self.assertEqual([t[0] for t in creator.timings], ['package', 'mpd'])
+        self.assertEqual(check_asset(creator.file_path('manifest.mpd'), False), 0)
+
+    def test_fix_sidx_ranges(self):
+        creator = DashOnDemandCreator(self.config_file, self.tmp_dir,
+                                      'manifest.mpd', 1)
+        mpd_path = creator.file_path('manifest.mpd')
+        with open(mpd_path, 'w') as ofh:
+            ofh.write(MPD)
+        creator.fix_sidx_ranges_in_mpd(mpd_path, {'a2': '805-900'})
+        mpd = open(mpd_path).read()
+        self.assertEqual(mpd.count('indexRange="800-900"'), 1)
+        self.assertEqual(mpd.count('indexRange="805-900"'), 1)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDashOnDemandCreator)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,183 @@
+"""
+Test packaging of progressive MP4 tracks as DASH OnDemand
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+from structops import uint32_to_str, sint32_to_str
+from track_data_extractor import TrackDataExtractor, is_sync_sample
+from ondemand_packager import make_box, make_full_box, child_boxes, FTYP
+from ondemand_packager import ProgressivePackager, package_track, make_mpd, peak_bitrate
+from ondemand_verifier import check_asset
+from test_track_resegmenter import make_track
+
+SAMPLES_PER_CHUNK = 10
+
+
+def make_sample_tables(samples, chunk_offsets):
+    "Sample table boxes for samples stored in chunks at chunk_offsets."
+    nr_samples = len(samples)
+    # (first_chunk, samples_per_chunk, sample_description_index)
+    stsc_entries = [(1, SAMPLES_PER_CHUNK, 1)]
+    if nr_samples % SAMPLES_PER_CHUNK:
+        stsc_entries.append((len(chunk_offsets), nr_samples % SAMPLES_PER_CHUNK, 1))
+    tables = {
+        'stts': make_full_box('stts', 0, 0, uint32_to_str(nr_samples) + "".join(
+            uint32_to_str(1) + uint32_to_str(samples.dur[i]) for i in range(nr_samples))),
+        'ctts': make_full_box('ctts', 1, 0, uint32_to_str(nr_samples) + "".join(
+            uint32_to_str(1) + sint32_to_str(samples.cto[i]) for i in range(nr_samples))),
+        'stsc': make_full_box('stsc', 0, 0, uint32_to_str(len(stsc_entries)) + "".join(
+            uint32_to_str(value) for entry in stsc_entries for value in entry)),
+        'stsz': make_full_box('stsz', 0, 0, uint32_to_str(0) + uint32_to_str(nr_samples) +
+                              "".join(uint32_to_str(size) for size in samples.size)),
+        'stco': make_full_box('stco', 0, 0, uint32_to_str(len(chunk_offsets)) +
+                              "".join(uint32_to_str(offset) for offset in chunk_offsets))}
+    sync_samples = [i + 1 for i in range(nr_samples) if is_sync_sample(samples.flags[i])]
+    if len(sync_samples) < nr_samples:
+        tables['stss'] = make_full_box('stss', 0, 0, uint32_to_str(len(sync_samples)) +
+                                       "".join(uint32_to_str(nr) for nr in sync_samples))
+    return tables
+
+
+def make_progressive_box(data, tables):
+    "Copy of the moov box data with sample tables filled and mvex removed."
+    box_type = data[4:8]
+    if box_type in ('moov', 'trak', 'mdia', 'minf'):
+        return make_box(box_type, "".join(make_progressive_box(child, tables)
+                                          for child_type, child in child_boxes(data, 8)
+                                          if child_type != 'mvex'))
+    if box_type == 'stbl':
+        children = [child for child_type, child in child_boxes(data, 8)
+                    if child_type == 'stsd']
+        children.extend(tables[name] for name in ('stts', 'ctts', 'stss', 'stsc',
+                                                  'stsz', 'stco') if name in tables)
+        return make_box('stbl', "".join(children))
+    return data
+
+
+def make_progressive(tmp_dir, media_type):
+    "Convert the CMAF test track into a progressive MP4 file."
+    track = TrackDataExtractor(make_track(tmp_dir, media_type))
+    track.filter_top_boxes()
+    samples = track.samples
+    moov = [child for child_type, child in child_boxes(track.header_data(), 0)
+            if child_type == 'moov'][0]
+    chunk_starts = range(0, len(samples), SAMPLES_PER_CHUNK)
+    chunk_sizes = [samples.data_size(s, s + SAMPLES_PER_CHUNK) for s in chunk_starts]
+    tables = make_sample_tables(samples, [0] * len(chunk_starts))
+    mdat_start = len(FTYP) + len(make_progressive_box(moov, tables)) + 8
+    chunk_offsets = [mdat_start + sum(chunk_sizes[:i]) for i in range(len(chunk_sizes))]
+    tables = make_sample_tables(samples, chunk_offsets)
+    sample_data = "".join(track.data[samples.offset[i]:samples.offset[i] + samples.size[i]]
+                          for i in range(len(samples)))
+    path = os.path.join(tmp_dir, '%s_progressive.mp4' % media_type)
+    with open(path, 'wb') as ofh:
+        ofh.write(FTYP + make_progressive_box(moov, tables) + make_box('mdat', sample_data))
+    track.close()
+    return path, samples, sample_data
+
+
+class TestProgressivePackager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_package(self, media_type):
+        "Package the progressive track and check that the samples are unchanged."
+        input_file, input_samples, sample_data = make_progressive(self.tmp_dir,
+                                                                  media_type)
+        output_file = os.path.join(self.tmp_dir, '%s_dashinit.mp4' % media_type)
+        packager = ProgressivePackager(input_file, 2000, output_file)
+        packager.resegment()
+        output = TrackDataExtractor(output_file)
+        output.filter_top_boxes()
+        for name in ('start', 'dur', 'size', 'cto'):
+            self.assertEqual(list(getattr(output.samples, name)),
+                             list(getattr(input_samples, name)))
+        for i in range(len(input_samples)):
+            self.assertEqual(is_sync_sample(output.samples.flags[i]),
+                             is_sync_sample(input_samples.flags[i]))
+        self.assertEqual("".join(output.data[offset:offset + size] for offset, size in
+                                 output.samples.data_ranges(0, len(output.samples))),
+                         sample_data)
+        output.close()
+        return packager, output
+
+    def test_video(self):
+        packager, output = self.check_package('video')
+        self.assertEqual([seg['duration'] for seg in output.sidx_data['segments']],
+                         [180000, 180000, 180000])
+        rep = packager.representation('V1')
+        self.assertEqual(rep.codecs, 'avc1.64000d')
+        self.assertEqual((rep.width, rep.height, rep.frame_rate), (320, 180, '30'))
+        # At least the highest rate over 60 frames (2s), which is above the average
+        samples = output.samples
+        average = 8.0 * samples.data_size(0, len(samples)) / 6
+        peak = max(8.0 * samples.data_size(i, i + 60) / 2 for i in range(len(samples) - 59))
+        self.assertTrue(rep.bandwidth >= peak > average)
+
+    def test_peak_bitrate(self):
+        # 1s samples, one big sample in the middle
+        sizes = [100, 100, 1000, 100, 100, 100]
+        self.assertEqual(peak_bitrate(range(6), sizes, 2, 1), 8 * 1100 / 2.0)
+        self.assertEqual(peak_bitrate(range(6), sizes, 1, 1), 8 * 1000.0)
+        self.assertEqual(peak_bitrate(range(6), sizes, 10, 1), 8 * 1500 / 10.0)
+
+    def test_audio(self):
+        packager = self.check_package('audio')[0]
+        rep = packager.representation('A1')
+        self.assertEqual(rep.codecs, 'mp4a.40.2')
+        self.assertEqual((rep.sample_rate, rep.channels, rep.lang), (48000, 2, 'und'))
+
+    def test_mpd(self):
+        reps = []
+        for media_type in ('video', 'audio'):
+            input_file = make_progressive(self.tmp_dir, media_type)[0]
+            output_file = os.path.join(self.tmp_dir, '%s_dashinit.mp4' % media_type)
+            reps.append(package_track((media_type, input_file, output_file, 2000))[0])
+        mpd_path = os.path.join(self.tmp_dir, 'manifest.mpd')
+        with open(mpd_path, 'wb') as ofh:
+            ofh.write(make_mpd(reps))
+        self.assertEqual(check_asset(mpd_path, False), 0)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestProgressivePackager)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,227 @@
+"""
+Test verification of DASH OnDemand assets
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+import sys
+import shutil
+import logging
+import tempfile
+import StringIO
+import unittest
+from collections import OrderedDict
+
+import test_utils
+from ondemand_verifier import CMAFTrack, TrackHeaders, check_assets, BAD_ALIGNMENT
+from ondemand_verifier import VerificationCache, TrackDurations, setup_logging
+from ondemand_verifier import check_track_group_alignment, _check_inter_as_alignment
+from ondemand_packager import package_track, write_mpd
+from track_resegmenter import TrackResegmenter
+from test_track_resegmenter import make_track
+from test_ondemand_packager import make_progressive
+
+
+def make_asset(asset_dir, audio_durations):
+    "Package the test video and the test audio once per duration."
+    os.mkdir(asset_dir)
+    reps = []
+    video_file = make_progressive(asset_dir, 'video')[0]
+    reps.append(package_track(('V1', video_file, os.path.join(asset_dir, 'V1.mp4'),
+                               2000))[0])
+    for i, duration in enumerate(audio_durations):
+        audio_file = make_progressive(asset_dir, 'audio')[0]
+        rep_id = 'A%d' % (i + 1)
+        reps.append(package_track((rep_id, audio_file,
+                                   os.path.join(asset_dir, rep_id + '.mp4'),
+                                   duration))[0])
+    mpd_path = os.path.join(asset_dir, 'manifest.mpd')
+    write_mpd(mpd_path, reps)
+    return mpd_path
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestCMAFTrack(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        input_file = make_track(self.tmp_dir, 'video')
+        self.track_file = os.path.join(self.tmp_dir, 'video_dashinit.mp4')
+        TrackResegmenter(input_file, 2000, self.track_file, sync_only=True).resegment()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_header_only(self):
+        full = CMAFTrack('full', open(self.track_file, 'rb').read())
+        track = CMAFTrack.from_file('headers', self.track_file)
+        self.assertEqual(track.segment_data, full.segment_data)
+        self.assertEqual(track.sidx_segment_data, full.sidx_segment_data)
+        self.assertEqual(len(track.segment_data['segments']), 3)
+
+    def test_skips_mdat(self):
+        headers = TrackHeaders(self.track_file)
+        data = open(self.track_file, 'rb').read()
+        self.assertEqual(len(headers), len(data))
+        self.assertTrue(headers.bytes_read < len(data) // 4)
+        mdat_offsets = [offset for offset, part in zip(headers.offsets, headers.parts)
+                        if part[4:8] == 'mdat']
+        self.assertEqual(len(mdat_offsets), 3)
+        for offset in mdat_offsets:
+            self.assertEqual(headers[offset:offset + 8], data[offset:offset + 8])
+            self.assertEqual(headers[offset + 8:offset + 16], '\x00' * 8)
+        self.assertEqual(headers[:mdat_offsets[0]], data[:mdat_offsets[0]])
+
+class TestAlignment(unittest.TestCase):
+
+    def check_group(self, timelines):
+        return check_track_group_alignment([TrackDurations('t%d' % i, durations)
+                                            for i, durations in enumerate(timelines)])
+
+    def test_track_group(self):
+        a = [180000] * 50
+        b = [180000] * 49 + [180001]
+        c = [90000] * 100
+        self.assertEqual(self.check_group([a]), 0)
+        self.assertEqual(self.check_group([a, a, a]), 0)
+        self.assertEqual(self.check_group([a, b]), 1)
+        self.assertEqual(self.check_group([a, a, a, b]), 1)
+        self.assertEqual(self.check_group([a, a, b, b]), 4)
+        self.assertEqual(self.check_group([a, b, c]), 3)
+
+    def test_inter_adaptation_sets(self):
+        def seg_data(timescale, durations):
+            return {'timescale': timescale,
+                    'segments': [{'duration': d} for d in durations]}
+        tg_segment_data = OrderedDict([
+            ('video', seg_data(90000, [180000] * 10)),
+            ('audio', seg_data(48000, [96256] * 9 + [93440])),
+            ('other', seg_data(1000, [2000] * 8 + [2100, 1900]))])
+        # The last audio segment and the last two of other differ by > 50ms
+        self.assertEqual(_check_inter_as_alignment(tg_segment_data), 3)
+
+
+class TestCheckAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.mpd_paths = [make_asset(os.path.join(self.tmp_dir, 'good'), [2000, 2000]),
+                          make_asset(os.path.join(self.tmp_dir, 'bad'), [2000, 500])]
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger()
+        self.old_level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.old_level)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parallel_same_as_serial(self):
+        serial = check_assets(self.mpd_paths, False, 1)
+        serial_messages = self.handler.messages
+        self.handler.messages = []
+        parallel = check_assets(self.mpd_paths, False, 3)
+        self.assertEqual(serial, [0, BAD_ALIGNMENT])
+        self.assertEqual(parallel, serial)
+        self.assertTrue(len(serial_messages) > 4)
+        self.assertEqual(self.handler.messages, serial_messages)
+
+    def test_cache(self):
+        cache_file = os.path.join(self.tmp_dir, 'cache.db')
+        serial = check_assets(self.mpd_paths, False)
+        serial_messages = self.handler.messages
+        self.handler.messages = []
+        cache = VerificationCache(cache_file)
+        check_assets(self.mpd_paths, False, 2, cache)
+        cache.close()
+        self.assertEqual((cache.nr_hits, cache.nr_misses), (0, 6))
+        # Change one track, keeping its size
+        track_path = os.path.join(self.tmp_dir, 'good', 'A1.mp4')
+        data = open(track_path, 'rb').read()
+        with open(track_path, 'wb') as ofh:
+            ofh.write(data[:-1] + chr(ord(data[-1]) ^ 0xff))
+        os.utime(track_path, (0, 0))
+        self.handler.messages = []
+        cache = VerificationCache(cache_file)
+        self.assertEqual(check_assets(self.mpd_paths, False, 1, cache), serial)
+        cache.close()
+        self.assertEqual((cache.nr_hits, cache.nr_misses), (5, 1))
+        self.assertEqual(self.handler.messages, serial_messages)
+
+    def test_report(self):
+        report_file = StringIO.StringIO()
+        check_assets(self.mpd_paths, False, 2, report_file=report_file)
+        good, bad = [json.loads(line) for line in
+                     report_file.getvalue().splitlines()]
+        self.assertEqual((good['badness'], good['mismatches']), (0, []))
+        self.assertEqual(len(good['representations']), 3)
+        self.assertEqual(good['bytes_total'],
+                         sum(os.path.getsize(r['path'])
+                             for r in good['representations']))
+        self.assertTrue(0 < good['bytes_read'] < good['bytes_total'])
+        self.assertEqual(bad['badness'], BAD_ALIGNMENT)
+        self.assertEqual([m['type'] for m in bad['mismatches']],
+                         ['alignment'])
+        for rep in bad['representations']:
+            self.assertTrue(rep['nr_segments'] > 0)
+            self.assertTrue(rep['min_segment_duration'] <=
+                            rep['max_segment_duration'])
+
+    def test_log_file(self):
+        log_file = os.path.join(self.tmp_dir, 'verifier.log')
+        log_handler = setup_logging('info', False, log_file)
+        try:
+            check_assets(self.mpd_paths, False, 1)
+        finally:
+            self.logger.removeHandler(log_handler)
+            log_handler.close()
+        lines = open(log_file).read().splitlines()
+        self.assertEqual(len(lines), len(self.handler.messages))
+        self.assertTrue(lines[0].startswith('INFO - '))
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCMAFTrack)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestAlignment))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestCheckAssets))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,102 @@
+"""
+Test the NumPy Pensieve actor network
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+from pensieve_model import np, read_checkpoint, export_actor, ActorModel
+
+MODEL_PATH = os.path.join(test_utils.TEST_PATH, "..", "pensieve_pretrained_models")
+CKPT_PREFIX = os.path.join(MODEL_PATH, "pretrain_linear_reward.ckpt")
+NPZ_PATH = os.path.join(MODEL_PATH, "pretrain_linear_reward.npz")
+
+
+@unittest.skipIf(np is None, "needs numpy")
+class TestPensieveModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_checkpoint(self):
+        tensors = read_checkpoint(CKPT_PREFIX, 'critic')
+        self.assertEqual(tensors['critic/Conv1D_2/W'].shape, (4, 1, 6, 128))
+        self.assertEqual(tensors['critic/FullyConnected_4/W'].shape, (128, 1))
+        self.assertFalse([name for name in tensors if name.startswith('actor/')])
+
+    def test_export(self):
+        npz_path = os.path.join(self.tmp_dir, 'actor.npz')
+        weights = export_actor(CKPT_PREFIX, npz_path)
+        self.assertEqual(len(weights), 16)
+        with np.load(npz_path) as exported, np.load(NPZ_PATH) as shipped:
+            self.assertEqual(sorted(exported.files), sorted(shipped.files))
+            for name in shipped.files:
+                self.assertTrue(np.array_equal(exported[name], shipped[name]))
+
+    def test_predict(self):
+        model = ActorModel(NPZ_PATH)
+        state = np.zeros((2, 6, 8))
+        state[1, 0, -1] = 0.5
+        state[1, 1, -1] = 1.5
+        state[1, 2, :] = 0.2
+        state[1, 3, :] = 0.1
+        state[1, 4, :6] = [0.2, 0.4, 0.6, 0.9, 1.2, 1.6]
+        state[1, 5, -1] = 0.5
+        action_prob = model.predict(state)
+        self.assertEqual(action_prob.shape, (2, 6))
+        self.assertTrue(np.allclose(action_prob.sum(axis=1), 1))
+        # Lowest quality for an empty buffer, but not with 15s buffered
+        self.assertEqual(list(action_prob.argmax(axis=1)), [0, 3])
+        self.assertTrue(np.allclose(model.predict(state[1:]), action_prob[1:]))
+
+    def test_conv_1d(self):
+        "Compare with 'same' padding of one before and two after."
+        model = ActorModel(NPZ_PATH)
+        x = np.random.rand(2, 5, 8)
+        padded = np.zeros((2, 8, 8))
+        padded[:, 1:6] = x
+        w = model.params['Conv1D/W']
+        expected = model.params['Conv1D/b'] + sum(np.dot(padded[:, tap:tap + 5], w[tap, 0])
+                                                  for tap in range(4))
+        self.assertTrue(np.allclose(model.conv_1d('Conv1D', x), expected.reshape(2, -1)))
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPensieveModel)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
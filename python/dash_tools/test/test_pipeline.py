@@ -0,0 +1,143 @@
+"""
+Test the encode, package and verify pipeline
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+import test_utils
+import batch_encoder
+from pipeline import Pipeline
+
+CONFIG = [{"contentType": "video", "frameRate": 25, "gopLength": 50,
+           "segmentDurationMs": 2000, "variants": [{"name": "v1", "vrate": 500},
+                                                   {"name": "v2", "vrate": 1000}]}]
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmp_dir, 'config.json')
+        with open(self.config_file, 'w') as ofh:
+            json.dump(CONFIG, ofh)
+        self.infiles = []
+        for title in ('A', 'B'):
+            self.infiles.append(os.path.join(self.tmp_dir, title + '.mov'))
+            open(self.infiles[-1], 'w').close()
+        self.events = []
+        self.lock = threading.Lock()
+        self.a_packaged = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def log(self, task):
+        with self.lock:
+            self.events.append((task['stage'], task['title'], task['name']))
+
+    def encode(self, task):
+        if task['title'] == 'B':
+            # B can only finish encoding when A has been packaged
+            self.assertTrue(self.a_packaged.wait(5))
+        self.log(task)
+        return 0
+
+    def package(self, task):
+        self.log(task)
+        if task['title'] == 'A':
+            self.a_packaged.set()
+        return 0
+
+    def make_pipeline(self, runners, multi_output=False):
+        return Pipeline(self.config_file, self.infiles, os.path.join(self.tmp_dir, 'out'),
+                        {'encode': 2, 'package': 1, 'verify': 1}, runners, multi_output)
+
+    def test_stages_overlap(self):
+        pipeline = self.make_pipeline({'encode': self.encode, 'package': self.package,
+                                       'verify': lambda task: self.log(task) or 0})
+        pipeline.run()
+        self.assertEqual(len(self.events), 8)
+        self.assertTrue(self.events.index(('package', 'A', 'A')) <
+                        self.events.index(('encode', 'B', 'v1')))
+        for title in ('A', 'B'):
+            self.assertTrue(self.events.index(('encode', title, 'v2')) <
+                            self.events.index(('package', title, title)) <
+                            self.events.index(('verify', title, title)))
+        summary = pipeline.stage_summary()
+        self.assertEqual([(s, summary[s]['nr_tasks']) for s in summary],
+                         [('encode', 4), ('package', 2), ('verify', 2)])
+        self.assertEqual(pipeline.failed_titles(), [])
+
+    def test_failure(self):
+        def encode(task):
+            self.log(task)
+            if task['title'] == 'A' and task['name'] == 'v2':
+                raise IOError("disk full")
+            return 0
+        pipeline = self.make_pipeline({'encode': encode, 'package': self.package,
+                                       'verify': lambda task: self.log(task) or 0})
+        pipeline.run()
+        self.assertEqual(pipeline.failed_titles(), ['A'])
+        self.assertEqual(sorted(e for e in self.events if e[0] != 'encode'),
+                         [('package', 'B', 'B'), ('verify', 'B', 'B')])
+        failed = [r for r in pipeline.records if r['exit_code'] != 0]
+        self.assertEqual([(r['name'], r['error']) for r in failed], [('v2', 'disk full')])
+        self.assertEqual(pipeline.stage_summary()['encode']['nr_failed'], 1)
+
+    def test_multi_output(self):
+        old_ffmpeg = batch_encoder.FFMPEG
+        batch_encoder.FFMPEG = 'true'
+        try:
+            pipeline = self.make_pipeline({'package': self.package,
+                                           'verify': lambda task: self.log(task) or 0},
+                                          multi_output=True)
+            pipeline.run()
+        finally:
+            batch_encoder.FFMPEG = old_ffmpeg
+        self.assertEqual(pipeline.failed_titles(), [])
+        encodes = [r for r in pipeline.records if r['stage'] == 'encode']
+        self.assertEqual([r['name'] for r in encodes], ['ladder', 'ladder'])
+        for title in ('A', 'B'):
+            title_dir = os.path.join(self.tmp_dir, 'out', title)
+            names = sorted(os.listdir(title_dir))
+            self.assertFalse([n for n in names if n.endswith('.X')])
+            self.assertEqual(len([n for n in names if n.endswith('.log')]), 2)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPipeline)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,215 @@
+"""
+Test resegmenting of CMAF tracks
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from array import array
+
+import test_utils
+import mp4
+from structops import uint32_to_str
+from track_data_extractor import SampleTable, np
+from track_resegmenter import TrackResegmenter
+
+DATA_PATH = os.path.join(test_utils.TEST_PATH, 'data')
+
+def make_track(tmp_dir, media_type):
+    "Concatenate the test init and media segment into a CMAF track file."
+    path = os.path.join(tmp_dir, '%s.mp4' % media_type)
+    with open(path, 'wb') as ofh:
+        for name in ('%s_init.mp4' % media_type, '%s_segment.m4s' % media_type):
+            with open(os.path.join(DATA_PATH, name), 'rb') as ifh:
+                ofh.write(ifh.read())
+    return path
+
+def make_sample_table():
+    "Samples with varying durations, sizes, a gap in the data and a few sync samples."
+    samples = SampleTable()
+    offset = 5000
+    for i in range(60):
+        dur = 1000 + 24 * (i % 3)
+        size = 200 + 17 * i
+        flags = 0x2000000 if i % 12 == 0 else 0x1010000
+        samples.append(2 ** 33 + 1024 * i, dur, size, offset, flags, 512 * (i % 4 - 1))
+        offset += size + (8 if i == 30 else 0)
+    return samples
+
+class CutParser(object):
+    "Minimal input parser for TrackResegmenter._find_cut_samples."
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.track_timescale = 24000
+
+def find_cut_samples(samples, duration_ms):
+    resegmenter = TrackResegmenter(None, duration_ms, None)
+    resegmenter.input_parser = CutParser(samples)
+    return resegmenter._find_cut_samples()
+
+class TestSampleTable(unittest.TestCase):
+
+    def test_columns(self):
+        samples = SampleTable()
+        for i in range(4):
+            samples.append(1024 * i, 1024, 100 + i, 1000 + i, 0x2000000, -i)
+        samples.freeze()
+        self.assertEqual(len(samples), 4)
+        self.assertEqual(samples[2].size, 102)
+        self.assertEqual(samples.end_time(-1), 4096)
+        self.assertTrue(samples.is_constant('dur', 0, 4))
+        self.assertFalse(samples.is_constant('size', 0, 4))
+        self.assertEqual(samples.pack(['size', 'cto'], 1, 3),
+                         '\x00\x00\x00\x65\xff\xff\xff\xff\x00\x00\x00\x66\xff\xff\xff\xfe')
+
+    def check_paths(self, samples):
+        "Results that must be the same with array and NumPy columns."
+        nr_samples = len(samples)
+        return (samples.data_size(0, nr_samples),
+                samples.data_ranges(0, nr_samples),
+                samples.data_ranges(31, 31),
+                samples.sync_samples(),
+                samples.is_constant('dur', 0, 1),
+                samples.is_constant('dur', 0, 3),
+                samples.is_constant('flags', 1, 12),
+                samples.pack(['start', 'dur', 'size', 'flags', 'cto'], 5, 25),
+                samples.pack(['offset'], 0, nr_samples),
+                find_cut_samples(samples, 400),
+                find_cut_samples(samples, 1000))
+
+    def test_python_columns(self):
+        samples = make_sample_table()
+        self.assertEqual(samples.data_ranges(0, len(samples)),
+                         [(5000, sum(200 + 17 * i for i in range(31))),
+                          (5008 + sum(200 + 17 * i for i in range(31)),
+                           sum(200 + 17 * i for i in range(31, 60)))])
+        self.assertEqual(samples.sync_samples(), [0, 12, 24, 36, 48])
+        self.assertEqual(samples.pack(['start'], 1, 2), '\x00\x00\x00\x02\x00\x00\x04\x00')
+        self.assertEqual(find_cut_samples(samples, 1000), [23, 46])
+
+    @unittest.skipIf(np is None, "needs numpy")
+    def test_numpy_columns(self):
+        samples = make_sample_table()
+        expected = self.check_paths(samples)
+        samples.freeze()
+        self.assertNotIsInstance(samples.dur, array)
+        self.assertEqual(self.check_paths(samples), expected)
+
+class TestTrackResegmenter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_resegment(self, media_type, duration_ms):
+        input_file = make_track(self.tmp_dir, media_type)
+        output_file = os.path.join(self.tmp_dir, 'out.mp4')
+        resegmenter = TrackResegmenter(input_file, duration_ms, output_file)
+        resegmenter.resegment()
+        data = open(output_file, 'rb').read()
+        root = mp4.mp4(data, len(data))
+        truns = root.find_all('moof.traf.trun')
+        sidx = root.find('sidx')
+        self.assertEqual(len(truns), sidx.reference_count)
+        nr_input_samples = len(resegmenter.input_parser.samples)
+        # The resegmenter leaves out a last segment with a single sample
+        self.assertTrue(sum(t.sample_count for t in truns) >= nr_input_samples - 1)
+        return truns
+
+    def test_audio(self):
+        truns = self.check_resegment('audio', 500)
+        self.assertTrue(len(truns) > 1)
+
+    def test_video(self):
+        truns = self.check_resegment('video', 1000)
+        self.assertTrue(len(truns) > 1)
+
+    def test_video_keyframes(self):
+        input_file = make_track(self.tmp_dir, 'video')
+        output_file = os.path.join(self.tmp_dir, 'video_out.mp4')
+        resegmenter = TrackResegmenter(input_file, 1000, output_file, sync_only=True)
+        resegmenter.resegment()
+        data = open(output_file, 'rb').read()
+        root = mp4.mp4(data, len(data))
+        # The GOP length is 2s so 1s segments are not possible
+        self.assertEqual([r['subsegment-duration'] for r in root.find('sidx').references],
+                         [180000, 180000, 180000])
+        for trun in root.find_all('moof.traf.trun'):
+            self.assertEqual(int(trun.sample_entry(0)['flags'], 16) & 0x3010000, 0x2000000)
+
+    def test_reference_alignment(self):
+        video_file = make_track(self.tmp_dir, 'video')
+        TrackResegmenter(video_file, 1000, video_file, sync_only=True).resegment()
+        audio_file = make_track(self.tmp_dir, 'audio')
+        output_file = os.path.join(self.tmp_dir, 'audio_out.mp4')
+        TrackResegmenter(audio_file, 500, output_file, reference_file=video_file).resegment()
+        data = open(output_file, 'rb').read()
+        root = mp4.mp4(data, len(data))
+        # Closest AAC frame boundaries to 2s and 4s
+        self.assertEqual([tfdt.decode_time for tfdt in root.find_all('moof.traf.tfdt')],
+                         [0, 94 * 1024, 188 * 1024])
+
+    def test_reference_with_composition_offset(self):
+        "The sidx of a B-frame reference starts at the composition offset, not at tfdt."
+        video_file = make_track(self.tmp_dir, 'video')
+        TrackResegmenter(video_file, 1000, video_file, sync_only=True).resegment()
+        data = open(video_file, 'rb').read()
+        ept_offset = data.find('sidx') + 16
+        self.assertEqual(data[ept_offset:ept_offset + 4], '\x00' * 4)
+        with open(video_file, 'wb') as ofh:
+            ofh.write(data[:ept_offset] + uint32_to_str(6000) + data[ept_offset + 4:])
+        audio_file = make_track(self.tmp_dir, 'audio')
+        output_file = os.path.join(self.tmp_dir, 'audio_out.mp4')
+        TrackResegmenter(audio_file, 500, output_file, reference_file=video_file).resegment()
+        data = open(output_file, 'rb').read()
+        root = mp4.mp4(data, len(data))
+        self.assertEqual([tfdt.decode_time for tfdt in root.find_all('moof.traf.tfdt')],
+                         [0, 94 * 1024, 188 * 1024])
+
+    def test_in_place(self):
+        input_file = make_track(self.tmp_dir, 'audio')
+        output_file = os.path.join(self.tmp_dir, 'out.mp4')
+        TrackResegmenter(input_file, 500, output_file).resegment()
+        TrackResegmenter(input_file, 500, input_file).resegment()
+        self.assertEqual(open(input_file, 'rb').read(), open(output_file, 'rb').read())
+        self.assertTrue(os.path.exists(input_file + '_bup'))
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSampleTable)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestTrackResegmenter))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
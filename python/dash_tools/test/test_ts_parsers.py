@@ -0,0 +1,322 @@
+"""
+Test elementary stream parsers of the MPEG-2 TS parser
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import struct
+import unittest
+
+import test_utils
+import mp4
+import scte35
+import ts
+
+def make_adts_frame(payload, sampling_frequency_index=3):
+    "Build an ADTS frame without CRC around payload."
+    frame_len = 7 + len(payload)
+    header = [0xff, 0xf1,
+              0x40 | (sampling_frequency_index << 2),
+              0x80 | (frame_len >> 11),
+              (frame_len >> 3) & 0xff,
+              ((frame_len & 0x7) << 5) | 0x1f,
+              0xfc]
+    return ''.join(chr(b) for b in header) + payload
+
+class TestAudioParsers(unittest.TestCase):
+
+    def test_adts_pts_interpolation(self):
+        parser = ts.aac_parser_adts(wall_clock=False)
+        data = ''.join(make_adts_frame(chr(i) * 10) for i in range(3))
+        frames = parser.add_pes(data, 90000, 0)
+        self.assertEqual([f.pts for f in frames], [90000, 91920, 93840])
+        self.assertEqual([f.data for f in frames], ['\x00' * 10, '\x01' * 10, '\x02' * 10])
+        self.assertTrue(all(f.wall_clk is None for f in frames))
+
+    def test_adts_frame_split_over_pes(self):
+        parser = ts.aac_parser_adts(wall_clock=False)
+        data = ''.join(make_adts_frame('x' * 100) for i in range(4))
+        frames = parser.add_pes(data[:150], 1000, 0)
+        self.assertEqual([f.pts for f in frames], [1000])
+        # The second frame started in the first PES so its PTS is interpolated
+        frames = parser.add_pes(data[150:], 50000, 0)
+        self.assertEqual([f.pts for f in frames], [2920, 50000, 51920])
+
+    def test_adts_resync(self):
+        parser = ts.aac_parser_adts(wall_clock=False)
+        ts.logger.silent = True
+        frames = parser.add_pes('\x00\x01' + make_adts_frame('y' * 20), 0, 0)
+        ts.logger.silent = False
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0].data, 'y' * 20)
+
+# HEVC NAL units with 4-byte start codes. The PPS has no extra slice header
+# bits, the IDR slice is an I slice and the TRAIL_R slice a P slice.
+HEVC_VPS = '\x00\x00\x00\x01\x40\x01\x0c\x01\xff\xff'
+HEVC_PPS = '\x00\x00\x00\x01\x44\x01\xc0\x80'
+HEVC_IDR = '\x00\x00\x00\x01\x26\x01\xae\x11\x22\x33'
+HEVC_TRAIL = '\x00\x00\x01\x02\x01\xd4\x44\x55\x66'
+
+class TestVideoParsers(unittest.TestCase):
+
+    def test_next_start_code(self):
+        self.assertEqual(ts.next_start_code('\x00\x00\x00\x01\x09\xf0\x00', 0), (0, 4))
+        self.assertEqual(ts.next_start_code('\xff\x00\x00\x01\x09\xf0\x00\x00', 0), (1, 3))
+        self.assertEqual(ts.next_start_code('\x00\x00\x01\x09\xf0\x00\x00\x00\x01\x09\x10\x00', 1), (5, 4))
+        self.assertEqual(ts.next_start_code('\x00\x00\x01\x09', 0), (-1, 0))
+
+    def test_h265_pictures(self):
+        parser = ts.h265_parser(wall_clock=False)
+        frames = parser.add_pes(HEVC_VPS + HEVC_PPS + HEVC_IDR, 3600, 0)
+        frames += parser.add_pes(HEVC_TRAIL, 7200, 3600)
+        frames += parser.flush()
+        self.assertEqual(len(frames), 2)
+        self.assertEqual([f.frame_type for f in frames], ['I', 'P'])
+        self.assertEqual([f.sync for f in frames], [True, False])
+        self.assertEqual([(f.pts, f.dts) for f in frames], [(3600, 0), (7200, 3600)])
+        self.assertEqual(frames[0].data, HEVC_IDR)
+        self.assertEqual(frames[1].data, HEVC_TRAIL)
+
+def add_crc(section):
+    return section + struct.pack('>I', ts.crc32_mpeg(section))
+
+def make_psi_section(table_id, table_id_extension, version, body):
+    header = struct.pack('>BHHBBB', table_id, 0xb000 | (len(body) + 9), table_id_extension,
+                         0xc1 | (version << 1), 0, 0)
+    return add_crc(header + body)
+
+def make_pmt_section(version, streams):
+    body = struct.pack('>HH', 0xe000 | 256, 0xf000)
+    for stream_type, pid in streams:
+        body += struct.pack('>BHH', stream_type, 0xe000 | pid, 0xf000)
+    return make_psi_section(ts.PMT_TABLE_ID, 1, version, body)
+
+class RecordingObserver(ts.observer):
+    def __init__(self):
+        self.pmts = []
+    def on_pmt(self, importer, pmt):
+        self.pmts.append(pmt)
+
+class TestPsi(unittest.TestCase):
+
+    def setUp(self):
+        self.observer = RecordingObserver()
+        self.importer = ts.ts_importer(self.observer, {'verbose' : 0})
+        pat_section = make_psi_section(ts.PAT_TABLE_ID, 1, 0, struct.pack('>HH', 1, 0xe000 | 100))
+        self.importer.add_data(''.join(make_ts_packets(ts.PAT_PID, pat_section)))
+
+    def test_crc(self):
+        section = make_pmt_section(0, [(ts.STREAM_TYPE_H264, 256)])
+        self.assertEqual(ts.crc32_mpeg(section), 0)
+        self.assertEqual(ts.crc32_mpeg('123456789'), 0x0376e6e7)
+
+    def test_pat_pmt(self):
+        self.assertEqual(self.importer.pmt_pid, 100)
+        section = make_pmt_section(0, [(ts.STREAM_TYPE_H264, 256), (ts.STREAM_TYPE_AAC, 257)])
+        self.importer.add_data(''.join(make_ts_packets(100, section)))
+        self.assertEqual(len(self.observer.pmts), 1)
+        pmt = self.observer.pmts[0]
+        self.assertEqual(pmt.program_num, 1)
+        self.assertEqual(pmt.pcr_pid, 256)
+        self.assertEqual([(s.stream_type, s.elementary_pid) for s in pmt.stream_list],
+                         [(ts.STREAM_TYPE_H264, 256), (ts.STREAM_TYPE_AAC, 257)])
+
+    def test_repeated_and_corrupt_pmt(self):
+        first = make_pmt_section(0, [(ts.STREAM_TYPE_H264, 256)])
+        second = make_pmt_section(1, [(ts.STREAM_TYPE_HEVC, 256)])
+        corrupt = second[:-1] + chr(ord(second[-1]) ^ 0x01)
+        ts.logger.silent = True
+        for section in (first, first, corrupt, first, second, second):
+            self.importer.add_data(''.join(make_ts_packets(100, section)))
+        ts.logger.silent = False
+        self.assertEqual([p.version_number for p in self.observer.pmts], [0, 1])
+        cache = self.importer.section_cache
+        self.assertEqual((cache.nr_new, cache.nr_repeated, cache.nr_crc_errors), (3, 3, 1))
+
+def make_splice_insert_section(event_id, pts_time, duration, pts_adjustment=0):
+    "Build a splice_insert splice_info_section with program splice and break duration."
+    command = ''.join([struct.pack('>IB', event_id, 0x7f),
+                       chr(0xef), # out_of_network, program_splice, duration_flag
+                       struct.pack('>BI', 0xfe | (pts_time >> 32), pts_time & 0xffffffff),
+                       struct.pack('>BI', 0xfe | (duration >> 32), duration & 0xffffffff),
+                       struct.pack('>HBB', 1, 0, 0)])
+    body = ''.join([chr(0x00), # protocol_version
+                    struct.pack('>BI', pts_adjustment >> 32, pts_adjustment & 0xffffffff),
+                    struct.pack('>I', 0xfff000 | len(command)), # cw_index, tier, length
+                    chr(scte35.SPLICE_INSERT), command,
+                    struct.pack('>H', 0)]) # descriptor_loop_length
+    return add_crc(struct.pack('>BH', scte35.SCTE35_TABLE_ID, 0x3000 | len(body) + 4) + body)
+
+def make_ts_packets(pid, section):
+    "Packetize a section with pointer_field and 0xff stuffing."
+    data = '\x00' + section
+    packets = []
+    cc = 0
+    while data:
+        header = struct.pack('>BHB', 0x47, (0x4000 if not packets else 0) | pid, 0x10 | cc)
+        payload, data = data[:184], data[184:]
+        packets.append(header + payload + '\xff' * (184 - len(payload)))
+        cc = (cc + 1) & 0x0f
+    return packets
+
+class TestScte35(unittest.TestCase):
+
+    def test_section_assembly(self):
+        first = make_splice_insert_section(1, 900000, 2700000)
+        second = make_splice_insert_section(2, 1800000, 2700000)
+        # Put the sections back to back so that they span two packets
+        packets = make_ts_packets(500, (first + second) * 4)
+        self.assertEqual(len(packets), 2)
+        assembler = ts.section_assembler()
+        sections = []
+        for data in packets:
+            sections += assembler.add_packet(ts.ts_packet(data))
+        self.assertEqual(sections, [first, second] * 4)
+
+    def test_splice_insert(self):
+        section = make_splice_insert_section(17, 900000, 2700000, pts_adjustment=1000)
+        info = scte35.parse_splice_info_section(section)
+        self.assertEqual(info.command_type, scte35.SPLICE_INSERT)
+        self.assertEqual(info.command.splice_event_id, 17)
+        self.assertTrue(info.command.out_of_network)
+        self.assertEqual(scte35.splice_pts(info), 901000)
+        self.assertEqual(scte35.event_duration(info), 2700000)
+        self.assertEqual(info.section, section)
+
+    def test_pts_wrap(self):
+        section = make_splice_insert_section(1, 1000, 90000)
+        info = scte35.parse_splice_info_section(section)
+        first_pts = scte35.PTS_MODULO - 89000
+        self.assertEqual(scte35.media_time(scte35.splice_pts(info), first_pts), 90000)
+
+    def test_emsg(self):
+        section = make_splice_insert_section(5, 990000, 2700000)
+        info = scte35.parse_splice_info_section(section)
+        data = scte35.make_emsg(info, first_pts=90000, segment_start=8, timescale=1)
+        root = mp4.mp4(data, len(data))
+        emsg = root.children[0]
+        self.assertEqual(emsg.scheme_id_uri, scte35.EMSG_SCHEME)
+        self.assertEqual(emsg.timescale, 1)
+        self.assertEqual(emsg.presentation_time_delta, 2)
+        self.assertEqual(emsg.event_duration, 30)
+        self.assertEqual(emsg.id, 5)
+        self.assertEqual(''.join(chr(c) for c in emsg.message_data), section)
+
+    def test_emsg_long_recording(self):
+        fourteen_hours = 14 * 3600 * 90000
+        section = make_splice_insert_section(6, 90000 + fourteen_hours, 2700000)
+        info = scte35.parse_splice_info_section(section)
+        self.assertRaises(ValueError, scte35.make_emsg, info, 90000)
+        data = scte35.make_emsg(info, first_pts=90000, version=1)
+        emsg = mp4.mp4(data, len(data)).children[0]
+        self.assertEqual((emsg.version, emsg.scheme_id_uri), (1, scte35.EMSG_SCHEME))
+        self.assertEqual(emsg.presentation_time, fourteen_hours)
+        self.assertEqual(emsg.event_duration, 2700000)
+        self.assertEqual(''.join(chr(c) for c in emsg.message_data), section)
+
+    def test_cues_before_first_pes(self):
+        class Importer(object):
+            first_pts = 0
+        class Writer(object):
+            def __init__(self):
+                self.cues = []
+            def write(self, info, first_pts=0):
+                self.cues.append((info.command.splice_event_id, first_pts))
+        observer = ts.parser_observer({'verbose': 0})
+        observer.scte35_writer = writer = Writer()
+        importer = Importer()
+        info = scte35.parse_splice_info_section(make_splice_insert_section(7, 990000, 90000))
+        observer.on_scte35(importer, 500, info)
+        self.assertEqual(writer.cues, [])
+        importer.first_pts = 900000
+        observer.on_pes(-2, None)
+        self.assertEqual(writer.cues, [(7, 900000)])
+
+NULL_PACKET = struct.pack('>BHB', 0x47, 0x1fff, 0x10) + '\xff' * 184
+
+class TestHandleHttp(unittest.TestCase):
+    "handle_http with httpio.iter_chunks replaced by chunks of a TS stream in memory."
+
+    def setUp(self):
+        self.iter_chunks = ts.httpio.iter_chunks
+        self.requests = []
+
+    def tearDown(self):
+        ts.httpio.iter_chunks = self.iter_chunks
+
+    def stream(self, data, chunk_size=1000):
+        def iter_chunks(url, chunk_size=chunk_size, max_bytes=-1):
+            self.requests.append((url, max_bytes))
+            if max_bytes >= 0:
+                data_left = data[:max_bytes]
+            else:
+                data_left = data
+            for offset in range(0, len(data_left), chunk_size):
+                yield data_left[offset:offset + chunk_size]
+        ts.httpio.iter_chunks = iter_chunks
+
+    def make_psi(self):
+        pat_section = make_psi_section(ts.PAT_TABLE_ID, 1, 0, struct.pack('>HH', 1, 0xe000 | 100))
+        pmt_section = make_pmt_section(0, [(ts.STREAM_TYPE_AAC, 257)])
+        return ''.join(make_ts_packets(ts.PAT_PID, pat_section) +
+                       make_ts_packets(100, pmt_section))
+
+    def test_psi_after_first_chunk(self):
+        observer = RecordingObserver()
+        importer = ts.ts_importer(observer, {'verbose' : 0})
+        data = NULL_PACKET * 1500 + self.make_psi() + NULL_PACKET * 200
+        self.stream(data, 188 * 1024)
+        ts.handle_http('http://server/stream.ts', -1, importer)
+        self.assertEqual(self.requests, [('http://server/stream.ts', -1)])
+        self.assertEqual(importer.pmt_pid, 100)
+        # The preflight data is parsed too, so every packet is counted once
+        self.assertEqual(importer.num_packets, len(data) // 188)
+        self.assertEqual(len(observer.pmts), 1)
+
+    def test_no_psi(self):
+        importer = ts.ts_importer(RecordingObserver(), {'verbose' : 0})
+        self.stream(NULL_PACKET * 1000 + self.make_psi() + NULL_PACKET * 200)
+        ts.logger.silent = True
+        try:
+            ts.handle_http('http://server/stream.ts', 188 * 1000, importer)
+        finally:
+            ts.logger.silent = False
+        self.assertEqual(importer.num_packets, 0)
+        self.assertFalse(importer.has_pmt)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestAudioParsers)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestVideoParsers))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestScte35))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPsi))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestHandleHttp))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
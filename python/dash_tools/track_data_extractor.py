@@ -30,20 +30,164 @@
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import os
+import mmap
+import struct
+from array import array
 from collections import namedtuple
 
-from structops import str_to_uint16, uint32_to_str
-from structops import str_to_uint32, str_to_uint64
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from structops import str_to_uint16
+from structops import str_to_uint32, str_to_uint64, str_to_sint32
 from mp4filter import MP4Filter
 
 SampleData = namedtuple("SampleData", "start dur size offset flags cto")
 
+NON_SYNC_SAMPLE_FLAG = 0x10000  # sample_is_non_sync_sample in sample flags
+DEPENDS_ON_MASK = 0x3000000  # sample_depends_on in sample flags
+DEPENDS_ON_OTHERS = 0x1000000
+
+
+def is_sync_sample(flags):
+    "Sync unless flagged non-sync or as depending on other samples."
+    return (not flags & NON_SYNC_SAMPLE_FLAG and
+            flags & DEPENDS_ON_MASK != DEPENDS_ON_OTHERS)
+
+
+def _uint64_typecode():
+    "Typecode of an unsigned 64-bit array ('Q' is not available in Python 2)."
+    for typecode in ('Q', 'L'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    raise ValueError("No unsigned 64-bit array typecode on this platform")
+
+
+class SampleTable(object):
+    """Sample data stored in one array per field instead of one tuple per sample.
+
+    The columns are array.array while filling, and are turned into NumPy arrays
+    by freeze() if NumPy is available."""
+
+    # (name, array typecode, big-endian struct format for trun output)
+    COLUMNS = (('start', _uint64_typecode(), '>Q'),
+               ('dur', 'I', '>I'),
+               ('size', 'I', '>I'),
+               ('offset', _uint64_typecode(), '>Q'),
+               ('flags', 'I', '>I'),
+               ('cto', 'i', '>i'))
+
+    def __init__(self):
+        for name, typecode, _ in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.struct_formats = dict((name, fmt[1]) for name, _, fmt in self.COLUMNS)
+
+    def append(self, start, dur, size, offset, flags, cto):
+        self.start.append(start)
+        self.dur.append(dur)
+        self.size.append(size)
+        self.offset.append(offset)
+        self.flags.append(flags)
+        self.cto.append(cto)
+
+    def freeze(self):
+        "Convert the columns to NumPy arrays, if available."
+        if np is None or not isinstance(self.start, array):
+            return
+        for name, typecode, _ in self.COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, np.frombuffer(column, dtype=np.dtype(typecode)))
+
+    def __len__(self):
+        return len(self.dur)
+
+    def __getitem__(self, i):
+        return SampleData(self.start[i], self.dur[i], self.size[i],
+                          self.offset[i], self.flags[i], self.cto[i])
+
+    def data_size(self, start_nr, end_nr):
+        "Total size of the data of samples start_nr to end_nr."
+        return int(sum(self.size[start_nr:end_nr]))
+
+    def data_ranges(self, start_nr, end_nr):
+        "Return (offset, size) of the data of samples start_nr to end_nr with adjacent samples merged."
+        offsets = self.offset[start_nr:end_nr]
+        sizes = self.size[start_nr:end_nr]
+        if len(offsets) == 0:
+            return []
+        if np is not None and not isinstance(offsets, array):
+            ends = offsets + sizes
+            run_starts = [0] + list(np.nonzero(offsets[1:] != ends[:-1])[0] + 1)
+            run_ends = run_starts[1:] + [len(offsets)]
+            return [(int(offsets[s]), int(ends[e - 1] - offsets[s]))
+                    for s, e in zip(run_starts, run_ends)]
+        ranges = []
+        run_offset = offsets[0]
+        run_end = run_offset
+        for offset, size in zip(offsets, sizes):
+            if offset != run_end:
+                ranges.append((run_offset, run_end - run_offset))
+                run_offset = offset
+            run_end = offset + size
+        ranges.append((run_offset, run_end - run_offset))
+        return ranges
+
+    def sync_samples(self):
+        "Numbers of the sync samples, see is_sync_sample."
+        if np is not None and not isinstance(self.flags, array):
+            sync = (((self.flags & NON_SYNC_SAMPLE_FLAG) == 0) &
+                    ((self.flags & DEPENDS_ON_MASK) != DEPENDS_ON_OTHERS))
+            return [int(i) for i in np.nonzero(sync)[0]]
+        return [i for i, flags in enumerate(self.flags) if is_sync_sample(flags)]
+
+    def end_time(self, i):
+        "End of presentation of sample i in decode time."
+        return int(self.start[i]) + int(self.dur[i])
+
+    def is_constant(self, name, start_nr, end_nr):
+        "True if field name has the same value for samples start_nr to end_nr."
+        values = getattr(self, name)[start_nr:end_nr]
+        if np is not None and not isinstance(values, array):
+            return bool(np.all(values == values[0]))
+        return values.count(values[0]) == len(values)
+
+    def pack(self, names, start_nr, end_nr):
+        "Return the fields names of the samples interleaved as big-endian binary data."
+        if not names or start_nr == end_nr:
+            return ""
+        columns = [getattr(self, name)[start_nr:end_nr] for name in names]
+        if np is not None and not isinstance(columns[0], array):
+            dtype = [(name, '>' + column.dtype.str[1:]) for name, column in
+                     zip(names, columns)]
+            rows = np.empty(end_nr - start_nr, dtype=dtype)
+            for name, column in zip(names, columns):
+                rows[name] = column
+            return rows.tostring()
+        fmt = '>' + ''.join(self.struct_formats[name] for name in names) * (end_nr - start_nr)
+        if len(columns) == 1:
+            return struct.pack(fmt, *columns[0])
+        return struct.pack(fmt, *[value for row in zip(*columns) for value in row])
+
 
 class TrackDataExtractor(MP4Filter):
     "Extract data from DASH Ondemand/CMAF Track. "
 
     def __init__(self, file_name, verbose=False):
-        super(TrackDataExtractor, self).__init__(file_name)
+        # Memory map the input, since only the headers are parsed and the
+        # sample data is copied range by range
+        self.input_fh = open(file_name, "rb")
+        if os.fstat(self.input_fh.fileno()).st_size > 0:
+            data = mmap.mmap(self.input_fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = ""
+        super(TrackDataExtractor, self).__init__(data=data)
+        self.keep_output = False
         self.verbose = verbose
         self.relevant_boxes = ["moov", "moof", "sidx"]
         self.track_timescale = None
@@ -52,7 +196,7 @@ class TrackDataExtractor(MP4Filter):
         self.default_sample_flags = None
         self.default_sample_size = None
         self.input_segments = []
-        self.samples = []
+        self.samples = SampleTable()
         self.last_moof_start = 0
         self.segment_start = None
         self.styp = ""  # styp box, if any
@@ -228,7 +372,7 @@ class TrackDataExtractor(MP4Filter):
     def process_trun(self, data):
         """Extract trun information into self.segments[-1] and self.samples"""
         version_and_flags = str_to_uint32(data[8:12])
-        # version = version_and_flags >> 24
+        version = version_and_flags >> 24
         flags = version_and_flags & 0xffffff
         sample_count = str_to_uint32(data[12:16])
         first_sample_flags = None
@@ -248,6 +392,11 @@ class TrackDataExtractor(MP4Filter):
         self.trun_base_size = pos  # How many bytes this far
         if self.trun_sample_flags is None:
             self.trun_sample_flags = flags
+        if version == 1:
+            read_cto = str_to_sint32
+        else:
+            read_cto = str_to_uint32
+        samples = self.samples
         for i in range(sample_count):
             sample_duration = self.default_sample_duration
             sample_size = self.default_sample_size
@@ -265,19 +414,40 @@ class TrackDataExtractor(MP4Filter):
                 sample_flags = str_to_uint32(data[pos:pos + 4])
                 pos += 4
             if flags & 0x800:  # composition_time_offset present
-                cto = str_to_uint32(data[pos:pos + 4])
+                cto = read_cto(data[pos:pos + 4])
                 pos += 4
             if cto is None:
                 cto = 0
-            sample = SampleData(start, sample_duration, sample_size,
-                                data_offset, sample_flags, cto)
-            self.samples.append(sample)
+            samples.append(start, sample_duration, sample_size,
+                           data_offset, sample_flags, cto)
             start += sample_duration
             data_offset += sample_size
         seg = self.input_segments[-1]
         seg['duration'] = start - self.base_media_decode_time
         return data
 
+    def finalize(self):
+        self.samples.freeze()
+
+    def segment_boundaries(self):
+        """Return (timescale, decode start times) of the segments of the track.
+
+        The sidx is used if present, otherwise the fragments. The sidx has
+        presentation times, which are shifted by the difference between the
+        earliest presentation time and the tfdt of the first fragment (e.g.
+        the composition offset of the first frame with B-frames)."""
+        if self.sidx_data is not None:
+            timescale = self.sidx_data['timescale']
+            starts = [seg['start'] for seg in self.sidx_data['segments']]
+            if self.input_segments and starts:
+                first_decode_time = (self.input_segments[0]['base_media_decode_time'] *
+                                     timescale // self.track_timescale)
+                offset = first_decode_time - starts[0]
+                starts = [start + offset for start in starts]
+            return timescale, starts
+        return (self.track_timescale,
+                [seg['base_media_decode_time'] for seg in self.input_segments])
+
     def find_header_end(self):
         "Find where the header ends. This part will be left untouched."
         header_end = 0
@@ -287,14 +457,16 @@ class TrackDataExtractor(MP4Filter):
             header_end += size
         return header_end
 
-    def construct_new_mdat(self, media_info):
-        "Return an mdat box with data for samples in media_info."
-        start_nr = media_info.start_nr
-        end_nr = media_info.end_nr
-        sample_data = []
-        for i in range(media_info.start_nr, media_info.end_nr):
-            sample = self.samples[i]
-            sample_data.append(self.data[sample.offset:sample.offset +
-                                                       sample.size])
-        combined_data = "".join(sample_data)
-        return uint32_to_str(8 + len(combined_data)) + 'mdat' + combined_data
+    def header_data(self):
+        "The header (ftyp, moov, ...) to write in front of the segments."
+        return self.data[:self.find_header_end()]
+
+    def copy_data(self, ofh, offset, size):
+        "Copy size bytes at offset in the memory mapped input to the file object ofh."
+        ofh.write(self.data[offset:offset + size])
+
+    def close(self):
+        "Release the input file."
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.input_fh.close()
@@ -33,36 +33,59 @@ Useful to get audio segments with a specified average duration."""
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import os
+from bisect import bisect_left
 from argparse import ArgumentParser
+from array import array
 from collections import namedtuple
 
-from structops import str_to_uint16, uint16_to_str, uint32_to_str, sint32_to_str
+from structops import str_to_uint16, uint16_to_str, uint32_to_str
 from structops import str_to_uint32, str_to_uint64, uint64_to_str
-from track_data_extractor import TrackDataExtractor
+from track_data_extractor import TrackDataExtractor, np
 from backup_handler import make_backup, BackupError
 
 SegmentData = namedtuple("SegmentData", "nr start dur size data")
 SegmentInfo = namedtuple("SegmentInfo", "start_nr end_nr start_time dur")
 
 
+def nr_sample_bytes(sample_flags):
+    "Number of bytes per sample in a trun with sample_flags."
+    nr_bytes = 0
+    for pattern in (0x100, 0x200, 0x400, 0x800):
+        if sample_flags & pattern != 0:
+            nr_bytes += 4
+    return nr_bytes
+
+
 class TrackResegmenter(object):
-    "Resegment an OnDemand/CMAF track into a new output track."
+    """Resegment an OnDemand/CMAF track into a new output track.
+
+    By default segments are cut by accumulated duration, which is fine for
+    audio. With sync_only, segments only start at sync samples, as needed
+    for video. With reference_file, the segment boundaries follow the
+    segments (sidx) of that track instead of duration_ms."""
 
     def __init__(self, input_file, duration_ms, output_file,
-                 skip_sidx=False, verbose=False):
+                 skip_sidx=False, verbose=False, sync_only=False,
+                 reference_file=None):
         self.input_file = input_file
         self.duration_ms = duration_ms
         self.output_file = output_file
         self.verbose = verbose
         self.input_parser = None
         self.skip_sidx = skip_sidx
+        self.sync_only = sync_only
+        self.reference_file = reference_file
+        self.init_range = ""
         self.sidx_range = ""
 
+    def _create_extractor(self):
+        "Create the parser for the input track."
+        return TrackDataExtractor(self.input_file, self.verbose)
+
     def resegment(self):
         "Resegment the track with new duration."
 
-        self.input_parser = TrackDataExtractor(self.input_file,
-                                               self.verbose)
+        self.input_parser = self._create_extractor()
         ip = self.input_parser
         ip.filter_top_boxes()
         if len(ip.input_segments) == 0:
@@ -76,27 +99,29 @@ class TrackResegmenter(object):
 
         segment_info = self._map_samples_to_new_segments()
         self.track_id = ip.track_id
-        output_segments = []
-        segment_sizes = []
-        for i, seg_info in enumerate(segment_info):
-            output_segment = ""
-            if ip.styp:
-                output_segment += ip.styp
-            output_segment += self._generate_moof(i+1, seg_info)
-            output_segment += ip.construct_new_mdat(seg_info)
-            output_segments.append(output_segment)
-            segment_sizes.append(len(output_segment))
-        if self.output_file:
-            if self.output_file == self.input_file:
-                try:
-                    make_backup(self.input_file)
-                except BackupError:
-                    print("Backup file for %s already exists" %
-                          self.input_file)
-                    return
-            with open(self.output_file, "wb") as ofh:
-                input_header_end = self.input_parser.find_header_end()
-                ofh.write(ip.data[:input_header_end])
+        # First pass: the segment sizes needed for the sidx follow from the
+        # sample metadata, so no segment has to be kept in memory
+        segment_sizes = [self._segment_size(seg_info) for seg_info in segment_info]
+        if not self.output_file:
+            ip.close()
+            return
+        output_file = self.output_file
+        if self.output_file == self.input_file:
+            try:
+                make_backup(self.input_file)
+            except BackupError:
+                print("Backup file for %s already exists" %
+                      self.input_file)
+                ip.close()
+                return
+            # The input is memory mapped, so write beside it and rename
+            output_file = self.output_file + ".tmp"
+        try:
+            with open(output_file, "wb") as ofh:
+                header = ip.header_data()
+                ofh.write(header)
+                input_header_end = len(header)
+                self.init_range = "0-%d" % (input_header_end - 1)
                 if not self.skip_sidx:
                     sidx = self._generate_sidx(segment_info, segment_sizes,
                                                timescale)
@@ -104,35 +129,128 @@ class TrackResegmenter(object):
                     sidx_start = input_header_end
                     self.sidx_range = "%d-%d" % (sidx_start,
                                                  sidx_start + len(sidx) - 1)
-                for output_segment in output_segments:
-                    ofh.write(output_segment)
+                # Second pass: stream one segment at a time
+                for i, seg_info in enumerate(segment_info):
+                    self._write_segment(ofh, i + 1, seg_info, segment_sizes[i])
+        finally:
+            ip.close()
+        if output_file != self.output_file:
+            os.rename(output_file, self.output_file)
+
+    def _segment_size(self, seg_info):
+        "Size of output segment calculated from the sample metadata."
+        ip = self.input_parser
+        return (len(ip.styp) + self._moof_size(seg_info) + 8 +
+                ip.samples.data_size(seg_info.start_nr, seg_info.end_nr))
+
+    def _write_segment(self, ofh, sequence_nr, seg_info, segment_size):
+        "Write styp, moof and mdat of an output segment."
+        ip = self.input_parser
+        segment_start = ofh.tell()
+        if ip.styp:
+            ofh.write(ip.styp)
+        ofh.write(self._generate_moof(sequence_nr, seg_info))
+        mdat_size = 8 + ip.samples.data_size(seg_info.start_nr, seg_info.end_nr)
+        ofh.write(uint32_to_str(mdat_size) + 'mdat')
+        for offset, size in ip.samples.data_ranges(seg_info.start_nr,
+                                                   seg_info.end_nr):
+            ip.copy_data(ofh, offset, size)
+        if ofh.tell() - segment_start != segment_size:
+            raise ValueError("Segment %d has size %d, not %d as in sidx" %
+                             (sequence_nr, ofh.tell() - segment_start,
+                              segment_size))
+
+    def _find_cut_samples(self):
+        "Return the numbers of the samples where new segments start."
+        if self.sync_only or self.reference_file:
+            return self._find_cut_samples_at_targets()
+        samples = self.input_parser.samples
+        limit = self.duration_ms * self.input_parser.track_timescale
+        cuts = []
+        segment_nr = 1
+        if np is not None and not isinstance(samples.dur, array):
+            acc_time = np.cumsum(samples.dur, dtype=np.int64) * 1000
+            pos = 0
+            while pos < len(acc_time):
+                pos += int(np.searchsorted(acc_time[pos:], segment_nr * limit,
+                                           side='right'))
+                if pos >= len(acc_time):
+                    break
+                cuts.append(pos)
+                segment_nr += 1
+                pos += 1
+        else:
+            acc_time = 0
+            for i, dur in enumerate(samples.dur):
+                acc_time += dur
+                if acc_time * 1000 > segment_nr * limit:
+                    cuts.append(i)
+                    segment_nr += 1
+        return cuts
+
+    def _target_times(self):
+        "Wanted segment start times (after the first) in track timescale."
+        ip = self.input_parser
+        timescale = ip.track_timescale
+        first_time = int(ip.samples.start[0])
+        end_time = ip.samples.end_time(-1)
+        if self.reference_file:
+            reference = TrackDataExtractor(self.reference_file)
+            try:
+                reference.filter_top_boxes()
+                ref_timescale, ref_starts = reference.segment_boundaries()
+            finally:
+                reference.close()
+            targets = [start * timescale // ref_timescale for start in ref_starts[1:]]
+        else:
+            seg_dur = self.duration_ms * timescale / 1000.0
+            targets = []
+            segment_nr = 1
+            while first_time + segment_nr * seg_dur < end_time:
+                targets.append(first_time + int(round(segment_nr * seg_dur)))
+                segment_nr += 1
+        return [t for t in targets if first_time < t < end_time]
+
+    def _find_cut_samples_at_targets(self):
+        """Cut at the allowed sample closest to each target time.
+
+        Allowed samples are the sync samples if sync_only is set, else all."""
+        samples = self.input_parser.samples
+        if self.sync_only:
+            candidates = samples.sync_samples()
+            if not candidates or candidates[0] != 0:
+                raise ValueError("Track does not start with a sync sample")
+        else:
+            candidates = range(len(samples))
+        candidate_times = [int(samples.start[i]) for i in candidates]
+        last_sample = len(samples) - 1
+        cuts = []
+        for target in self._target_times():
+            pos = bisect_left(candidate_times, target)
+            if pos > 0 and (pos == len(candidates) or target - candidate_times[pos - 1] <
+                            candidate_times[pos] - target):
+                pos -= 1
+            cut = candidates[pos]
+            if cut == 0 or cut >= last_sample or (cuts and cut <= cuts[-1]):
+                continue
+            cuts.append(cut)
+        return cuts
 
     def _map_samples_to_new_segments(self):
         "Calculate which samples go into which segments."
         new_segment_info = []
-        segment_nr = 1
-        acc_time = 0
+        samples = self.input_parser.samples
+        nr_samples = len(samples)
         start_nr = 0
-        start_sample = self.input_parser.samples[0]
-        timescale = self.input_parser.track_timescale
-        nr_samples = len(self.input_parser.samples)
-        for i, sample in enumerate(self.input_parser.samples):
-            acc_time += sample.dur
-            if acc_time * 1000  > segment_nr * self.duration_ms * timescale:
-                end_sample = self.input_parser.samples[i-1]
-                end_time = end_sample.start + end_sample.dur
-                seg_dur = end_time - start_sample.start
-                info = SegmentInfo(start_nr, i, start_sample.start, seg_dur)
-                new_segment_info.append(info)
-                start_nr = i
-                start_sample = sample
-                segment_nr += 1
+        for i in self._find_cut_samples():
+            seg_dur = samples.end_time(i - 1) - samples.start[start_nr]
+            info = SegmentInfo(start_nr, i, int(samples.start[start_nr]), seg_dur)
+            new_segment_info.append(info)
+            start_nr = i
 
         if start_nr != nr_samples - 1:
-            end_sample = self.input_parser.samples[-1]
-            end_time = end_sample.start + end_sample.dur
-            info = SegmentInfo(start_nr, nr_samples, start_sample.start,
-                               end_time - start_sample.start)
+            info = SegmentInfo(start_nr, nr_samples, int(samples.start[start_nr]),
+                               samples.end_time(-1) - samples.start[start_nr])
             new_segment_info.append(info)
         if self.verbose:
             for i, info in enumerate(new_segment_info):
@@ -183,42 +301,58 @@ class TrackResegmenter(object):
         size = 8 + len(tfhd) + len(tfdt) + len(trun)
         return uint32_to_str(size) + 'traf' + tfhd + tfdt + trun
 
-    def _generate_tfhd(self, seg_info, track_id):
-        ip = self.input_parser
-        first_sample = ip.samples[seg_info.start_nr]
-        common_size = first_sample.size
-        common_dur = first_sample.dur
-        common_flags = first_sample.flags
-        common_cto = first_sample.cto
-        for sample in ip.samples[seg_info.start_nr + 1:seg_info.end_nr]:
-            if sample.dur != common_dur:
-                common_dur = None
-            if sample.size != common_size:
-                common_size = None
-            if sample.flags != common_flags:
-                common_flags = None
-            if sample.cto != common_cto:
-                common_cto = None
+    def _moof_size(self, seg_info):
+        "Size of the moof generated for seg_info."
+        defaults, sample_flags = self._sample_defaults(seg_info)[1:]
+        sample_count = seg_info.end_nr - seg_info.start_nr
+        tfhd_size = 16 + 4 * len(defaults)
+        tfdt_size = 20 if seg_info.start_time > 2 ** 30 else 16
+        trun_size = 20 + sample_count * nr_sample_bytes(sample_flags)
+        traf_size = 8 + tfhd_size + tfdt_size + trun_size
+        return 8 + 16 + traf_size
+
+    def _sample_defaults(self, seg_info):
+        """Find values common to all samples in segment.
+
+        Return tfhd flags, list of default values, and the trun flags for
+        the values needed per sample."""
+        samples = self.input_parser.samples
+        start_nr, end_nr = seg_info.start_nr, seg_info.end_nr
+        common = {}
+        for name in ('dur', 'size', 'flags', 'cto'):
+            if samples.is_constant(name, start_nr, end_nr):
+                common[name] = int(getattr(samples, name)[start_nr])
+            else:
+                common[name] = None
+        common_dur = common['dur']
+        common_size = common['size']
+        common_flags = common['flags']
+        common_cto = common['cto']
         flags = 0x020000
-        data = ""
+        defaults = []
         sample_flags = 0  # Which individual sample data is needed
         if common_dur is not None:
             flags |= 0x08
-            data += uint32_to_str(common_dur)
+            defaults.append(common_dur)
         else:
             sample_flags |= 0x100
         if common_size is not None:
             flags |= 0x10
-            data += uint32_to_str(common_size)
+            defaults.append(common_size)
         else:
             sample_flags |= 0x200
         if common_flags is not None:
             flags |= 0x20
-            data += uint32_to_str(common_flags)
+            defaults.append(common_flags)
         else:
             sample_flags |= 0x400
         if common_cto is None or common_cto != 0:
             sample_flags |= 0x800
+        return flags, defaults, sample_flags
+
+    def _generate_tfhd(self, seg_info, track_id):
+        flags, defaults, sample_flags = self._sample_defaults(seg_info)
+        data = "".join(uint32_to_str(value) for value in defaults)
         size = 16 + len(data)
         self.sample_flags = sample_flags
 
@@ -245,13 +379,6 @@ class TrackResegmenter(object):
 
     def _generate_trun(self, seg_info, offset):
         "Generate trun box with correct sample data for segment."
-
-        def nr_sample_bytes(sample_flags):
-            nr_bytes = 0
-            for pattern in (0x100, 0x200, 0x400, 0x800):
-                if sample_flags & pattern != 0:
-                    nr_bytes += 4
-            return nr_bytes
         version = 1  # Allow for signed cto
         ip = self.input_parser
         sample_data_size = nr_sample_bytes(self.sample_flags)
@@ -263,15 +390,10 @@ class TrackResegmenter(object):
         output += uint32_to_str(version_and_flags)
         output += uint32_to_str(sample_count)
         output += uint32_to_str(offset + trun_size + 8)  # 8 bytes into mdat
-        for sample in ip.samples[seg_info.start_nr:seg_info.end_nr]:
-            if self.sample_flags & 0x100:
-                output += uint32_to_str(sample.dur)
-            if self.sample_flags & 0x200:
-                output += uint32_to_str(sample.size)
-            if self.sample_flags & 0x400:
-                output += uint32_to_str(sample.flags)
-            if self.sample_flags & 0x800:
-                output += sint32_to_str(sample.cto)
+        columns = [name for name, pattern in (('dur', 0x100), ('size', 0x200),
+                                              ('flags', 0x400), ('cto', 0x800))
+                   if self.sample_flags & pattern]
+        output += ip.samples.pack(columns, seg_info.start_nr, seg_info.end_nr)
         return output
 
 
@@ -308,11 +430,24 @@ def main():
                         dest="skip_sidx",
                         help="Do not write sidx box to output")
 
+    parser.add_argument("-k", "--keyframes",
+                        action="store_true",
+                        dest="sync_only",
+                        help="Only start segments at sync samples (video)")
+
+    parser.add_argument("-r", "--reference-file",
+                        action="store",
+                        dest="reference_file",
+                        default=None,
+                        help="Align segments to the segments of this track "
+                             "instead of using duration")
+
     args = parser.parse_args()
 
     resegmenter = TrackResegmenter(args.input_file, args.duration,
                                    args.output_file, args.skip_sidx,
-                                   args.verbose)
+                                   args.verbose, args.sync_only,
+                                   args.reference_file)
     resegmenter.resegment()
 
 
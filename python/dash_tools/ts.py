@@ -41,12 +41,13 @@ import time
 import struct
 import socket
 import select
-import httplib
 import binascii
 import optparse
-import urlparse
 import datetime
 
+import httpio
+import scte35
+
 class Logger(object):
     "Simple log class where output can be turned off."
 
@@ -108,6 +109,14 @@ EIT_PID = 0x0012
 EIT_PID2 = 0x0080
 STUFFING_PID = 0x1fff
 
+# Table ids
+PAT_TABLE_ID = 0x00
+PMT_TABLE_ID = 0x02
+NIT_ACTUAL_TABLE_ID = 0x40
+NIT_OTHER_TABLE_ID = 0x41
+EIT_FIRST_TABLE_ID = 0x4e
+EIT_LAST_TABLE_ID = 0x6f
+
 # Stream Types
 # See http://www.atsc.org/cms/standards/Code-Points-Registry-Rev-35.xlsx
 STREAM_TYPE_MPEG1_VIDEO   = 0x01
@@ -119,6 +128,7 @@ STREAM_TYPE_AUDIO_ADTS    = 0x0f
 STREAM_TYPE_H264          = 0x1b
 STREAM_TYPE_MPEG4_VIDEO   = 0x10
 STREAM_TYPE_METADATA      = 0x15
+STREAM_TYPE_HEVC          = 0x24
 STREAM_TYPE_AAC           = 0x11
 STREAM_TYPE_MPEG2_VIDEO_2 = 0x80
 STREAM_TYPE_AC3           = 0x81
@@ -140,6 +150,7 @@ STREAM_TYPES = {
     STREAM_TYPE_H264 : 'H264 video',
     STREAM_TYPE_MPEG4_VIDEO : 'MPEG4 video',
     STREAM_TYPE_METADATA : 'Metadata',
+    STREAM_TYPE_HEVC : 'HEVC video',
     STREAM_TYPE_AAC : 'AAC',
     STREAM_TYPE_AC3 : 'AC3',
     STREAM_TYPE_PCM : 'PCM',
@@ -269,6 +280,11 @@ def read_bits(reader, num_bits, text, display, to_hex=False):
     print_bits(text, num, display, to_hex)
     return num
 
+def wall_clock():
+    "Current wall-clock time in seconds, as stamped on frames."
+    time_now = datetime.datetime.utcnow()
+    return time.mktime(time_now.timetuple()) + time_now.microsecond / 1000000.0
+
 class frame(object):
     def __init__(self, data, sync, wall_clk, pts, dts, frame_type=''):
         self.data = data
@@ -279,9 +295,12 @@ class frame(object):
         self.frame_type = frame_type
 
     def __str__(self):
-        return 'frame_type={0} wall_clk={1:.4f} pts={2} ({3:.2f}) dts={4} ({5:.2f}) diff={6}'\
+        wall_clk = '-'
+        if self.wall_clk is not None:
+            wall_clk = '{0:.4f}'.format(self.wall_clk)
+        return 'frame_type={0} wall_clk={1} pts={2} ({3:.2f}) dts={4} ({5:.2f}) diff={6}'\
             .format(self.frame_type,
-                    self.wall_clk,
+                    wall_clk,
                     self.pts,
                     self.pts / 90.0,
                     self.dts,
@@ -380,44 +399,104 @@ class pmt_info(object):
         self.program_pid = program_pid
 
 #
-# PAT parser
+# PSI sections
 #
-class pat(ts_packet):
-    def __init__(self, data, display=False):
-        ts_packet.__init__(self, data, display)
+# Bit fields are described by tables of (attribute, number of bits, display text)
+PSI_HEADER_FIELDS = (('table_id',                 8,  'table id'),
+                     ('section_syntax_indicator', 1,  'section syntax indicator'),
+                     ('marker',                   1,  'marker'),
+                     ('reserved_1',               2,  'reserved'),
+                     ('section_length',           12, 'section length'),
+                     ('table_id_extension',       16, 'table id extension'),
+                     ('reserved_2',               2,  'reserved'),
+                     ('version_number',           5,  'version number'),
+                     ('current_next_indicator',   1,  'current next indicator'),
+                     ('section_number',           8,  'section number'),
+                     ('last_section_number',      8,  'last section number'))
+
+PAT_PROGRAM_FIELDS = (('program_num',     16, 'program num'),
+                      ('reserved',        3,  'reserved'),
+                      ('program_map_pid', 13, 'program map pid'))
+
+PMT_FIELDS = (('reserved_3',          3,  'reserved'),
+              ('pcr_pid',             13, 'pcr pid'),
+              ('reserved_4',          4,  'reserved'),
+              ('program_info_length', 12, 'program info length'))
+
+PMT_STREAM_FIELDS = (('stream_type',    8,  'stream type'),
+                     ('reserved_a',     3,  'reserved (7)'),
+                     ('elementary_pid', 13, 'elementary pid'),
+                     ('reserved_b',     4,  'reserved'),
+                     ('es_info_length', 12, 'es info length'))
+
+NIT_FIELDS = (('reserved_3',                 4,  'reserved future use'),
+              ('network_descriptors_length', 12, 'network descriptors length'))
+
+NIT_LOOP_FIELDS = (('reserved_4',                   4,  'reserved future use'),
+                   ('transport_stream_loop_length', 12, 'transport stream loop length'))
+
+NIT_TRANSPORT_STREAM_FIELDS = (('transport_stream_id',          16, 'transport stream id'),
+                               ('original_network_id',          16, 'original network id'),
+                               ('reserved',                     4,  'reserved for future use'),
+                               ('transport_descriptors_length', 12, 'transport descriptors length'))
+
+EIT_FIELDS = (('transport_stream_id',         16, 'transport stream id'),
+              ('original_network_id',         16, 'original network id'),
+              ('segment_last_section_number', 8,  'segment last section number'),
+              ('last_table_id',               8,  'last table id'))
+
+EIT_EVENT_FIELDS = (('event_id',                16, 'event id'),
+                    ('start_time',              40, 'start time'),
+                    ('duration',                24, 'duration'),
+                    ('running_status',          3,  'running status'),
+                    ('free_CA_mode',            1,  'free CA mode'),
+                    ('descriptors_loop_length', 12, 'descriptors loop length'))
+
+def fields_size(fields):
+    return sum(nr_bits for _, nr_bits, _ in fields) // 8
+
+def unpack_fields(data, offset, fields, display=False, indent='  '):
+    "Decode the big-endian bit fields described by fields at offset. Returns a dict."
+    nr_bits = fields_size(fields) * 8
+    value = int(binascii.hexlify(data[offset:offset + nr_bits // 8]), 16)
+    result = {}
+    for name, bits, text in fields:
+        nr_bits -= bits
+        result[name] = (value >> nr_bits) & ((1 << bits) - 1)
+        print_bits(indent + text, result[name], display)
+    return result
+
+class psi_section(object):
+    "A long-form PSI/SI section. Subclasses parse the table specific part in parse()."
+    name = 'PSI SECTION'
 
+    def __init__(self, data, display=False):
+        self.data = data
         if display:
-            log('[PROGRAM ASSOCIATION TABLE]')
-
-        self.pointer_field              = read_bits(self.reader, 8,  '  pointer field', display)
-        if self.pointer_field:
-            self.reader.step_bytes(self.pointer_field)
-
-        self.table_id                   = read_bits(self.reader, 8,  '  table id', display)
-        self.section_syntax_indicator   = read_bits(self.reader, 1,  '  section syntax indicator', display)
-        self.marker                     = read_bits(self.reader, 1,  '  marker (0)', display)
-        self.reserved_1                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.section_length             = read_bits(self.reader, 12, '  section length', display)
-        self.transport_stream_id        = read_bits(self.reader, 16, '  transport stream id', display)
-        self.reserved_2                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.version_number             = read_bits(self.reader, 5,  '  version number', display)
-        self.current_next_indicator     = read_bits(self.reader, 1,  '  current next indicator', display)
-        self.section_number             = read_bits(self.reader, 8,  '  section number', display)
-        self.last_section_number        = read_bits(self.reader, 8,  '  last section number', display)
+            log('[%s]' % self.name)
+        self.__dict__.update(unpack_fields(data, 0, PSI_HEADER_FIELDS, display))
+        # End of the table data, before CRC_32
+        self.end = min(3 + self.section_length, len(data)) - 4
+        self.parse(8, display)
+        self.crc32 = struct.unpack('>I', data[self.end:self.end + 4])[0]
+        print_bits('  crc32', self.crc32, display, to_hex=True)
+
+    def parse(self, pos, display):
+        pass
 
-        self.pmt_info = []
+class pat(psi_section):
+    name = 'PROGRAM ASSOCIATION TABLE'
 
-        num_programs = (self.section_length - 5 - 4) / 4
-        for i in range(num_programs):
+    def parse(self, pos, display):
+        self.transport_stream_id = self.table_id_extension
+        self.pmt_info = []
+        while pos + 4 <= self.end:
             if display:
                 log('  [PROGRAM]')
-            program_num         = read_bits(self.reader, 16, '    program num', display)
-            reserved            = read_bits(self.reader, 3,  '    reserved', display)
-            program_map_pid     = read_bits(self.reader, 13, '    program map pid', display)
-            #if program_num == 0:
-                #log('    NOTE, this is the NETWOTK PID (NIT)')
-            self.pmt_info.append(pmt_info(program_num, reserved, program_map_pid))
-        self.crc32 = read_bits(self.reader, 32, '  crc32', display, to_hex = True)
+            program = unpack_fields(self.data, pos, PAT_PROGRAM_FIELDS, display, '    ')
+            self.pmt_info.append(pmt_info(program['program_num'], program['reserved'],
+                                          program['program_map_pid']))
+            pos += 4
 
 class descriptor(object):
     def __init__(self, tag, data):
@@ -595,300 +674,194 @@ class pmt_stream(object):
         self.es_description = es_description
         self.descriptors = descriptors
 
-#
-# PMT parser
-#
-class pmt(ts_packet):
-    def __init__(self, data, display=False):
-        ts_packet.__init__(self, data, display)
+class pmt(psi_section):
+    name = 'PROGRAM MAP TABLE'
 
-        if display:
-            log('[PROGRAM MAP TABLE]')
-
-        self.pointer_field              = read_bits(self.reader, 8,  '  pointer field', display)
-        if self.pointer_field:
-            self.reader.step_bytes(self.pointer_field)
-
-        self.table_id                   = read_bits(self.reader, 8,  '  table id', display)
-        self.section_syntax_indicator   = read_bits(self.reader, 1,  '  section syntax indicator', display)
-        self.marker                     = read_bits(self.reader, 1,  '  marker', display)
-        self.reserved_1                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.section_length             = read_bits(self.reader, 12, '  section length', display)
-        self.program_num                = read_bits(self.reader, 16, '  program num', display)
-        self.reserved_2                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.version_number             = read_bits(self.reader, 5,  '  version', display)
-        self.current_next_indicator     = read_bits(self.reader, 1,  '  current next indicator', display)
-        self.section_number             = read_bits(self.reader, 8,  '  section number', display)
-        self.last_section_number        = read_bits(self.reader, 8,  '  last section number', display)
-        self.reserved_3                 = read_bits(self.reader, 3,  '  reserved', display)
-        self.pcr_pid                    = read_bits(self.reader, 13, '  pcr pid', display)
-        self.reserved_4                 = read_bits(self.reader, 4,  '  reserved', display)
-        self.program_info_length        = read_bits(self.reader, 12, '  program info length', display)
-
-        if self.program_info_length:
-            self.reader.step_bytes(self.program_info_length)
+    def parse(self, pos, display):
+        self.program_num = self.table_id_extension
+        self.__dict__.update(unpack_fields(self.data, pos, PMT_FIELDS, display))
+        pos += 4 + self.program_info_length
 
         self.stream_list = []
-        counter = 0
-        num = self.section_length - 9 - self.program_info_length - 4
-        while counter <  num:
-            stream_type = self.reader.get_bits(8)
+        while pos + 5 <= self.end:
+            stream = unpack_fields(self.data, pos, PMT_STREAM_FIELDS)
             if display:
-                log('  [STREAM] - %s' % get_stream_type(stream_type))
-                print_bits('    stream type', stream_type, display, to_hex = True)
-            reserved_a      = read_bits(self.reader, 3,  '    reserved (7)', display)
-            elementary_pid  = read_bits(self.reader, 13, '    elementary pid', display)
-            reserved_b      = read_bits(self.reader, 4,  '    reserved', display)
-            es_info_length  = read_bits(self.reader, 12, '    es info length', display)
+                log('  [STREAM] - %s' % get_stream_type(stream['stream_type']))
+                for name, _, text in PMT_STREAM_FIELDS:
+                    print_bits('    ' + text, stream[name], display, to_hex=name == 'stream_type')
+            pos += 5
+            es_info_length = stream['es_info_length']
             es_description = None
             descriptors = []
-            counter += 5
             if es_info_length:
-                es_description = self.data[self.reader.index - 1 : self.reader.index - 1 + es_info_length]
+                es_description = self.data[pos:pos + es_info_length]
                 descriptors = parse_descriptors(es_description, display)
-                counter += es_info_length
-                self.reader.step_bytes(es_info_length)
-            self.stream_list.append(pmt_stream(stream_type,
-                                               reserved_a,
-                                               elementary_pid,
-                                               reserved_b,
+                pos += es_info_length
+            self.stream_list.append(pmt_stream(stream['stream_type'],
+                                               stream['reserved_a'],
+                                               stream['elementary_pid'],
+                                               stream['reserved_b'],
                                                es_info_length,
                                                es_description,
                                                descriptors))
-        self.crc32 = read_bits(self.reader, 32, '  crc32', display, to_hex=True)
 
 #
 # NIT parser
 # https://svn.baysse.fr/svn/pouchintv/docs/MPEG-2_Transport_Stream/49346_DVB.pdf
 #
-class nit(ts_packet):
-    def __init__(self, data, display=False):
-        ts_packet.__init__(self, data, display)
-
-        if display:
-            log('[NETWORK INFORMATION TABLE]')
-
-        self.pointer_field              = read_bits(self.reader, 8,  '  pointer field', display)
-        if self.pointer_field:
-            self.reader.step_bytes(self.pointer_field)
-
-        self.table_id                   = read_bits(self.reader, 8,  '  table id', display)
-        self.section_syntax_indicator   = read_bits(self.reader, 1,  '  section syntax indicator', display)
-        self.marker                     = read_bits(self.reader, 1,  '  reserved future use', display)
-        self.reserved_1                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.section_length             = read_bits(self.reader, 12, '  section length', display)
-        self.network_id                 = read_bits(self.reader, 16, '  network id', display)
-        self.reserved_2                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.version_number             = read_bits(self.reader, 5,  '  version', display)
-        self.current_next_indicator     = read_bits(self.reader, 1,  '  current next indicator', display)
-        self.section_number             = read_bits(self.reader, 8,  '  section number', display)
-        self.last_section_number        = read_bits(self.reader, 8,  '  last section number', display)
-        self.reserved_3                 = read_bits(self.reader, 4,  '  reserved future use', display)
-        self.network_descriptors_length = read_bits(self.reader, 12, '  network descriptors length', display)
-
-        # For now, skip network descriptors
-        if self.network_descriptors_length:
-            description = self.data[self.reader.index - 1 : self.reader.index - 1 + self.network_descriptors_length]
-            descriptors = parse_descriptors(description)
-            self.reader.step_bytes(self.network_descriptors_length)
-
-        self.reserved_4                   = read_bits(self.reader, 4,  '  reserved future use', display)
-        self.transport_stream_loop_length = read_bits(self.reader, 12, '  transport stream loop length', display)
-
+class nit(psi_section):
+    name = 'NETWORK INFORMATION TABLE'
+
+    def parse(self, pos, display):
+        self.network_id = self.table_id_extension
+        self.__dict__.update(unpack_fields(self.data, pos, NIT_FIELDS, display))
+        pos += 2
+        self.network_descriptors = parse_descriptors(self.data[pos:pos + self.network_descriptors_length])
+        pos += self.network_descriptors_length
+
+        self.__dict__.update(unpack_fields(self.data, pos, NIT_LOOP_FIELDS, display))
+        pos += 2
+        end = min(pos + self.transport_stream_loop_length, self.end)
         self.stream_list = []
-        counter = 0
-        num = self.transport_stream_loop_length
-        while counter <  num:
+        while pos + 6 <= end:
             if display:
                 log('  [TRANSPORT STREAM] ')
-            read_bits(self.reader, 16, '    transport stream id', display)
-            read_bits(self.reader, 16, '    original network id', display)
-            read_bits(self.reader, 4,  '    reserved for future use', display)
-            tlen = read_bits(self.reader, 12,  '    transport descriptors length', display)
-            counter += 6
-
-            if tlen:
-                description = self.data[self.reader.index - 1 : self.reader.index - 1 + tlen]
-                descriptors = parse_descriptors(description)
-                self.reader.step_bytes(tlen)
-                counter += tlen
-
-        self.crc32 = read_bits(self.reader, 32, '  crc32', display, to_hex = True)
+            stream = unpack_fields(self.data, pos, NIT_TRANSPORT_STREAM_FIELDS, display, '    ')
+            pos += 6
+            tlen = stream['transport_descriptors_length']
+            stream['descriptors'] = parse_descriptors(self.data[pos:pos + tlen])
+            pos += tlen
+            self.stream_list.append(stream)
 
 #
 # EIT parser
 # en_300468v011101p section 5.2.4
 #
-class eit(ts_packet):
-    def __init__(self, data, display=False):
-        ts_packet.__init__(self, data, display)
+class eit(psi_section):
+    name = 'EVENT INFORMATION TABLE'
+
+    def parse(self, pos, display):
+        self.service_id = self.table_id_extension
+        self.__dict__.update(unpack_fields(self.data, pos, EIT_FIELDS, display))
+        pos += 6
+        self.events = []
+        while pos + 12 <= self.end:
+            event = unpack_fields(self.data, pos, EIT_EVENT_FIELDS, display, '    ')
+            pos += 12
+            tlen = event['descriptors_loop_length']
+            event['descriptors'] = parse_descriptors(self.data[pos:pos + tlen])
+            pos += tlen
+            self.events.append(event)
+
+PSI_TABLES = {PAT_TABLE_ID : pat,
+              PMT_TABLE_ID : pmt,
+              NIT_ACTUAL_TABLE_ID : nit,
+              NIT_OTHER_TABLE_ID : nit}
+for table_id in range(EIT_FIRST_TABLE_ID, EIT_LAST_TABLE_ID + 1):
+    PSI_TABLES[table_id] = eit
 
-        if display:
-            log('[EVENT INFORMATION TABLE]')
-
-        self.pointer_field              = read_bits(self.reader, 8,  '  pointer field', display)
-        if self.pointer_field:
-            self.reader.step_bytes(self.pointer_field)
-
-        self.table_id                   = read_bits(self.reader, 8,  '  table id', display, to_hex=True)
-        self.section_syntax_indicator   = read_bits(self.reader, 1,  '  section syntax indicator', display)
-        self.marker                     = read_bits(self.reader, 1,  '  reserved future use', display)
-        self.reserved_1                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.section_length             = read_bits(self.reader, 12, '  section length', display)
-        self.service_id                 = read_bits(self.reader, 16, '  service id', display)
-        self.reserved_2                 = read_bits(self.reader, 2,  '  reserved', display)
-        self.version_number             = read_bits(self.reader, 5,  '  version', display)
-        self.current_next_indicator     = read_bits(self.reader, 1,  '  current next indicator', display)
-        self.section_number             = read_bits(self.reader, 8,  '  section number', display)
-        self.last_section_number        = read_bits(self.reader, 8,  '  last section number', display)
-        self.transport_stream_id        = read_bits(self.reader, 16, '  transport stream id', display)
-        self.original_network_id        = read_bits(self.reader, 16, '  original network id', display)
-        self.segment_last_section_number = read_bits(self.reader, 8,  '  segment last section number', display)
-        self.last_table_id              = read_bits(self.reader, 8,  '  last table id', display, to_hex=True)
+#
+# MPEG-2 CRC32 (polynomial 0x04c11db7, no reflection, no final xor)
+#
+def make_crc32_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            if crc & 0x80000000:
+                crc = (crc << 1) ^ 0x04c11db7
+            else:
+                crc <<= 1
+        table.append(crc & 0xffffffff)
+    return table
 
-        done = False
-        if self.section_length < 16:
-            done = True
-        while not done:
-            event_id = read_bits(self.reader, 16,  '    event id', display)
-            start_time = read_bits(self.reader, 40,  '    start time', display)
-            duration = read_bits(self.reader, 24,  '    duration', display)
-            running_status = read_bits(self.reader, 3,  '    running status', display)
-            free_CA_mode = read_bits(self.reader, 1,  '    free CA mode', display)
-            descriptors_loop_length = read_bits(self.reader, 12,  '    descriptors loop length', display)
+CRC32_TABLE = make_crc32_table()
 
-            tlen = descriptors_loop_length
-            description = self.data[self.reader.index - 1 : self.reader.index - 1 + tlen]
-            descriptors = parse_descriptors(description)
-            self.reader.step_bytes(tlen)
+def crc32_mpeg(data):
+    "CRC32 of data. A section including its CRC_32 field has CRC 0."
+    crc = 0xffffffff
+    table = CRC32_TABLE
+    for c in data:
+        crc = ((crc << 8) & 0xffffffff) ^ table[(crc >> 24) ^ ord(c)]
+    return crc
 
-            done = True
+class section_cache(object):
+    """Filter out repeated and corrupt long-form sections.
 
-class SCTE35(ts_packet):
-    "SCTE-35 cue packet parser."
+    The version and CRC of the last accepted section is kept per PID, table_id,
+    table_id_extension and section_number. A repetition is recognized without
+    computing any CRC, so the cost of the ~10 Hz PSI repetitions is negligible."""
 
-    def __init__(self, data, display=False):
-        ts_packet.__init__(self, data, display)
-        if display:
-            log('[SCTE-35 CUE PACKET] payload_length = %d' % len(self.payload))
-            log(dump_hex(self.payload, 16))
-        # Parse according to section 7.2 in SCTE35 2013 standard
-        self.first_byte               = read_bits(self.reader, 8, ' first_byte', display)
-        # One byte of zero, then
-        self.table_id                 = read_bits(self.reader, 8, ' table_id', display, to_hex=True)
-        self.section_syntax_indicator = read_bits(self.reader, 1, ' section_syntax_indicator', display)
-        self.private_indicator        = read_bits(self.reader, 1, ' private_indicator', display)
-        reserved                      = read_bits(self.reader, 2, ' reserved', display)
-        self.section_length           = read_bits(self.reader, 12, ' section_length', display)
-        self.protocol_version         = read_bits(self.reader, 8, ' protocol_version', display)
-        self.encrypted_packet         = read_bits(self.reader, 1, ' encrypted_packet', display)
-        self.encryption_algorithm     = read_bits(self.reader, 6, ' encryption_algorithm', display)
-        self.pts_adjustment           = read_bits(self.reader, 33, ' pts_adjustment', display)
-        self.cw_index                 = read_bits(self.reader, 8, ' cw_index', display)
-        self.tier                     = read_bits(self.reader, 12, ' tier', display)
-        self.splice_command_length    = read_bits(self.reader, 12, ' splice_command_length', display)
-        self.splice_command_type      = read_bits(self.reader, 8, ' splice_command_type', display)
-        self.duration = -1
-        self.splice_time_pts = -1
-        # In one of the following methods we should read self.splice_command_length - 1 bytes
-        # It actually says that the splice_command_type should not be included in the standard, but that doesn't agree
-        # with the sample we got from RJIL.
-
-        if self.splice_command_type == 0x00:
-            self.splice_null(self.splice_command_length-1)
-        elif self.splice_command_type == 0x04:
-            self.splice_schedule(self.splice_command_length-1)
-        elif self.splice_command_type == 0x05:
-            self.splice_insert(self.splice_command_length-1)
-        elif self.splice_command_type == 0x06:
-            self.time_signal(self.splice_command_length-1)
-        elif self.splice_command_type == 0x07:
-            self.bandwidth_reservation(self.splice_command_length-1)
-        elif self.splice_command_type == 0xff:
-            self.private_command(self.splice_command_length-1)
-        else: #Reserved types
-            log("ERROR: SCTE splice_command_type = %d not known" % splice_command_type)
-
-        self.descriptor_loop_length = read_bits(self.reader, 16, ' descriptor_loop_length', display)
-        # There are this many byte of descriptor data
-        if self.descriptor_loop_length > 0:
-            self.splice_descriptor(self.descriptor_loop_length, display)
-        if self.encrypted_packet:
-            self.encrypted_crc_32 = read_bits(self.reader, 32, ' E_CRC_32', display, to_hex=True)
-        self.crc_32               = read_bits(self.reader, 32, ' CRC_32', display, to_hex=True)
-
-    def splice_null(self, nr_bytes):
-        data = read_bits(self.reader, 8*nr_bytes, " splice_null_data", True)
-        log("SCTE35: splice_null(%d)" % nr_bytes)
-
-    def splice_schedule(self, nr_bytes):
-        log("SCTE35: splice_schedule(%d)" % nr_bytes)
-
-    def splice_insert(self, nr_bytes):
-        display = True
-        log("SCTE35: splice_insert(%d)" % nr_bytes)
-        splice_event_id = read_bits(self.reader, 32, ' splice_event_id', display)
-        splice_event_cancel_indicator = read_bits(self.reader, 1, ' splice_event_cancel_indidator', display)
-        reserved = read_bits(self.reader, 7, ' reserved', display)
-        if splice_event_cancel_indicator == 0:
-            out_of_network_indicator = read_bits(self.reader, 1, ' out_of_network_indicator', display)
-            program_splice_flag = read_bits(self.reader, 1, ' program_splice_flag', display)
-            duration_flag = read_bits(self.reader, 1, ' duration_flag', display)
-            splice_immediate_flag = read_bits(self.reader, 1, ' splice_immediate_flag', display)
-            reserved = read_bits(self.reader, 4, ' reserved', display)
-            if program_splice_flag == 1 and splice_immediate_flag == 0:
-                self.splice_time(display)
-            if program_splice_flag == 0:
-                component_count = read_bits(self.reader, 8, ' component_count', display)
-                for i in range(component_count):
-                    component_tag = read_bits(self.reader, 8, ' out_of_network_indicator', display)
-                    if splice_immediate_flag == 0:
-                        self.splice_time(display)
-        if duration_flag == 1:
-            self.break_duration(display )
-        unique_program_id = read_bits(self.reader, 16, ' unique_program_id', display)
-        avail_num = read_bits(self.reader, 8, ' avail_num', display)
-        avails_expected = read_bits(self.reader, 8, ' avails_expected', display)
-
-    def time_signal(self, nr_bytes):
-        log("SCTE35: time_signal(%d)" % nr_bytes)
-
-    def bandwidth_reservation(self, nr_bytes):
-        log("SCTE35: bandwidth_reservation(%d)" % nr_bytes)
-
-    def private_command(self, nr_bytes):
-        log("SCTE35: private_command(%d)" % nr_bytes)
-
-    def splice_time(self, display):
-        log("SCTE35: splice_time")
-        time_specified_flag = read_bits(self.reader, 1, ' time_specified_flag', display)
-        if time_specified_flag == 1:
-            reserved = read_bits(self.reader, 6, ' reserved', display)
-            pts_time = read_bits(self.reader, 33, ' pts_time', display)
-            self.splice_time_pts = pts_time
-        else:
-            reserved = read_bits(self.reader, 7, ' reserved', display)
+    def __init__(self):
+        self.signatures = {}
+        self.nr_new = 0
+        self.nr_repeated = 0
+        self.nr_crc_errors = 0
+
+    def is_new(self, pid, section):
+        "True if section is valid and differs from the previous one of the same table."
+        if len(section) < 12:
+            return False
+        key = (pid, section[0], section[3:5], section[6])
+        signature = (ord(section[5]) & 0x3e, section[-4:])
+        if self.signatures.get(key) == signature:
+            self.nr_repeated += 1
+            return False
+        if crc32_mpeg(section):
+            self.nr_crc_errors += 1
+            log('CRC error in section with table_id 0x{0:02x} on pid {1}'.format(ord(section[0]), pid))
+            return False
+        if not ord(section[5]) & 0x01:
+            # current_next_indicator == 0, not applicable yet
+            return False
+        self.signatures[key] = signature
+        self.nr_new += 1
+        return True
 
-    def break_duration(self, display):
-        log("SCTE35: break_duration")
-        auto_return = read_bits(self.reader, 1, ' auto_return', display)
-        reserved = read_bits(self.reader, 6, ' reserved', display)
-        self.duration = read_bits(self.reader, 33, ' duration', display)
+#
+# Section assembler
+#
+class section_assembler(object):
+    """Reassemble PSI/SI sections from the TS packets of one PID.
 
-    def splice_descriptor(self, length, display):
-        log("SCTE35: splice_descriptor")
-        splice_descriptor_tag = read_bits(self.reader, 8, ' splice_descriptor_tag', display)
-        descriptor_length = read_bits(self.reader, 8, ' descriptor_length', display)
-        assert descriptor_length == length - 2
-        identifier = read_bits(self.reader, 32, ' identifier', display, to_hex=True)
-        for i in range(descriptor_length-4):
-            data = read_bits(self.reader, 8, ' private_byte', display)
+    Sections may span several packets, and a packet may carry the end of one
+    section and the start of one or more new sections."""
 
+    def __init__(self):
+        self.data = ''
 
-    def __str__(self):
-        return "Type = %x, time=%d, duration=%d" % (self.splice_command_type,
-                                                    self.splice_time_pts,
-                                                    self.duration)
+    def add_packet(self, packet):
+        "Add the payload of a TS packet. Returns a list of complete sections."
+        payload = packet.payload
+        if not payload:
+            return []
+        sections = []
+        if packet.payload_unit_start_indicator:
+            pointer_field = ord(payload[0])
+            if self.data:
+                self.data += payload[1:1 + pointer_field]
+                sections += self._extract_sections()
+            self.data = payload[1 + pointer_field:]
+        elif self.data:
+            self.data += payload
+        else:
+            return []
+        sections += self._extract_sections()
+        return sections
+
+    def _extract_sections(self):
+        sections = []
+        while len(self.data) >= 3:
+            if self.data[0] == '\xff':
+                # Stuffing until end of packet
+                self.data = ''
+                break
+            section_length = ((ord(self.data[1]) & 0x0f) << 8) | ord(self.data[2])
+            if len(self.data) < 3 + section_length:
+                break
+            sections.append(self.data[:3 + section_length])
+            self.data = self.data[3 + section_length:]
+        return sections
 
 #
 # PES parser
@@ -991,6 +964,8 @@ class observer(object):
         pass
     def on_pes(self, pid, pes):
         pass
+    def on_scte35(self, importer, pid, cue):
+        pass
     def flush(self):
         pass
     def get_scte35_pids(self):
@@ -1012,6 +987,12 @@ class ts_importer(object):
         self.log_cc = log_cc
         self.pids = {}
         self.scte35_pids = set()
+        self.section_assemblers = {}
+        self.section_cache = section_cache()
+        self.table_handlers = {pat : self._on_pat,
+                               pmt : self._on_pmt,
+                               nit : self._on_nit,
+                               eit : self._on_eit}
 
         self.num_packets = 0
         self.num_bytes = 0
@@ -1022,10 +1003,10 @@ class ts_importer(object):
         self.first_pts = 0
         self.last_pts = 0
 
-        self.eit_data = ''
-
     # Use the preflight for vod to get pat and pmt
-    def preflight(self, data):
+    def preflight(self, data, final=True):
+        """Find the PAT and PMT in data. If final is False, return False instead
+        of raising when they are not found, so that more data can follow."""
         offset = 0
         pids = {}
         while offset < len(data) and ord(data[offset]) == 0x47:
@@ -1037,21 +1018,18 @@ class ts_importer(object):
             pids[packet.pid] += 1
             self.preflight_packets += 1
 
-            if packet.pid == PAT_PID:
-                self._handle_pat(packet)
-            elif packet.pid == self.pmt_pid:
-                self._handle_pmt(packet)
-                #return True
-            elif packet.pid == self.nit_pid:
-                self._handle_nit(packet)
-                #return True
-            elif packet.pid == EIT_PID or packet.pid == EIT_PID2:
-                self._handle_eit(packet)
+            if packet.pid in (PAT_PID, self.pmt_pid, self.nit_pid, EIT_PID, EIT_PID2):
+                self._handle_psi(packet)
             offset += 188
 
             if self.has_pmt and self.preflight_packets > 100:
+                # The data is parsed again, so drop partial sections
+                self.section_assemblers = {}
                 return True
 
+        if not final:
+            return False
+        self.section_assemblers = {}
         log('pids found: %s' % pids)
         raise Exception('Could not find pat/pmt during preflight')
 
@@ -1078,7 +1056,7 @@ class ts_importer(object):
             if packet.transport_error_indicator:
                 self.packet_errors += 1
             elif packet.pid == PAT_PID:
-                self._handle_pat(packet)
+                self._handle_psi(packet)
             elif packet.pid == CA_PID:
                 #log('TODO: CA packet')
                 pass
@@ -1086,10 +1064,8 @@ class ts_importer(object):
                 self.num_stuffing_packets += 1
             #elif packet.pid == SDT_PID:
             #    log('TODO: SDT packet')
-            elif packet.pid == self.pmt_pid:
-                self._handle_pmt(packet)
-            elif packet.pid == self.nit_pid:
-                self._handle_nit(packet)
+            elif packet.pid == self.pmt_pid or packet.pid == self.nit_pid:
+                self._handle_psi(packet)
             elif packet.pid in self.scte35_pids:
                 self._handle_scte35(packet)
             elif packet.pid in self.pids.keys():
@@ -1163,6 +1139,9 @@ class ts_importer(object):
         log('First PTS: %.2f sec' % self.first_pts)
         log('Last PTS: %.2f sec' % self.last_pts)
         log('Transport errors: %s' % self.packet_errors)
+        log('PSI sections: %d new, %d repeated, %d CRC errors' % (self.section_cache.nr_new,
+                                                                  self.section_cache.nr_repeated,
+                                                                  self.section_cache.nr_crc_errors))
 
         log('')
         log('pids found:')
@@ -1192,57 +1171,77 @@ class ts_importer(object):
         if self.log_cc:
             mpeg_video_cc = self.observer.mpeg_video_parser.get_cc_summary()
             h264_cc = self.observer.h264_parser.get_cc_summary()
+            h265_cc = self.observer.h265_parser.get_cc_summary()
             if mpeg_video_cc:
                 self.print_cc_summary("MPEG2", mpeg_video_cc)
             if h264_cc:
                 self.print_cc_summary("H.264", h264_cc)
-
-    def _handle_pat(self, packet):
-        if self.has_pat:
-            return
-        pat_packet = pat(packet.data, display=self.options['verbose'] >= 2)
-        self.observer.on_pat(pat_packet)
-        for info in pat_packet.pmt_info:
+            if h265_cc:
+                self.print_cc_summary("HEVC", h265_cc)
+
+    def _new_sections(self, packet):
+        "Complete sections on the pid of packet, without repetitions and corrupt sections."
+        assembler = self.section_assemblers.get(packet.pid)
+        if assembler is None:
+            assembler = self.section_assemblers[packet.pid] = section_assembler()
+        return [section for section in assembler.add_packet(packet)
+                if self.section_cache.is_new(packet.pid, section)]
+
+    def _handle_psi(self, packet):
+        for section in self._new_sections(packet):
+            table_class = PSI_TABLES.get(ord(section[0]))
+            if table_class:
+                table = table_class(section, display=self.options['verbose'] >= 2)
+                self.table_handlers[table_class](packet.pid, table)
+
+    def _on_pat(self, pid, pat_section):
+        self.observer.on_pat(pat_section)
+        for info in pat_section.pmt_info:
             if info.program_num == 0x00:
                 self.nit_pid = info.program_pid
-                self.has_pat = True
             else:
                 self.pmt_pid = info.program_pid
-                self.has_pat = True
-                return
+                break
+        self.has_pat = True
 
-    def _handle_pmt(self, packet):
-        #if self.has_pmt:
-        #    return
-        pmt_packet = pmt(packet.data, display=self.options['verbose'] >= 2)
-        self.observer.on_pmt(self, pmt_packet)
+    def _on_pmt(self, pid, pmt_section):
+        if pid != self.pmt_pid:
+            return
+        self.observer.on_pmt(self, pmt_section)
         self.has_pmt = True
         self.scte35_pids = self.observer.get_scte35_pids()
 
-    def _handle_nit(self, packet):
-        if self.has_nit:
-            return
-        nit_packet = nit(packet.data, display=self.options['verbose'] >= 2)
+    def _on_nit(self, pid, nit_section):
         self.has_nit = True
 
-    def _handle_eit(self, packet):
-        if packet.payload_unit_start_indicator:
-            if self.eit_data:
-                eit_packet = eit(self.eit_data, display=self.options['verbose'] >= 2)
-            self.eit_data = packet.data
-        elif self.eit_data:
-            self.eit_data += packet.payload
+    def _on_eit(self, pid, eit_section):
+        pass
 
     def _handle_scte35(self, packet):
-        scte35 = SCTE35(packet.data, display=self.options['verbose'] >= 2)
-        print "SCTE35 parsed: %s" % scte35
+        if not self.section_assemblers.has_key(packet.pid):
+            self.section_assemblers[packet.pid] = section_assembler()
+        for section in self.section_assemblers[packet.pid].add_packet(packet):
+            if crc32_mpeg(section):
+                self.section_cache.nr_crc_errors += 1
+                log('CRC error in SCTE-35 section on pid {0}'.format(packet.pid))
+                continue
+            if self.options['verbose'] >= 2:
+                log('[SCTE-35 SECTION] pid=%d length=%d' % (packet.pid, len(section)))
+                log(dump_hex(section, 16))
+            try:
+                cue = scte35.parse_splice_info_section(section)
+            except (scte35.Scte35Error, struct.error) as e:
+                log('SCTE-35 parse error on pid {0}: {1}'.format(packet.pid, e))
+                continue
+            self.observer.on_scte35(self, packet.pid, cue)
 
 #
 # MPEG audio parser
 #
 class mpeg_audio_parser(object):
-    def __init__(self, display=False):
+    def __init__(self, display=False, wall_clock=True):
         self.display = display
+        self.wall_clock = wall_clock
 
     def add_pes(self, data, pts, dts):
         self.data = data
@@ -1254,8 +1253,9 @@ class mpeg_audio_parser(object):
             log('')
             log('[MPEG AUDIO PES] pts={0} dts={1}'.format(pts, dts))
 
-        time_now = datetime.datetime.utcnow()
-        t = time.mktime(time_now.timetuple()) + time_now.microsecond / 1000000.0
+        t = None
+        if self.wall_clock:
+            t = wall_clock()
         return [frame(data, True, t, self.pts, self.dts, 'A')]
 
 #
@@ -1453,18 +1453,22 @@ class SEIParser(object):
             cc_data['format'] = 'ATSC'
         return cc_data
 
-    def parse(self, nal_data, pts):
-        "Parse SEI NAL unit."
+    def parse(self, nal_data, pts, nal_header_len=1):
+        """Parse SEI NAL unit, starting with a 4-byte start code.
+
+        nal_header_len is 1 for H.264 and 2 for HEVC."""
 
+        payload_start = 4 + nal_header_len
         #log('nal_data: %d' % len(nal_data))
-        length, nal_data_2 = EBSPtoRBSP(nal_data, len(nal_data), 5)
+        length, nal_data_2 = EBSPtoRBSP(nal_data, len(nal_data), payload_start)
         #log('length=%d' %  len(nal_data_2))
         length2 = RBSPtoSODB(nal_data_2, length)
 
-        reader = bitreader(nal_data_2[5:])
+        reader = bitreader(nal_data_2[payload_start:])
 
         if self.display:
-            log('[H264 SEI] ({0} bytes) pts={1}'.format(len(nal_data), pts))
+            codec = 'H265' if nal_header_len == 2 else 'H264'
+            log('[{0} SEI] ({1} bytes) pts={2}'.format(codec, len(nal_data), pts))
         #log(dump_hex(nal_data, 16))
         #log(dump_hex(nal_data_2, 16))
 
@@ -1699,6 +1703,23 @@ class SCTEParser(UserDataParser):
                         log("WARNING: Cannot handle 608 field_number=%d" % field_number)
                 non_real_time_video_count = read_bits(reader, 4, '    non_real_time_video_count', display=self.display)
 
+def next_start_code(data, offset):
+    """Find the next Annex B start code at or after offset.
+
+    Returns the offset and length (3 or 4) of the start code, or (-1, 0) if
+    there is none with at least one byte of NAL unit header after it."""
+    pos = data.find('\x00\x00\x01', offset)
+    if pos < 0:
+        return -1, 0
+    if pos > offset and data[pos - 1] == '\x00':
+        pos -= 1
+        code_len = 4
+    else:
+        code_len = 3
+    if pos + 5 >= len(data):
+        return -1, 0
+    return pos, code_len
+
 #
 # H264 parser
 #
@@ -1714,20 +1735,7 @@ class h264_parser(object):
         return self.sei_parser.ATSC_parser.get_cc_summary()
 
     def next_start_code(self, data, offset):
-        while offset + 5 < len(data):
-            code = (ord(data[offset]) == 0x00) and \
-                   (ord(data[offset + 1]) == 0x00) and \
-                   (ord(data[offset + 2]) == 0x00) and \
-                   (ord(data[offset + 3]) == 0x01)
-            code2 = (ord(data[offset]) == 0x00) and \
-                    (ord(data[offset + 1]) == 0x00) and \
-                    (ord(data[offset + 2]) == 0x01)
-            if code == 1:
-                return offset, 4
-            elif code2 == 1:
-                return offset, 3
-            offset += 1
-        return -1, 0
+        return next_start_code(data, offset)
 
     def print_nal_unit_types(self, data):
         offset = 0
@@ -1884,6 +1892,168 @@ class h264_parser(object):
             frames.append(self.construction_frame)
         return frames
 
+#
+# HEVC (H.265) parser
+#
+HEVC_NAL_BLA_W_LP = 16
+HEVC_NAL_RSV_IRAP_23 = 23
+HEVC_NAL_VPS = 32
+HEVC_NAL_SPS = 33
+HEVC_NAL_PPS = 34
+HEVC_NAL_AUD = 35
+HEVC_NAL_EOS = 36
+HEVC_NAL_EOB = 37
+HEVC_NAL_FD = 38
+HEVC_NAL_PREFIX_SEI = 39
+HEVC_NAL_SUFFIX_SEI = 40
+
+HEVC_SLICE_TYPES = {0 : 'B', 1 : 'P', 2 : 'I'}
+
+def remove_emulation_prevention(data):
+    "Drop emulation prevention bytes. Good enough for short headers."
+    return data.replace('\x00\x00\x03', '\x00\x00')
+
+class h265_parser(object):
+    """Parser of HEVC elementary streams.
+
+    Pictures are delimited by first_slice_segment_in_pic_flag. IRAP pictures
+    (BLA, IDR and CRA) are marked as sync frames. The slice type is read from
+    the first slice segment header, using the PPS fields that precede it."""
+
+    def __init__(self, display=False, cc_basename=None, wall_clock=True):
+        self.display = display
+        self.wall_clock = wall_clock
+        self.construction_frame = None
+        self.construction_nals = []
+        self.data = ''
+        self.pts = 0
+        self.times = []
+        self.pps = {}
+        self.sei_parser = SEIParser(display, cc_basename)
+
+    def get_cc_summary(self):
+        return self.sei_parser.ATSC_parser.get_cc_summary()
+
+    def add_pes(self, data, pts, dts, flush=False):
+        if pts > -1 and not self.sei_parser.ATSC_parser.has_pts_offset():
+            self.sei_parser.ATSC_parser.set_pts_offset(pts)
+
+        self.data += data
+        if pts > -1:
+            self.pts = pts
+            self.times.append([pts, dts])
+        if len(self.times) > 2:
+            self.times.remove(self.times[0])
+            log('TOO MANY PTS, DTS, REMOVE FIRST')
+
+        frames = []
+        offset, code_len = next_start_code(self.data, 0)
+        if offset < 0:
+            return frames
+
+        while offset >= 0:
+            next_offset, next_code_len = next_start_code(self.data, offset + code_len)
+            if next_offset < 0:
+                if not flush:
+                    break
+                end = len(self.data)
+            else:
+                end = next_offset
+            self.parse_nal_unit(self.data[offset:end], code_len, frames)
+            offset, code_len = next_offset, next_code_len
+
+        if offset >= 0:
+            self.data = self.data[offset:]
+        else:
+            self.data = ''
+
+        return frames
+
+    def parse_nal_unit(self, nal_data, code_len, frames):
+        nal_type = (ord(nal_data[code_len]) >> 1) & 0x3f
+
+        if nal_type < HEVC_NAL_VPS:
+            # VCL NAL unit
+            if len(nal_data) > code_len + 2 and ord(nal_data[code_len + 2]) & 0x80:
+                self.start_picture(nal_data, code_len, nal_type, frames)
+            if self.construction_frame:
+                self.construction_nals.append(nal_data)
+        elif nal_type == HEVC_NAL_PREFIX_SEI or nal_type == HEVC_NAL_SUFFIX_SEI:
+            if code_len == 3:
+                nal_data = '\x00' + nal_data
+            self.sei_parser.parse(nal_data, self.pts, nal_header_len=2)
+        elif nal_type == HEVC_NAL_PPS:
+            self.parse_pps(nal_data[code_len + 2:])
+            if self.display:
+                log('[PPS]: %s' % binascii.b2a_base64(nal_data[code_len:]).strip())
+        elif nal_type == HEVC_NAL_VPS or nal_type == HEVC_NAL_SPS:
+            if self.display:
+                name = nal_type == HEVC_NAL_VPS and 'VPS' or 'SPS'
+                log('[%s]: %s' % (name, binascii.b2a_base64(nal_data[code_len:]).strip()))
+        elif HEVC_NAL_AUD <= nal_type <= HEVC_NAL_FD:
+            # Delimiters and filler data
+            pass
+        else:
+            log('Unknown HEVC NAL type={0}'.format(nal_type))
+
+    def parse_pps(self, rbsp):
+        reader = bitreader(remove_emulation_prevention(rbsp[:16]))
+        pps_id = ue(reader)
+        ue(reader) # pps_seq_parameter_set_id
+        dependent_slice_segments_enabled_flag = reader.get_bits(1)
+        reader.get_bits(1) # output_flag_present_flag
+        num_extra_slice_header_bits = reader.get_bits(3)
+        self.pps[pps_id] = (dependent_slice_segments_enabled_flag, num_extra_slice_header_bits)
+
+    def start_picture(self, nal_data, code_len, nal_type, frames):
+        # if we have a complete frame, store it
+        self.complete_picture(frames)
+
+        sync = HEVC_NAL_BLA_W_LP <= nal_type <= HEVC_NAL_RSV_IRAP_23
+
+        reader = bitreader(remove_emulation_prevention(nal_data[code_len + 2 : code_len + 18]))
+        reader.get_bits(1) # first_slice_segment_in_pic_flag
+        if sync:
+            reader.get_bits(1) # no_output_of_prior_pics_flag
+        pps_id = ue(reader)
+        frame_type = 'unknown'
+        if self.pps.has_key(pps_id):
+            # dependent_slice_segment_flag and slice_segment_address are only
+            # present in non-first slice segments
+            reader.get_bits(self.pps[pps_id][1]) # slice_reserved_flag
+            slice_type = ue(reader)
+            frame_type = HEVC_SLICE_TYPES.get(slice_type, 'unknown')
+
+        if self.times:
+            time_data = self.times.pop(0)
+        else:
+            time_data = [-1, -1]
+
+        if self.display:
+            log('')
+            log('[HEVC SLICE] (%d bytes)' % len(nal_data))
+            log('  nal unit type          : %s' % nal_type)
+            log('  slice type             : %s' % frame_type)
+            log('  pts                    :%s (%.3fs)' % (time_data[0], time_data[0] / 90000.0))
+            log('  dts                    :%s (%.3fs)' % (time_data[1], time_data[1] / 90000.0))
+
+        t = None
+        if self.wall_clock:
+            t = wall_clock()
+        self.construction_frame = frame('', sync, t, time_data[0], time_data[1], frame_type)
+
+    def complete_picture(self, frames):
+        if self.construction_frame:
+            self.construction_frame.data = ''.join(self.construction_nals)
+            frames.append(self.construction_frame)
+            self.construction_frame = None
+            self.construction_nals = []
+
+    def flush(self):
+        frames = self.add_pes('', -1, -1, flush=True)
+        self.complete_picture(frames)
+        return frames
+
 SampleRates = {0 : 96000,
                1 : 88200,
                2 : 64000,
@@ -1899,43 +2069,133 @@ SampleRates = {0 : 96000,
                12 : 7350}
 
 #
-# AAC parser - ADTS
+# Audio framer
 #
-class aac_parser_adts(object):
-    def __init__(self, display=False):
+class audio_framer(object):
+    """Base class for parsers splitting PES payloads into audio frames.
+
+    The payloads are appended to a buffer which is walked with a read
+    cursor. The consumed head of the buffer is only dropped when more than
+    half of it has been read, so each byte is copied a bounded number of
+    times. The PES PTS is given to the first frame starting in that PES,
+    and the PTS of the following frames is interpolated from the number of
+    samples per frame and the sample rate.
+
+    Subclasses implement frame_length() and frame_payloads()."""
+
+    def __init__(self, display=False, wall_clock=True):
         self.display = display
+        self.wall_clock = wall_clock
         self.data = ''
+        self.pos = 0
+        self.pes_pos = -1
+        self.pes_pts = 0
+        self.pes_dts = 0
+        self.base_pts = 0
+        self.base_dts = 0
+        self.nr_samples = 0
+        self.sample_rate = 0
 
     def add_pes(self, data, pts, dts):
+        if self.pos > len(self.data) / 2:
+            self.compact()
+        self.pes_pos = len(self.data)
+        self.pes_pts = pts
+        self.pes_dts = dts or pts
         self.data += data
-        frames = []
 
-        done = False
-        while not done:
-            if len(self.data) < 7:
-                break
+        t = None
+        if self.wall_clock:
+            t = wall_clock()
 
-            aac_frame_len = ((ord(self.data[3]) & 0x3) << 11) + (ord(self.data[4]) << 3) + ((ord(self.data[5]) & 0xe0) >> 5)
-            if aac_frame_len == 0:
-                # Check why this happens
-                log("WARNING: aac_frame_len == 0, but %d data bytes remain" % len(self.data))
-                break
-            if len(self.data) >= aac_frame_len:
-                frame_data = self.data[0:aac_frame_len]
-                self.parse_frame(frame_data, pts, dts)
-                time_now = datetime.datetime.utcnow()
-                t = time.mktime(time_now.timetuple()) + time_now.microsecond / 1000000.0
-                frames.append(frame(frame_data[7:], True, t, pts, dts, 'audio'))
-                self.data = self.data[aac_frame_len:]
-            else:
+        frames = []
+        while True:
+            frame_len = self.frame_length(self.data, self.pos)
+            if frame_len is None or self.pos + frame_len > len(self.data):
                 break
+            if frame_len <= 0:
+                self.resync()
+                continue
+
+            if 0 <= self.pes_pos <= self.pos:
+                self.base_pts = self.pes_pts
+                self.base_dts = self.pes_dts
+                self.nr_samples = 0
+                self.pes_pos = -1
+
+            for payload, nr_samples, sample_rate in self.frame_payloads(self.data, self.pos, frame_len):
+                if sample_rate != self.sample_rate:
+                    # Restart the interpolation at the new rate
+                    if self.sample_rate:
+                        offset = (self.nr_samples * 90000) // self.sample_rate
+                        self.base_pts += offset
+                        self.base_dts += offset
+                    self.nr_samples = 0
+                    self.sample_rate = sample_rate
+                offset = (self.nr_samples * 90000) // self.sample_rate
+                frames.append(frame(payload, True, t, self.base_pts + offset, self.base_dts + offset, self.frame_type))
+                self.nr_samples += nr_samples
+            self.pos += frame_len
 
         return frames
 
-    def parse_frame(self, data, pts, dts):
+    def compact(self):
+        "Drop the consumed part of the buffer."
+        self.data = self.data[self.pos:]
+        if self.pes_pos >= 0:
+            self.pes_pos = max(self.pes_pos - self.pos, 0)
+        self.pos = 0
+
+    def resync(self):
+        "Skip to the next possible frame start after a sync loss."
+        pos = self.data.find(self.sync_byte, self.pos + 1)
+        if pos < 0:
+            pos = len(self.data)
+        log('WARNING: {0} lost sync, skipping {1} bytes'.format(self.frame_type, pos - self.pos))
+        self.pos = pos
+
+    def frame_length(self, data, pos):
+        """Return the length of the frame starting at pos, None if more data is needed,
+        or 0 if there is no valid frame header at pos. Must be overridden by subclass."""
+
+    def frame_payloads(self, data, pos, frame_len):
+        """Return a list of (payload, nr_samples, sample_rate) for the frame at pos.
+        Must be overridden by subclass."""
+
+#
+# AAC parser - ADTS
+#
+class aac_parser_adts(audio_framer):
+    frame_type = 'audio'
+    sync_byte = '\xff'
+
+    def frame_length(self, data, pos):
+        if len(data) - pos < 7:
+            return None
+        if ord(data[pos]) != 0xff or ord(data[pos + 1]) & 0xf0 != 0xf0:
+            return 0
+        aac_frame_len = ((ord(data[pos + 3]) & 0x3) << 11) + (ord(data[pos + 4]) << 3) + ((ord(data[pos + 5]) & 0xe0) >> 5)
+        if aac_frame_len < 7:
+            return 0
+        return aac_frame_len
+
+    def frame_payloads(self, data, pos, frame_len):
+        protection_absent = ord(data[pos + 1]) & 0x01
+        sampling_frequency_index = (ord(data[pos + 2]) >> 2) & 0x0f
+        nr_raw_data_blocks = ord(data[pos + 6]) & 0x03
+        header_len = 7
+        if protection_absent == 0:
+            header_len = 9
+        if self.display:
+            self.parse_frame(data[pos : pos + frame_len])
+        return [(data[pos + header_len : pos + frame_len],
+                 1024 * (nr_raw_data_blocks + 1),
+                 SampleRates.get(sampling_frequency_index, 48000))]
+
+    def parse_frame(self, data):
         if self.display:
             log('')
-            log('[AAC ADTS frame] {0} bytes pts={1} dts={2}'.format(len(data), pts, dts))
+            log('[AAC ADTS frame] {0} bytes'.format(len(data)))
 
         #with open('sample_he_v2.aac', 'w') as f:
         #    f.write(data)
@@ -2036,76 +2296,56 @@ class aac_parser_adts(object):
 #
 # AAC parser - LATM
 #
-class aac_parser_latm(object):
-    def __init__(self, display=False):
-        self.display = display
-        self.data = ''
-        self.sampling_frequency_index = 0
+class aac_parser_latm(audio_framer):
+    frame_type = 'audio'
+    sync_byte = '\x56'
 
-    def add_pes(self, data, pts, dts):
-
-        self.data += data
-        frames = []
-
-        reader = bitreader(self.data)
-        done = False
-        while not done:
-            if len(self.data) < 2:
-                break
-
-            if self.display:
-                log('')
-                log('[AAC LATM frame] {0} bytes pts={1} dts={2}'.format(len(data), pts, dts))
-
-            sync_word = read_bits(reader, 11, '  sync word', self.display, to_hex=True)
-            if sync_word != 0x2b7:
-                log('Bad sync word, clear buffer')
-                data = ''
-                break
-
-            audio_mux_length_bytes = read_bits(reader, 13, '  audio mux length bytes', self.display)
-            if audio_mux_length_bytes > len(self.data):
-                break
-
-            audio_mux_data = reader.step_bytes(audio_mux_length_bytes)
-            self.data = self.data[audio_mux_length_bytes+3:]
-            f, pos = self.parse_audio_mux_element(audio_mux_data, pts, dts)
-            frames += f
-            if pos!= len(data) - 2:
-                raise Exception('Bad AAC LATM frame data')
-
-        return frames
+    def __init__(self, display=False, wall_clock=True):
+        audio_framer.__init__(self, display, wall_clock)
+        self.sampling_frequency_index = 0
+        self.num_sub_frames = 0
+
+    def frame_length(self, data, pos):
+        if len(data) - pos < 3:
+            return None
+        sync_word = (ord(data[pos]) << 3) | (ord(data[pos + 1]) >> 5)
+        if sync_word != 0x2b7:
+            return 0
+        audio_mux_length_bytes = ((ord(data[pos + 1]) & 0x1f) << 8) | ord(data[pos + 2])
+        return audio_mux_length_bytes + 3
+
+    def frame_payloads(self, data, pos, frame_len):
+        if self.display:
+            log('')
+            log('[AAC LATM frame] {0} bytes'.format(frame_len))
+        payloads, end = self.parse_audio_mux_element(data[pos + 3 : pos + frame_len])
+        if end - 1 > frame_len - 3:
+            log('WARNING: AAC LATM audio mux element overrun')
+        sample_rate = SampleRates[self.sampling_frequency_index]
+        return [(payload, 1024, sample_rate) for payload in payloads]
 
     def require(self, a, b, desc):
         if a != b:
             msg = 'Pase Failure, {0} != {1} for {2}'.format(str(a), str(b), desc)
             raise Exception(msg)
 
-    def parse_audio_mux_element(self, data, pts, dts):
+    def parse_audio_mux_element(self, data):
         if self.display:
             log('    [Audio Mux Element]')
         reader = bitreader(data)
         use_same_stream_mux = read_bits(reader, 1, '    use same stream mux', self.display)
-        num_sub_frames = 0
         if not use_same_stream_mux:
-            num_sub_frames = self.parse_stream_mux_config(reader)
+            self.num_sub_frames = self.parse_stream_mux_config(reader)
 
-        frames = []
-        time_now = datetime.datetime.utcnow()
-        t = time.mktime(time_now.timetuple()) + time_now.microsecond / 1000000.0
-        offset = 0
-        for i in range(0, num_sub_frames+1):
+        payloads = []
+        for i in range(0, self.num_sub_frames+1):
             if self.display:
                 log('      [Subframe {0}]'.format(i))
             length = self.parse_patyload_length_info(reader)
-            frame_data = self.parse_patyload_mux(reader, length)
-
-            # Create audio frame
-            frames.append(frame(frame_data, True, t, pts + offset, dts, 'audio'))
-            offset += (1024 * 90000) / SampleRates[self.sampling_frequency_index]
+            payloads.append(self.parse_patyload_mux(reader, length))
 
         #log('data at pos', reader.tell())
-        return frames, reader.tell()
+        return payloads, reader.tell()
 
     def parse_stream_mux_config(self, reader):
         num_sub_frames = 0
@@ -2196,24 +2436,61 @@ def hamming_8_4(value, bits):
 #
 # AC3 parser
 #
-class ac3_parser(object):
-    def __init__(self, display=False):
-        self.display = display
-        self.data = ''
-
-    def add_pes(self, data, pts, dts):
-        frames = []
-
-        #log(dump_hex(data, 16))
-
-        reader = bitreader(data)
-        read_bits(reader,  16, '  sync word', self.display, to_hex = True)
-
-        time_now = datetime.datetime.utcnow()
-        t = time.mktime(time_now.timetuple()) + time_now.microsecond / 1000000.0
-        frames.append(frame(data, True, t, pts, dts, 'audio AC3'))
-
-        return frames
+AC3SampleRates = (48000, 44100, 32000)
+
+# Words (16 bits) per AC-3 syncframe indexed by frmsizecod, one list per fscod
+# ATSC A/52 Table 5.18
+AC3FrameSizes = (
+    (64, 64, 80, 80, 96, 96, 112, 112, 128, 128, 160, 160, 192, 192, 224, 224,
+     256, 256, 320, 320, 384, 384, 448, 448, 512, 512, 640, 640, 768, 768,
+     896, 896, 1024, 1024, 1152, 1152, 1280, 1280),
+    (69, 70, 87, 88, 104, 105, 121, 122, 139, 140, 174, 175, 208, 209, 243, 244,
+     278, 279, 348, 349, 417, 418, 487, 488, 557, 558, 696, 697, 835, 836,
+     975, 976, 1114, 1115, 1253, 1254, 1393, 1394),
+    (96, 96, 120, 120, 144, 144, 168, 168, 192, 192, 240, 240, 288, 288, 336, 336,
+     384, 384, 480, 480, 576, 576, 672, 672, 768, 768, 960, 960, 1152, 1152,
+     1344, 1344, 1536, 1536, 1728, 1728, 1920, 1920))
+
+EAC3BlocksPerFrame = (1, 2, 3, 6)
+
+class ac3_parser(audio_framer):
+    "Parser of AC-3 and E-AC-3 syncframes."
+    frame_type = 'audio AC3'
+    sync_byte = '\x0b'
+
+    def frame_length(self, data, pos):
+        if len(data) - pos < 6:
+            return None
+        if ord(data[pos]) != 0x0b or ord(data[pos + 1]) != 0x77:
+            return 0
+        bsid = ord(data[pos + 5]) >> 3
+        if bsid <= 10:
+            fscod = ord(data[pos + 4]) >> 6
+            frmsizecod = ord(data[pos + 4]) & 0x3f
+            if fscod == 3 or frmsizecod >= len(AC3FrameSizes[0]):
+                return 0
+            return 2 * AC3FrameSizes[fscod][frmsizecod]
+        # E-AC-3
+        frmsiz = ((ord(data[pos + 2]) & 0x07) << 8) | ord(data[pos + 3])
+        return 2 * (frmsiz + 1)
+
+    def frame_payloads(self, data, pos, frame_len):
+        if self.display:
+            log('')
+            log('[AC3 frame] {0} bytes'.format(frame_len))
+        bsid = ord(data[pos + 5]) >> 3
+        fscod = ord(data[pos + 4]) >> 6
+        nr_samples = 1536
+        if bsid > 10:
+            if fscod == 3:
+                fscod = (ord(data[pos + 4]) >> 4) & 0x03
+                sample_rate = AC3SampleRates[fscod] / 2
+            else:
+                sample_rate = AC3SampleRates[fscod]
+                nr_samples = 256 * EAC3BlocksPerFrame[(ord(data[pos + 4]) >> 4) & 0x03]
+        else:
+            sample_rate = AC3SampleRates[fscod]
+        return [(data[pos : pos + frame_len], nr_samples, sample_rate)]
 
 #
 # TeleText EBU Parser
@@ -2588,12 +2865,17 @@ class parser_observer(observer):
         self.mpeg_video_pid = -1
         self.mpeg_audio_pid = -1
         self.h264_pid = -1
+        self.h265_pid = -1
         self.aac_pid = -1
         self.ac3_pid = -1
         self.teletext_pid = -1
         self.dvb_pid = -1
         self.metadata_pid = -1
         self.scte35_pids = set()
+        self.scte35_writer = None
+        # Cues received before the first PES, waiting for the first PTS
+        self.pending_cues = []
+        self.importer = None
         self.options = options
 
         # If video data should be logged
@@ -2619,12 +2901,25 @@ class parser_observer(observer):
         else:
             cc_basename = None
 
+        # If frames should be stamped with wall-clock time
+        if options.has_key('wall_clock'):
+            wall_clock = options['wall_clock']
+        else:
+            wall_clock = True
+
+        # Where and how SCTE-35 cues should be written
+        if options.get('scte35_output'):
+            writer_class = scte35.EVENT_WRITERS[options.get('scte35_format', 'json')]
+            self.scte35_file = open(options['scte35_output'], 'wb')
+            self.scte35_writer = writer_class(self.scte35_file)
+
         # Create some codec parsers
         self.h264_parser = h264_parser(display=self.video_display, cc_basename=cc_basename)
+        self.h265_parser = h265_parser(display=self.video_display, cc_basename=cc_basename, wall_clock=wall_clock)
         self.mpeg_video_parser = mpeg_video_parser(display=self.video_display, cc_basename=cc_basename)
-        self.aac_parser = aac_parser_adts(display=self.audio_display)
-        self.ac3_parser = ac3_parser(display=self.audio_display)
-        self.mpeg_audio_parser = mpeg_audio_parser(display=self.audio_display)
+        self.aac_parser = aac_parser_adts(display=self.audio_display, wall_clock=wall_clock)
+        self.ac3_parser = ac3_parser(display=self.audio_display, wall_clock=wall_clock)
+        self.mpeg_audio_parser = mpeg_audio_parser(display=self.audio_display, wall_clock=wall_clock)
 
     def on_pat(self, pat):
         pass
@@ -2641,6 +2936,9 @@ class parser_observer(observer):
                 self.h264_pid = stream.elementary_pid
                 importer.observe_pid(stream.elementary_pid)
                 #pass
+            elif stream.stream_type == STREAM_TYPE_HEVC:
+                self.h265_pid = stream.elementary_pid
+                importer.observe_pid(stream.elementary_pid)
             elif stream.stream_type == STREAM_TYPE_AAC or stream.stream_type == STREAM_TYPE_AUDIO_ADTS:
                 self.aac_pid = stream.elementary_pid
                 importer.observe_pid(stream.elementary_pid)
@@ -2667,6 +2965,8 @@ class parser_observer(observer):
                             importer.observe_pid(stream.elementary_pid)
 
     def on_pes(self, pid, pes):
+        if self.pending_cues:
+            self.write_pending_cues()
         if pid == self.mpeg_video_pid:
             frames = self.mpeg_video_parser.add_pes(pes.payload, pes.pts, pes.dts)
             if self.options['verbose'] > 0:
@@ -2682,6 +2982,11 @@ class parser_observer(observer):
             if self.options['verbose'] > 0:
                 for frame in frames:
                     log(frame)
+        elif pid == self.h265_pid:
+            frames = self.h265_parser.add_pes(pes.payload, pes.pts, pes.dts)
+            if self.options['verbose'] > 0:
+                for frame in frames:
+                    log(frame)
         elif pid == self.aac_pid:
             frames = self.aac_parser.add_pes(pes.payload, pes.pts, pes.dts)
             if self.options['verbose'] > 0:
@@ -2704,11 +3009,37 @@ class parser_observer(observer):
             id3_parser(pes.payload, pes.pts, pes.dts, display=self.text_display)
             #pass
 
+    def on_scte35(self, importer, pid, cue):
+        self.importer = importer
+        if importer.first_pts == 0:
+            # Media time is relative to the first PTS, which is not known yet
+            self.pending_cues.append((pid, cue))
+            return
+        self.write_cue(pid, cue)
+
+    def write_cue(self, pid, cue):
+        first_pts = self.importer.first_pts
+        log('SCTE35 on pid {0}: {1}'.format(pid, scte35.cue_summary(cue, first_pts)))
+        if self.scte35_writer:
+            self.scte35_writer.write(cue, first_pts)
+
+    def write_pending_cues(self):
+        "Write the cues held until the first PTS, or until the end if there is none."
+        pending, self.pending_cues = self.pending_cues, []
+        for pid, cue in pending:
+            self.write_cue(pid, cue)
+
     def flush(self):
+        self.write_pending_cues()
         frames = self.h264_parser.flush()
+        frames += self.h265_parser.flush()
         if self.options['verbose'] > 0:
             for frame in frames:
                 log(frame)
+        if self.scte35_writer:
+            self.scte35_writer.close()
+            self.scte35_file.close()
+            self.scte35_writer = None
 
     def get_scte35_pids(self):
         return self.scte35_pids
@@ -2721,19 +3052,23 @@ class key_frame_observer(observer):
         self.key_frames = []
         self.data_file = None
         self.h264_parser = h264_parser(display=False)
+        self.h265_parser = h265_parser(display=False)
+        self.video_parser = self.h264_parser
 
     def on_pat(self, pat):
         pass
 
     def on_pmt(self, importer, pmt):
         for stream in pmt.stream_list:
-            if stream.stream_type == 0x1b:
+            if stream.stream_type in (STREAM_TYPE_H264, STREAM_TYPE_HEVC):
                 if stream.elementary_pid != pmt.pcr_pid:
                     raise Exception('Video pid must have PCR')
+                if stream.stream_type == STREAM_TYPE_HEVC:
+                    self.video_parser = self.h265_parser
                 importer.observe_pid(stream.elementary_pid)
 
     def on_pes(self, pid, pes):
-        frames = self.h264_parser.add_pes(pes.payload, pes.pts, pes.dts)
+        frames = self.video_parser.add_pes(pes.payload, pes.pts, pes.dts)
         for frame in frames:
             if frame.sync:
                 log(frame)
@@ -2745,17 +3080,42 @@ class key_frame_observer(observer):
                         for key_frame in self.key_frames:
                             file.write(str(key_frame) + '\n')
 
-def handle_http(url, importer):
-    parts = urlparse.urlsplit(url)
-    conn = httplib.HTTPConnection(parts.netloc, timeout=10)
-    conn.set_debuglevel(3)
-    conn.connect()
-    conn.request('GET', parts.path)
-    data = conn.getresponse().read()
-    importer.preflight(data)
+def handle_http(url, nr_bytes_to_read, importer):
+    """Stream url in chunks over a pooled keep-alive connection, feeding whole TS packets.
+
+    As in handle_file, up to 188*100000 bytes are searched for the PAT and PMT
+    before the first data is parsed."""
     global cc_map
-    cc_map.clear()
-    importer.add_data(data)
+    preflight_bytes = 188*100000
+    if nr_bytes_to_read > 0:
+        preflight_bytes = min(preflight_bytes, nr_bytes_to_read)
+    pending = ''
+    preflight_chunks = []
+    nr_preflight_bytes = 0
+    for chunk in httpio.iter_chunks(url, max_bytes=nr_bytes_to_read):
+        data = pending + chunk
+        nr_packets_bytes = len(data) - len(data) % 188
+        data, pending = data[:nr_packets_bytes], data[nr_packets_bytes:]
+        if not data:
+            continue
+        if preflight_chunks is not None:
+            preflight_chunks.append(data)
+            nr_preflight_bytes += len(data)
+            try:
+                if not importer.preflight(data, final=nr_preflight_bytes >= preflight_bytes):
+                    continue
+            except Exception, e:
+                print 'preflight error:', e
+                importer.report()
+                return
+            data = ''.join(preflight_chunks)
+            preflight_chunks = None
+            cc_map.clear()
+        importer.add_data(data)
+    if preflight_chunks is not None:
+        print 'preflight error: stream ended before pat/pmt were found'
+        importer.report()
+        return
     importer.flush()
 
 def handle_file(filename, nr_bytes_to_read, importer):
@@ -2814,6 +3174,9 @@ def main():
     parser.add_option('-T', '--text', help='display text/metadata details', action='store_true', default=False, dest='text')
     parser.add_option('-s', '--silent', help='silent (suppress log printout)', action='store_true', default=False, dest='silent')
     parser.add_option('-p', '--packets', help='max nr TS packets to parse [default: %default]', action='store', default=-1, dest='max_nr_packets')
+    parser.add_option('--scte35-output', help='write SCTE-35 cues to file', action='store', default='', dest='scte35_output')
+    parser.add_option('--scte35-format', help='format of SCTE-35 output: json, emsg or mpd [default: %default]', type='choice', choices=sorted(scte35.EVENT_WRITERS.keys()), default='json', dest='scte35_format')
+    parser.add_option('-W', '--no-wall-clock', help='do not stamp audio frames with wall-clock time', action='store_false', default=True, dest='wall_clock')
 
     # parse and validate options
     (opts, args) = parser.parse_args()
@@ -2833,6 +3196,9 @@ def main():
     options['audio'] = opts.audio
     options['text'] = opts.text
     options['verbose'] = opts.verbose
+    options['wall_clock'] = opts.wall_clock
+    options['scte35_output'] = opts.scte35_output
+    options['scte35_format'] = opts.scte35_format
     max_nr_packets = int(opts.max_nr_packets)
 
     if max_nr_packets > 0:
@@ -2853,7 +3219,7 @@ def main():
         uri = args[0]
         data = None
         if uri.find('http') == 0:
-            handle_http(uri, importer)
+            handle_http(uri, nr_bytes_to_read, importer)
             importer.report()
         else:
             handle_file(uri, nr_bytes_to_read, importer)
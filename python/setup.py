@@ -19,6 +19,7 @@ console_scripts = [
     'dash-ondemand-add-subtitles=dash_tools.ondemand_add_subs:main',
     'dash-track-resegmenter=dash_tools.track_resegmenter:main',
     'dash-batch-encoder=dash_tools.batch_encoder:main',
+    'dash-pipeline=dash_tools.pipeline:main',
     'dash-livedownloader=dash_tools.livedownloader:main'
 ]
 